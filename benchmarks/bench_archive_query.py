@@ -0,0 +1,135 @@
+"""
+Benchmark of cross-plant archive queries: pandas concat-and-filter against `archive_query`.
+
+A month of daily archive files with manifests is written to the S3 stand-in. Two
+questions are then answered both ways: how often each plant's soil moisture was below
+20% over the month, and one plant's readings over a week. The pandas approach downloads
+every daily file, concatenates them and filters the frame, as ad hoc scripts did. The
+query layer scans the files in place with projection, filter pushdown and threads.
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "pipeline"))
+# pylint: disable=wrong-import-position
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from pyarrow import fs
+import archive_catalog
+import archive_query
+from stand_ins import S3StandIn, PLANT_NAMES
+
+BUCKET = "benchmark-bucket"
+PREFIX = "plant_data/"
+DRY_BELOW = 20.0
+
+
+def write_month(s3: S3StandIn, directory: str, days: int, plant_count: int,
+                readings_per_day: int, first_day: str = "2024-11-01") -> int:
+    """Write `days` daily archive files with manifests and return the rows written."""
+    rng = np.random.default_rng(0)
+    rows = 0
+    for day in pd.date_range(first_day, periods=days, freq="D"):
+        times = pd.date_range(day, periods=readings_per_day,
+                              freq=pd.Timedelta(days=1) / readings_per_day)
+        plant_ids = np.tile(np.arange(1, plant_count + 1), len(times))
+        count = len(plant_ids)
+        frame = pd.DataFrame({
+            "plant_id": plant_ids,
+            "plant_name": [PLANT_NAMES[plant_id % len(PLANT_NAMES)] for plant_id in plant_ids],
+            "soil_moisture": rng.uniform(0, 100, count),
+            "temperature": rng.normal(15, 3, count),
+            "last_watered": np.repeat(times - pd.Timedelta(hours=6), plant_count),
+            "recording_at": np.repeat(times, plant_count),
+            "botanist_first_name": "Carl",
+            "botanist_last_name": "Linnaeus",
+            "botanist_email": "carl.linnaeus@lnhm.co.uk",
+            "botanist_phone": "(146)994-1635x35992",
+        })
+        key = f"{PREFIX}{day:%Y-%m-%d}.parquet"
+        path = os.path.join(directory, "archive.parquet")
+        archive_catalog.write_archive(frame, path)
+        s3.upload_file(path, BUCKET, key)
+        s3.put_object(Bucket=BUCKET, Key=archive_catalog.manifest_key(key),
+                      Body=json.dumps(archive_catalog.build_manifest(path, key)))
+        rows += count
+    return rows
+
+
+def pandas_frame(s3: S3StandIn) -> pd.DataFrame:
+    """Every daily file downloaded and concatenated, as ad hoc scripts do."""
+    keys = [key for key in archive_catalog.list_keys(s3, BUCKET, PREFIX)
+            if key.endswith(".parquet")]
+    return pd.concat([pd.read_parquet(io.BytesIO(
+        s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())) for key in keys],
+        ignore_index=True)
+
+
+def pandas_dry_counts(s3: S3StandIn, start, end) -> pd.Series:
+    """Readings below DRY_BELOW per plant, with pandas."""
+    frame = pandas_frame(s3)
+    frame = frame[(frame["recording_at"] >= start) & (frame["recording_at"] < end)]
+    return (frame["soil_moisture"] < DRY_BELOW).groupby(frame["plant_id"]).sum()
+
+
+def pandas_plant_readings(s3: S3StandIn, plant_id: int, start, end) -> pd.DataFrame:
+    """One plant's readings, with pandas."""
+    frame = pandas_frame(s3)
+    return frame[(frame["plant_id"] == plant_id) & (frame["recording_at"] >= start)
+                 & (frame["recording_at"] < end)][["recording_at", "soil_moisture"]]
+
+
+def timed(function, *args):
+    """Return the result of a call and the seconds it took."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    """Time both approaches and check they agree."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--readings-per-day", type=int, default=1440)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        s3 = S3StandIn(os.path.join(directory, "s3"))
+        rows = write_month(s3, directory, args.days, args.plants, args.readings_per_day)
+        catalog = archive_catalog.ArchiveCatalog(s3, BUCKET, PREFIX).refresh()
+        query = archive_query.ArchiveQuery(catalog, fs.SubTreeFileSystem(
+            s3.root, fs.LocalFileSystem()))
+        start, end = catalog.time_range()[0].floor("D"), catalog.time_range()[1].ceil("D")
+        week_start, week_end = start + pd.Timedelta(days=7), start + pd.Timedelta(days=14)
+        print(f"{args.days} days, {args.plants} plants, {rows:,} rows")
+        print(f"{'question':<24} {'pandas s':>9} {'query s':>9} {'speed-up':>9}")
+
+        expected, pandas_seconds = timed(pandas_dry_counts, s3, start, end)
+        summary, query_seconds = timed(
+            lambda: query.plant_summary(start, end, DRY_BELOW))
+        assert summary.set_index("plant_id")["dry_readings"].sort_index().tolist() \
+            == expected.sort_index().tolist()
+        print(f"{'dry readings per plant':<24} {pandas_seconds:>9.2f} {query_seconds:>9.2f} "
+              f"{pandas_seconds / query_seconds:>8.1f}x")
+
+        expected, pandas_seconds = timed(pandas_plant_readings, s3, 1, week_start, week_end)
+        table, query_seconds = timed(
+            lambda: query.scan(["recording_at", "soil_moisture"], [1], week_start, week_end,
+                               ds.field("soil_moisture").is_valid()))
+        assert table.num_rows == len(expected)
+        print(f"{'one plant for a week':<24} {pandas_seconds:>9.2f} {query_seconds:>9.2f} "
+              f"{pandas_seconds / query_seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of the chart payloads against charting raw readings.
+
+For each standard window, one plant's chart data is prepared both ways: from the raw
+readings, parsed, sorted and filtered as the dashboard used to, and from the pipeline's
+payload. The JSON embedded in each chart is measured too. The cost of the minute
+pipeline merging one batch into the payloads of every plant is also timed.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "pipeline"))
+# pylint: disable=wrong-import-position
+import numpy as np
+import pandas as pd
+import chart_payloads
+from stand_ins import PLANT_NAMES
+
+NOW = pd.Timestamp("2024-11-27 12:00")
+
+
+def week_of_readings(plant_count: int) -> pd.DataFrame:
+    """One reading per minute per plant over the last 7 days, timestamps as strings."""
+    times = pd.date_range(end=NOW, periods=7 * 1440, freq="min")
+    rng = np.random.default_rng(0)
+    count = len(times) * plant_count
+    return pd.DataFrame({
+        "plant_id": np.tile(np.arange(1, plant_count + 1), len(times)),
+        "plant_name": [PLANT_NAMES[i % len(PLANT_NAMES)] for i in range(plant_count)]
+        * len(times),
+        "temperature": rng.normal(15, 3, count),
+        "soil_moisture": rng.uniform(0, 100, count),
+        "recording_at": np.repeat(times.strftime("%Y-%m-%d %H:%M:%S"), plant_count),
+    }).sample(frac=1, random_state=0)
+
+
+def raw_chart_data(readings: pd.DataFrame, plant_id: int, span: pd.Timedelta) -> list:
+    """Chart data prepared from raw readings."""
+    plant = readings[readings["plant_id"] == plant_id].copy()
+    plant["recording_at"] = pd.to_datetime(plant["recording_at"])
+    plant = plant[plant["recording_at"] >= NOW - span].sort_values("recording_at")
+    return plant[["recording_at", "temperature", "soil_moisture"]].to_dict("records")
+
+
+def payload_chart_data(series: dict, plant_id: int, window: str) -> list:
+    """Chart data taken from the payload."""
+    return series[(window, plant_id)][
+        ["recording_at", "temperature", "soil_moisture"]].to_dict("records")
+
+
+def timed(function, *args, repeat: int = 5):
+    """Return the result of a call and the best seconds of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    """Print chart preparation time and size per window, and the update cost."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--plants", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    readings = week_of_readings(args.plants)
+    payloads = chart_payloads.merge(chart_payloads.empty_payloads(),
+                                    chart_payloads.bucket(readings), NOW)
+    series = dict(iter(payloads.groupby(["window", "plant_id"])))
+    print(f"{args.plants} plants, {len(readings):,} readings over 7 days")
+    print(f"{'window':>6} {'raw rows':>9} {'raw s':>8} {'raw KB':>8} "
+          f"{'payload rows':>13} {'payload s':>10} {'payload KB':>11}")
+    for window, (span, _) in chart_payloads.WINDOWS.items():
+        raw, raw_seconds = timed(raw_chart_data, readings, 1, span)
+        payload, payload_seconds = timed(payload_chart_data, series, 1, window)
+        print(f"{window:>6} {len(raw):>9} {raw_seconds:>8.4f} "
+              f"{len(json.dumps(raw, default=str)) / 1024:>8.1f} {len(payload):>13} "
+              f"{payload_seconds:>10.4f} {len(json.dumps(payload, default=str)) / 1024:>11.1f}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        location = os.path.join(directory, "charts.arrow")
+        chart_payloads.save_payloads(payloads, location)
+        batch = readings[readings["recording_at"] == NOW.strftime("%Y-%m-%d %H:%M:%S")]
+        _, seconds = timed(chart_payloads.update, batch, location, NOW)
+        print(f"Merging one minute's batch into {len(payloads):,} buckets "
+              f"({os.path.getsize(location) / 1024:.0f} KB on disk): {seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Load test of the dashboard's reads with many concurrent sessions.
+
+The read API service (`dashboard/read_api.py`) runs in its own process, as it does in
+the dashboard task. RDS is `DatabaseStandIn`, holding the last 24 hours of readings, and
+S3 is `S3StandIn`, holding daily archive files, chart payloads and a rolling statistics
+snapshot. Each simulated session then renders pages the way `dashboard/app.py` does,
+through `read_api_client.py`. It switches between the real-time, historical and
+comparison pages, plants and date ranges, with a pause between renders.
+
+Render latency is the time a page spends fetching its data, so drawing charts in the
+browser is not included. For each number of sessions the script prints the p50 and p99
+render latency per page, the service's backend query and cache counters, database round
+trips, S3 requests, and the service process's resident memory: idle before the load, its
+highest during the load, and after it.
+Runs with a different `--pool-size`, `--db-latency` or `--no-cache` show the effect of
+pooling and caching.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import argparse
+import tempfile
+import resource
+import threading
+import multiprocessing
+from datetime import timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "pipeline"))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "dashboard"))
+# pylint: disable=wrong-import-position
+import numpy as np
+import pandas as pd
+import requests
+from pyarrow import fs
+import chart_payloads
+from archive_cache import ArchiveCache
+from read_api import ReadService, make_server
+from read_api_client import ReadApiClient
+from stand_ins import BOTANISTS, PLANT_NAMES, DatabaseStandIn, S3StandIn
+from bench_archive_query import BUCKET, PREFIX, write_month
+
+REAL_TIME_WINDOW = timedelta(hours=1)
+HOT_HOURS = 24
+COMPARISON_DAYS = 30
+
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB, or its peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_rss(stop: threading.Event, peak: list, interval: float = 0.05) -> None:
+    """Keep the highest resident memory seen in `peak[0]` until stopped."""
+    while not stop.wait(interval):
+        peak[0] = max(peak[0], rss_mb())
+
+
+def now_minute() -> pd.Timestamp:
+    """The current minute as naive UTC, like the dashboard's timestamps."""
+    return pd.Timestamp.now("UTC").tz_localize(None).floor("min")
+
+
+def write_archive(directory: str, days: int, plant_count: int) -> None:
+    """Write the archive, chart payloads and statistics snapshot the service reads."""
+    s3 = S3StandIn(os.path.join(directory, "s3"))
+    first_day = now_minute().floor("D") - pd.Timedelta(days=days)
+    write_month(s3, directory, days, plant_count, 1440, first_day=first_day)
+
+    times = pd.date_range(end=now_minute(), periods=7 * 1440, freq="min")
+    rng = np.random.default_rng(0)
+    count = len(times) * plant_count
+    week = pd.DataFrame({
+        "plant_id": np.tile(np.arange(1, plant_count + 1), len(times)),
+        "plant_name": [PLANT_NAMES[plant_id % len(PLANT_NAMES)]
+                       for plant_id in range(1, plant_count + 1)] * len(times),
+        "temperature": rng.normal(15, 3, count),
+        "soil_moisture": rng.uniform(0, 100, count),
+        "recording_at": np.repeat(times, plant_count),
+    })
+    chart_payloads.update(week, os.path.join(directory, "charts.arrow"), now_minute())
+
+    summary = {"mean": 15.0, "std": 3.0, "min": 9.0, "max": 21.0, "count": 60}
+    with open(os.path.join(directory, "snapshot.json"), "w", encoding="utf-8") as file:
+        json.dump({"plants": {str(plant_id): {"temperature": summary, "soil_moisture": summary}
+                              for plant_id in range(1, plant_count + 1)}}, file)
+
+
+def fill_database(database: DatabaseStandIn, plant_count: int) -> None:
+    """One reading per minute per plant over the last HOT_HOURS hours."""
+    rng = random.Random(0)
+    for index, botanist in enumerate(BOTANISTS):
+        database.botanists[botanist] = index + 1
+    for plant_id in range(1, plant_count + 1):
+        database.plants[plant_id] = (plant_id % len(BOTANISTS) + 1,
+                                     PLANT_NAMES[plant_id % len(PLANT_NAMES)])
+    for recorded in pd.date_range(end=now_minute(), periods=HOT_HOURS * 60, freq="min"):
+        recorded = recorded.to_pydatetime()
+        database.recordings.extend(
+            (plant_id, rng.uniform(0, 100), rng.gauss(15, 3), recorded - timedelta(hours=6),
+             recorded) for plant_id in range(1, plant_count + 1))
+
+
+def serve(directory: str, options: dict, commands, results) -> None:
+    """Run the read API over the stand-ins until told to stop, then report its counters."""
+    logging.disable(logging.INFO)
+    s3 = S3StandIn(os.path.join(directory, "s3"))
+    database = DatabaseStandIn(latency=options["db_latency"])
+    fill_database(database, options["plants"])
+    service = ReadService(
+        database.connect, s3, "gamma", BUCKET, PREFIX,
+        archive_cache=ArchiveCache(s3, tempfile.mkdtemp(dir=directory)),
+        filesystem=fs.SubTreeFileSystem(s3.root, fs.LocalFileSystem()),
+        pool_size=options["pool_size"], charts_location=os.path.join(directory, "charts.arrow"),
+        stats_location=os.path.join(directory, "snapshot.json"))
+    if options["no_cache"]:
+        for cache in (service.reader.hot_cache, service.reader.cold_cache,
+                      service.archive_results, service.stats_results):
+            cache.ttl = 0
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stop, peak = threading.Event(), [rss_mb()]
+    idle_mb = peak[0]
+    threading.Thread(target=sample_rss, args=(stop, peak), daemon=True).start()
+    results.put(server.server_address[1])
+
+    commands.get()
+    stop.set()
+    server.shutdown()
+    server.server_close()
+    results.put({**service.stats(), "db_round_trips": database.round_trips,
+                 "s3_requests": s3.requests, "s3_mb_read": s3.bytes_read / 2**20,
+                 "idle_mb": idle_mb, "peak_mb": peak[0], "after_mb": rss_mb()})
+
+
+def render_real_time(client: ReadApiClient, rng: random.Random) -> None:
+    """The real-time page: latest readings, a trend window and rolling statistics."""
+    plant_id = rng.choice(list(client.plants()))
+    client.readings([plant_id], now_minute() - REAL_TIME_WINDOW, None)
+    client.chart_payload(plant_id, rng.choice(list(chart_payloads.WINDOWS)))
+    client.rolling_stats()
+
+
+def render_historical(client: ReadApiClient, rng: random.Random) -> None:
+    """The historical page: a preset window from the payloads, or a custom date range."""
+    plant_id = rng.choice(list(client.plants()))
+    window = rng.choice([*chart_payloads.WINDOWS, "Custom"])
+    now = now_minute()
+    if window == "Custom":
+        first = client.archive_range()[0]
+        start = first.floor("D") + pd.Timedelta(days=rng.randrange((now - first).days + 1))
+        client.readings([plant_id], start, start + pd.Timedelta(days=rng.randint(1, 7)))
+    elif client.chart_payload(plant_id, window).empty:
+        client.readings([plant_id], now - chart_payloads.WINDOWS[window][0], now)
+
+
+def render_comparison(client: ReadApiClient, rng: random.Random) -> None:
+    """The comparison page: the driest plants and the daily means of the first five."""
+    first, last = client.archive_range()
+    start = max(first, last - pd.Timedelta(days=COMPARISON_DAYS)).floor("D")
+    end = last.floor("D") + pd.Timedelta(days=1)
+    summary = client.plant_summary(start, end, float(rng.choice([10, 20, 30])))
+    client.daily_means(summary["plant_id"].head(5).tolist(), start, end,
+                       rng.choice(["soil_moisture", "temperature"]))
+
+
+# Page: (render, share of renders)
+PAGES = {"Real-Time": (render_real_time, 0.5), "Historical": (render_historical, 0.4),
+         "Comparison": (render_comparison, 0.1)}
+
+
+def session(base_url: str, renders: int, think: float, seed: int, latencies: list,
+            errors: list) -> None:
+    """One user rendering pages with a random pause between them."""
+    rng = random.Random(seed)
+    client = ReadApiClient(base_url)
+    time.sleep(rng.uniform(0, think))
+    for _ in range(renders):
+        page = rng.choices(list(PAGES), [share for _, share in PAGES.values()])[0]
+        start = time.perf_counter()
+        try:
+            PAGES[page][0](client, rng)
+            latencies.append((page, time.perf_counter() - start))
+        except requests.RequestException:
+            errors.append(page)
+        time.sleep(rng.expovariate(1 / think) if think else 0)
+
+
+def receive(results, process):
+    """The next result from a process, failing rather than waiting if it has died."""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"The read API process exited with {process.exitcode}")
+
+
+def run_load(directory: str, sessions: int, args: argparse.Namespace) -> tuple:
+    """Latencies, errors, seconds and service counters of one load level."""
+    context = multiprocessing.get_context("spawn")
+    commands, results = context.Queue(), context.Queue()
+    options = {"plants": args.plants, "pool_size": args.pool_size,
+               "db_latency": args.db_latency, "no_cache": args.no_cache}
+    service = context.Process(target=serve, args=(directory, options, commands, results))
+    service.start()
+    base_url = f"http://127.0.0.1:{receive(results, service)}"
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=session, args=(
+        base_url, args.renders, args.think, seed, latencies, errors))
+        for seed in range(sessions)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - began
+
+    commands.put("stop")
+    counters = receive(results, service)
+    service.join()
+    return latencies, errors, seconds, counters
+
+
+def main() -> None:
+    """Print render latency and backend load for each number of sessions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 25, 50])
+    parser.add_argument("--renders", type=int, default=20, help="renders per session")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="mean seconds between a session's renders")
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30, help="days of archive")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--db-latency", type=float, default=0.005,
+                        help="seconds per database round trip")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="expire the service's result caches immediately")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_archive(directory, args.days, args.plants)
+        print(f"{args.plants} plants, {args.days} days archived, {HOT_HOURS} hours in RDS, "
+              f"pool of {args.pool_size}, {args.db_latency * 1000:.0f} ms per round trip"
+              f"{', caches off' if args.no_cache else ''}")
+        levels = {sessions: run_load(directory, sessions, args) for sessions in args.sessions}
+
+    print(f"\n{'sessions':>8} {'page':<11} {'renders':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for sessions, (latencies, _, _, _) in levels.items():
+        for page in [*PAGES, "All"]:
+            times = [seconds * 1000 for name, seconds in latencies if page in (name, "All")]
+            if times:
+                print(f"{sessions:>8} {page:<11} {len(times):>8} "
+                      f"{np.percentile(times, 50):>8.0f} {np.percentile(times, 99):>8.0f}")
+
+    print(f"\n{'sessions':>8} {'renders/s':>9} {'errors':>6} {'hot q':>6} {'cold rd':>7} "
+          f"{'scans':>6} {'conns':>5} {'coalesced':>9} {'db trips':>8} {'s3 reqs':>7} "
+          f"{'s3 MB':>6} {'idle MB':>7} {'peak MB':>7} {'after MB':>8}")
+    for sessions, (latencies, errors, seconds, counters) in levels.items():
+        print(f"{sessions:>8} {len(latencies) / seconds:>9.1f} {len(errors):>6} "
+              f"{counters['hot_queries']:>6} {counters['cold_reads']:>7} "
+              f"{counters['archive_files_scanned']:>6} {counters['connections_opened']:>5} "
+              f"{counters['coalesced']:>9} {counters['db_round_trips']:>8} "
+              f"{counters['s3_requests']:>7} {counters['s3_mb_read']:>6.1f} "
+              f"{counters['idle_mb']:>7.0f} {counters['peak_mb']:>7.0f} "
+              f"{counters['after_mb']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark of the minute pipeline and the RDS -> S3 archival pipeline.
+
+For each plant count, a local plants API stub, database stand-in and S3 stand-in are
+started. `pipeline.run_pipeline` then polls every plant and loads the readings, and
+`etl_pipeline.run_pipeline` archives them. Each stage's wall time and peak traced memory
+are written to a results file and compared against a stored baseline. Any stage that got
+slower by more than the tolerance is flagged as a regression.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import warnings
+import tracemalloc
+from contextlib import ExitStack
+from unittest.mock import patch
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+for folder in ("pipeline", "rds_to_s3_pipeline"):
+    sys.path.append(os.path.join(BENCHMARK_DIR, "..", folder))
+os.environ.setdefault("SCHEMA_NAME", "gamma")
+# pylint: disable=wrong-import-position
+import extract
+import load
+import stages
+import etl_pipeline
+from stand_ins import PlantsApiStub, DatabaseStandIn, S3StandIn
+import pipeline
+
+DEFAULT_SIZES = [50, 5_000, 50_000]
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results", "end_to_end.json")
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline_end_to_end.json")
+TOLERANCE = 0.25
+NOISE_FLOOR = 0.05
+
+STAGES = [
+    (stages, "run_extraction", "extract"),
+    (stages, "run_transformation", "transform"),
+    (stages, "run_loading", "load"),
+    (etl_pipeline, "load_data_to_dataframe", "archive_read"),
+    (etl_pipeline, "save_to_parquet", "archive_write"),
+    (etl_pipeline, "upload_to_s3", "archive_upload"),
+    (etl_pipeline, "upload_manifest", "archive_manifest"),
+    (etl_pipeline, "clear_rds", "archive_clear"),
+]
+
+
+class StageTimer:
+    """Wraps stage functions to record their duration and peak traced memory."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def wrap(self, name: str, function):
+        """Return a version of `function` that records its timing under `name`."""
+        def timed(*args, **kwargs):
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                self.timings[name] = {
+                    "seconds": round(time.perf_counter() - start, 4),
+                    "peak_memory_mb": round(peak / 2**20, 2),
+                }
+        return timed
+
+
+def run_size(plant_count: int, api_latency: float, api_error_rate: float,
+             db_latency: float) -> dict:
+    """Run both pipelines once against fresh stand-ins for `plant_count` plants."""
+    timer = StageTimer()
+    database = DatabaseStandIn(latency=db_latency)
+
+    with tempfile.TemporaryDirectory() as directory, ExitStack() as stack, \
+            PlantsApiStub(latency=api_latency, error_rate=api_error_rate) as api:
+        s3 = S3StandIn(directory)
+        stack.enter_context(patch.object(extract, "BASE_URL", api.base_url))
+        stack.enter_context(patch.object(
+            extract, "PLANT_IDS", range(1, plant_count + 1)))
+        stack.enter_context(patch.object(load.pymssql, "connect", database.connect))
+        stack.enter_context(patch.object(etl_pipeline.pymssql, "connect", database.connect))
+        stack.enter_context(patch.object(etl_pipeline.boto3, "client", s3.client))
+        stack.enter_context(patch.object(etl_pipeline, "S3_BUCKET", "benchmark-bucket"))
+        for module, function_name, stage in STAGES:
+            stack.enter_context(patch.object(
+                module, function_name, timer.wrap(stage, getattr(module, function_name))))
+
+        previous_directory = os.getcwd()
+        os.chdir(directory)
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            pipeline.run_pipeline()
+            minute_seconds = time.perf_counter() - start
+            rows_loaded = len(database.recordings)
+            load_round_trips = database.round_trips
+
+            start = time.perf_counter()
+            etl_pipeline.run_pipeline()
+            archive_seconds = time.perf_counter() - start
+        finally:
+            tracemalloc.stop()
+            os.chdir(previous_directory)
+
+    return {
+        "plants": plant_count,
+        "api_requests": api.requests,
+        "rows_loaded": rows_loaded,
+        "db_round_trips": load_round_trips,
+        "s3_bytes_written": s3.bytes_written,
+        "minute_pipeline_seconds": round(minute_seconds, 4),
+        "archive_pipeline_seconds": round(archive_seconds, 4),
+        "plants_per_second": round(plant_count / minute_seconds, 1),
+        "stages": timer.timings,
+    }
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """List stages that are slower than the baseline by more than the tolerance."""
+    regressions = []
+    for size, run in results["runs"].items():
+        baseline_run = baseline.get("runs", {}).get(size)
+        if not baseline_run:
+            continue
+        for stage, timing in run["stages"].items():
+            before = baseline_run["stages"].get(stage, {}).get("seconds")
+            after = timing["seconds"]
+            if before is not None and after > before * (1 + tolerance) \
+                    and after - before > NOISE_FLOOR:
+                regressions.append(
+                    f"{size} plants, {stage}: {before:.3f}s -> {after:.3f}s")
+    return regressions
+
+
+def print_summary(results: dict) -> None:
+    """Print one line per stage and plant count."""
+    print(f"{'plants':>8} {'stage':<16} {'seconds':>9} {'peak MB':>9}")
+    for size, run in results["runs"].items():
+        for stage, timing in run["stages"].items():
+            print(f"{size:>8} {stage:<16} {timing['seconds']:>9.3f} "
+                  f"{timing['peak_memory_mb']:>9.2f}")
+        print(f"{size:>8} {'(plants/s)':<16} {run['plants_per_second']:>9.1f}")
+
+
+def main() -> int:
+    """Run the suite and return a non-zero exit code if a regression was found."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="Seconds the API stub waits before each response.")
+    parser.add_argument("--api-error-rate", type=float, default=0.02,
+                        help="Share of API requests that return a sensor error.")
+    parser.add_argument("--db-latency", type=float, default=0.0,
+                        help="Seconds each database round trip takes.")
+    parser.add_argument("--results", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    results = {
+        "python": platform.python_version(),
+        "settings": {"api_latency": args.api_latency, "api_error_rate": args.api_error_rate,
+                     "db_latency": args.db_latency},
+        "runs": {str(size): run_size(size, args.api_latency, args.api_error_rate,
+                                     args.db_latency)
+                 for size in args.sizes},
+    }
+    logging.disable(logging.NOTSET)
+
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print_summary(results)
+    print(f"Results written to {args.results}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found, skipping the regression check.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as file:
+        regressions = find_regressions(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Benchmark of streaming exports against building the whole file in memory.
+
+A month of daily archive files is written to the S3 stand-in. Every plant's readings of
+all but the last two days, which are wholly archived, are exported as CSV and as Parquet.
+Streaming goes through `export.py` one day at a time. Materialising reads the whole range into one frame and encodes it in
+one go, as a Streamlit download button would need. Each run is made in a fresh process,
+so its peak resident memory is its own.
+"""
+import io
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import resource
+import multiprocessing
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "pipeline"))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "dashboard"))
+# pylint: disable=wrong-import-position
+import pandas as pd
+import archive_catalog
+import export
+from tiered_reader import TieredReader
+from stand_ins import S3StandIn
+from bench_archive_query import BUCKET, PREFIX, write_month
+
+
+def no_database():
+    """The exported range ends before the tier overlap, so RDS is never queried."""
+    raise RuntimeError("The benchmark export should not reach RDS")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(root: str, days: int, mode: str, export_format: str) -> tuple:
+    """Export in a mode and return (seconds, bytes, peak MB) of this process."""
+    logging.disable(logging.INFO)
+    s3 = S3StandIn(root)
+    catalog = archive_catalog.ArchiveCatalog(s3, BUCKET, PREFIX).refresh()
+    reader = TieredReader(no_database, lambda: catalog, "gamma")
+    start = catalog.time_range()[0].floor("D")
+    end = start + pd.Timedelta(days=days)
+    size = 0
+    began = time.perf_counter()
+    if mode == "stream":
+        with open(os.devnull, "wb") as sink:
+            for chunk in export.export(reader, None, start, end, export_format):
+                sink.write(chunk)
+                size += len(chunk)
+    elif mode == "materialise":
+        dataframe = reader.read(None, start, end, cache=False)
+        if export_format == "csv":
+            size = len(dataframe.to_csv(index=False).encode("utf-8"))
+        else:
+            buffer = io.BytesIO()
+            dataframe.to_parquet(buffer, index=False, compression="zstd")
+            size = buffer.tell()
+    return time.perf_counter() - began, size, peak_rss_mb()
+
+
+def main() -> None:
+    """Print the time, size and peak memory of each way of exporting."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--readings-per-day", type=int, default=1440)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    export_days = args.days - 2
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "s3")
+        rows = write_month(S3StandIn(root), directory, args.days, args.plants,
+                           args.readings_per_day)
+        print(f"{args.days} days archived, {args.plants} plants, {rows:,} rows; "
+              f"exporting {export_days} days")
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            _, _, baseline = pool.apply(run, (root, export_days, "none", "csv"))
+        print(f"Baseline process peak: {baseline:.0f} MB")
+        print(f"{'format':<8} {'mode':<12} {'seconds':>8} {'MB out':>8} {'peak MB':>8}")
+        for export_format in export.FORMATS:
+            for mode in ("stream", "materialise"):
+                with context.Pool(1, maxtasksperchild=1) as pool:
+                    seconds, size, peak = pool.apply(run, (root, export_days, mode, export_format))
+                print(f"{export_format:<8} {mode:<12} {seconds:>8.2f} "
+                      f"{size / 2**20:>8.1f} {peak:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark showing minute pipeline throughput as the number of shard workers grows, for
+several fleet sizes, to find where sharding starts to pay for its start-up cost.
+"""
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+# pylint: disable=wrong-import-position
+import extract
+import load
+import sharding
+
+PLANT_COUNTS = [int(count) for count in
+                os.getenv("BENCH_PLANT_COUNTS", "50,100,200,300,500,2000").split(",")]
+API_LATENCY = float(os.getenv("BENCH_API_LATENCY", "0.002"))
+WORKER_COUNTS = [1, 2, 4, 8]
+
+
+def simulated_plant_data(plant_id: int, session=None) -> dict:  # pylint: disable=unused-argument
+    """Stand-in for the plants API that waits as long as a real request would."""
+    time.sleep(API_LATENCY)
+    return {
+        "plant_id": plant_id,
+        "name": f"Plant {plant_id}",
+        "soil_moisture": 40 + plant_id % 20,
+        "temperature": 15 + plant_id % 10,
+        "last_watered": "Tue, 26 Nov 2024 14:10:54 GMT",
+        "recording_taken": "2024-11-26 15:01:07",
+        "botanist": {"name": "Kurt Martin-Brown", "email": "kurt@example.com",
+                     "phone": "123-456-7890"},
+    }
+
+
+class SimulatedConnection:
+    """Stand-in for a pymssql connection that accepts and discards statements."""
+
+    def cursor(self):
+        """Return this object as its own cursor."""
+        return self
+
+    def execute(self, *_):
+        """Discard a statement."""
+
+    def commit(self):
+        """Nothing to commit."""
+
+    def rollback(self):
+        """Nothing to roll back."""
+
+    def close(self):
+        """Nothing to close."""
+
+
+extract.get_plant_data = simulated_plant_data
+load.get_db_connection = SimulatedConnection
+
+
+def run_benchmark() -> None:
+    """
+    Time a full sharded run for each plant and worker count and print the throughput.
+    Shards are not capped by MIN_PLANTS_PER_SHARD here, so small fleets show its cost.
+    """
+    print(f"{API_LATENCY * 1000:.1f} ms simulated API latency")
+    print(f"{'plants':>7} {'workers':>8} {'plants/shard':>13} {'seconds':>9} "
+          f"{'plants/s':>10} {'speed-up':>9}")
+    for plant_count in PLANT_COUNTS:
+        plant_ids = list(range(1, plant_count + 1))
+        baseline = None
+        for workers in WORKER_COUNTS:
+            start = time.perf_counter()
+            rows = sharding.run_sharded(workers, workers, plant_ids, min_plants_per_shard=1)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{plant_count:>7} {workers:>8} {plant_count // workers:>13} "
+                  f"{elapsed:>9.2f} {rows / elapsed:>10.0f} {baseline / elapsed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    run_benchmark()
@@ -0,0 +1,100 @@
+"""
+Benchmark of replaying the spool after a database outage.
+
+An outage of each length is simulated by spooling one batch of cleaned readings per
+minute for every plant. The backlog is then replayed into the database stand-in with
+`spool.replay`. For comparison, outages of up to `--compare-hours` are also loaded with
+the row-by-row `load_data_to_database` the minute pipeline uses, which is too slow to
+run on long outages. Every database round trip takes `--db-latency` seconds.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "pipeline"))
+os.environ.setdefault("SCHEMA_NAME", "gamma")
+# pylint: disable=wrong-import-position
+import pandas as pd
+import load
+import spool
+from stand_ins import DatabaseStandIn, BOTANISTS, PLANT_NAMES
+
+DEFAULT_HOURS = [1, 6, 24]
+
+
+def minute_batch(plant_count: int, recorded_at: datetime) -> pd.DataFrame:
+    """One minute of cleaned readings for every plant."""
+    plant_ids = range(1, plant_count + 1)
+    botanists = [BOTANISTS[plant_id % len(BOTANISTS)] for plant_id in plant_ids]
+    return pd.DataFrame({
+        "plant_id": plant_ids,
+        "plant_name": [PLANT_NAMES[plant_id % len(PLANT_NAMES)] for plant_id in plant_ids],
+        "soil_moisture": [40.0 + plant_id % 20 for plant_id in plant_ids],
+        "temperature": [15.0 + plant_id % 10 for plant_id in plant_ids],
+        "last_watered": pd.Timestamp(recorded_at - timedelta(hours=6), tz="UTC"),
+        "recording_at": pd.Timestamp(recorded_at, tz="UTC"),
+        "botanist_first_name": [botanist[0] for botanist in botanists],
+        "botanist_last_name": [botanist[1] for botanist in botanists],
+        "botanist_email": [botanist[2] for botanist in botanists],
+        "botanist_phone": [botanist[3] for botanist in botanists],
+    })
+
+
+def run_outage(hours: int, plant_count: int, db_latency: float, compare: bool) -> dict:
+    """Spool an outage of `hours` hours, then time its replay and optionally a row-by-row load."""
+    start = datetime(2024, 11, 27)
+    with tempfile.TemporaryDirectory() as directory:
+        for minute in range(hours * 60):
+            spool.append(minute_batch(plant_count, start + timedelta(minutes=minute)),
+                         directory)
+        backlog = pd.concat([spool.read_segment(segment).to_pandas()
+                             for segment in spool.segments(directory)], ignore_index=True)
+
+        database = DatabaseStandIn(latency=db_latency)
+        began = time.perf_counter()
+        rows = spool.replay(database, directory)
+        replay_seconds = time.perf_counter() - began
+        replay_round_trips = database.round_trips
+
+    result = {"hours": hours, "rows": rows, "replay_seconds": replay_seconds,
+              "replay_round_trips": replay_round_trips}
+    if compare:
+        database = DatabaseStandIn(latency=db_latency)
+        began = time.perf_counter()
+        load.load_data_to_database(database, backlog)
+        result.update(row_seconds=time.perf_counter() - began,
+                      row_round_trips=database.round_trips)
+    return result
+
+
+def main() -> None:
+    """Print replay throughput for each outage length."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hours", type=int, nargs="+", default=DEFAULT_HOURS)
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--compare-hours", type=int, default=1,
+                        help="Longest outage to also load row by row.")
+    parser.add_argument("--db-latency", type=float, default=0.002,
+                        help="Seconds each database round trip takes.")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print(f"{args.plants} plants, {args.db_latency * 1000:.1f} ms per round trip")
+    print(f"{'hours':>6} {'rows':>8} {'replay s':>9} {'trips':>7} {'rows/s':>9} "
+          f"{'row-by-row s':>13} {'trips':>7}")
+    for hours in args.hours:
+        result = run_outage(hours, args.plants, args.db_latency, hours <= args.compare_hours)
+        row_by_row = (f"{result['row_seconds']:>13.2f} {result['row_round_trips']:>7}"
+                      if "row_seconds" in result else f"{'-':>13} {'-':>7}")
+        print(f"{result['hours']:>6} {result['rows']:>8} {result['replay_seconds']:>9.2f} "
+              f"{result['replay_round_trips']:>7} "
+              f"{result['rows'] / result['replay_seconds']:>9.0f} {row_by_row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Microbenchmark comparing format-inferred and fixed-format timestamp parsing."""
+import os
+import sys
+import timeit
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+import timestamps  # pylint: disable=wrong-import-position
+
+ROW_COUNTS = [50, 5_000, 50_000]
+REPEATS = 5
+
+
+def make_columns(rows: int) -> tuple:
+    """Build recording_at and last_watered columns shaped like the API output."""
+    recording_at = pd.date_range("2024-11-26", periods=rows, freq="s")
+    last_watered = recording_at.floor("h")
+    return (
+        pd.Series(recording_at.strftime("%Y-%m-%d %H:%M:%S"), dtype=object),
+        pd.Series(last_watered.strftime(
+            "%a, %d %b %Y %H:%M:%S GMT"), dtype=object),
+    )
+
+
+def inferred_path(recording_at: pd.Series, last_watered: pd.Series) -> None:
+    """The original parsing in clean_plant_data."""
+    pd.to_datetime(recording_at, errors="coerce")
+    pd.to_datetime(last_watered.str.replace("GMT", ""), errors="coerce")
+
+
+def fixed_format_path(recording_at: pd.Series, last_watered: pd.Series) -> None:
+    """The parsing done by the timestamps module."""
+    timestamps.parse_recording_at(recording_at)
+    timestamps.parse_last_watered(last_watered)
+
+
+def run_benchmark() -> None:
+    """Time both parsing paths and print the results."""
+    print(f"{'rows':>8} {'inferred (ms)':>15} {'fixed (ms)':>12} {'speed-up':>9}")
+    for rows in ROW_COUNTS:
+        recording_at, last_watered = make_columns(rows)
+        inferred = min(timeit.repeat(
+            lambda: inferred_path(recording_at, last_watered),
+            number=1, repeat=REPEATS))
+        fixed = min(timeit.repeat(
+            lambda: fixed_format_path(recording_at, last_watered),
+            number=1, repeat=REPEATS))
+        print(f"{rows:>8} {inferred * 1000:>15.2f} {fixed * 1000:>12.2f} "
+              f"{inferred / fixed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
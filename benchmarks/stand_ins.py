@@ -0,0 +1,373 @@
+"""
+Local stand-ins for the plants API, the RDS database and S3, used by the benchmarks.
+
+- `PlantsApiStub` is a real HTTP server on localhost that answers /plants/<id> like the
+  plants API does, with configurable latency and error rate.
+- `DatabaseStandIn` behaves like a pymssql connection and keeps the botanist, plant and
+  recording tables in memory, so rows inserted by the minute pipeline or the bulk
+  loader can be read back by the RDS -> S3 pipeline and the dashboard's read API.
+- `S3StandIn` behaves like a boto3 S3 client backed by a local directory.
+"""
+import os
+import re
+import json
+import time
+import random
+import shutil
+import threading
+from io import BytesIO
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PLANT_NAMES = ["Venus flytrap", "Corpse flower", "Rafflesia arnoldii", "Black bat flower",
+               "Pitcher plant", "Wollemi pine", "Bird of paradise", "Cactus", "Lily"]
+BOTANISTS = [("Carl", "Linnaeus", "carl.linnaeus@lnhm.co.uk", "(146)994-1635x35992"),
+             ("Gertrude", "Jekyll", "gertrude.jekyll@lnhm.co.uk", "001-481-273-3691x127"),
+             ("Eliza", "Andrews", "eliza.andrews@lnhm.co.uk", "(846)669-6651x75948")]
+
+
+def fake_plant(plant_id: int, recorded_at: datetime) -> dict:
+    """A response body in the same shape as the plants API."""
+    first_name, last_name, email, phone = BOTANISTS[plant_id % len(BOTANISTS)]
+    return {
+        "plant_id": plant_id,
+        "name": f"{PLANT_NAMES[plant_id % len(PLANT_NAMES)]} {plant_id}",
+        "soil_moisture": round(30 + (plant_id * 7 % 50) + random.random(), 2),
+        "temperature": round(12 + (plant_id * 3 % 10) + random.random(), 2),
+        "last_watered": (recorded_at - timedelta(hours=plant_id % 24)).strftime(
+            "%a, %d %b %Y %H:00:00 GMT"),
+        "recording_taken": recorded_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "botanist": {"name": f"{first_name} {last_name}", "email": email, "phone": phone},
+    }
+
+
+def chunks(params, width: int) -> list:
+    """Split the flat parameters of a multi-row statement into one tuple per row."""
+    return [tuple(params[start:start + width]) for start in range(0, len(params), width)]
+
+
+class PlantsApiStub:
+    """Local HTTP server imitating the plants API."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        """URL to use in place of extract.BASE_URL."""
+        return f"http://127.0.0.1:{self.server.server_port}/plants/"
+
+    def handler(self):
+        """Request handler class bound to this stub."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers GET /plants/<id>."""
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Return a plant reading or a sensor error."""
+                with stub.lock:
+                    stub.requests += 1
+                    failed = stub.random.random() < stub.error_rate
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                match = re.fullmatch(r"/plants/(\d+)", self.path)
+                plant_id = int(match.group(1)) if match else None
+                if plant_id is None or failed:
+                    status = 404
+                    body = {"error": "plant sensor fault", "plant_id": plant_id}
+                else:
+                    status = 200
+                    body = fake_plant(plant_id, datetime.now())
+
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_):
+                """Keep benchmark output quiet."""
+
+        return Handler
+
+    def __enter__(self) -> "PlantsApiStub":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DatabaseStandIn:
+    """
+    In-memory stand-in for a pymssql connection to the gamma schema.
+
+    Only the statements issued by the pipelines and the dashboard are understood. Every
+    call to execute is counted as a database round trip.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self.botanists = {}
+        self.plants = {}
+        self.recordings = []
+        self.lock = threading.Lock()
+
+    def connect(self, **_) -> "DatabaseStandIn":
+        """Used in place of pymssql.connect."""
+        return self
+
+    def cursor(self, *_, **__) -> "CursorStandIn":
+        """Open a cursor on the in-memory tables."""
+        return CursorStandIn(self)
+
+    def commit(self) -> None:
+        """Statements are applied immediately, so there is nothing to commit."""
+
+    def rollback(self) -> None:
+        """Statements are applied immediately, so there is nothing to roll back."""
+
+    def close(self) -> None:
+        """The stand-in stays usable after being closed."""
+
+    def recording_rows(self, plant_name: str = None) -> list:
+        """Recordings joined with their plant and botanist, like the pipelines' queries."""
+        rows = []
+        botanists = {botanist_id: key for key, botanist_id in self.botanists.items()}
+        for plant_id, soil_moisture, temperature, last_watered, recording_at in self.recordings:
+            botanist_id, name = self.plants[plant_id]
+            if plant_name is not None and name != plant_name:
+                continue
+            rows.append((plant_id, name, soil_moisture, temperature, last_watered,
+                         recording_at, *botanists[botanist_id]))
+        return rows
+
+
+class CursorStandIn:
+    """Cursor over a `DatabaseStandIn`."""
+
+    RECORDING_COLUMNS = ["plant_id", "plant_name", "soil_moisture", "temperature",
+                         "last_watered", "recording_at"]
+    BOTANIST_COLUMNS = ["botanist_first_name", "botanist_last_name",
+                        "botanist_email", "botanist_phone"]
+
+    def __init__(self, database: DatabaseStandIn):
+        self.database = database
+        self.description = None
+        self.rows = []
+
+    def __enter__(self) -> "CursorStandIn":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def execute(self, query: str, params=None) -> None:
+        """Apply a statement to the in-memory tables."""
+        database = self.database
+        with database.lock:
+            database.round_trips += 1
+        if database.latency:
+            time.sleep(database.latency)
+
+        statement = " ".join(query.split()).lower()
+        merge = re.match(r"merge \w+\.(\w+)", statement)
+        insert = re.search(r"insert into \w+\.(\w+)", statement)
+        table = insert.group(1) if insert and not merge else None
+        with database.lock:
+            if merge and merge.group(1) == "botanist":
+                for row in chunks(params, 4):
+                    database.botanists.setdefault(row, len(database.botanists) + 1)
+            elif merge and merge.group(1) == "plant":
+                for plant_id, first, last, email, phone, name in chunks(params, 6):
+                    database.plants.setdefault(
+                        plant_id, (database.botanists[(first, last, email, phone)], name))
+            elif table == "botanist":
+                database.botanists.setdefault(
+                    tuple(params[:4]), len(database.botanists) + 1)
+            elif table == "plant":
+                plant_id, _, first, last, email, phone, name = params
+                database.plants.setdefault(
+                    plant_id, (database.botanists[(first, last, email, phone)], name))
+            elif table == "recording":
+                database.recordings.extend(chunks(params, 5))
+            elif statement.startswith("truncate table") and ".recording" in statement:
+                database.recordings.clear()
+            elif statement.startswith("delete from") and ".recording" in statement:
+                start, end = params
+                database.recordings[:] = [row for row in database.recordings
+                                          if not start <= row[4] < end]
+            elif statement.startswith("select") and "where r.recording_at >= %s" in statement:
+                self.select_readings(statement, params)
+            elif statement.startswith("select plant_id, plant_name from"):
+                self.set_result(["plant_id", "plant_name"],
+                                [(plant_id, name) for plant_id, (_, name)
+                                 in database.plants.items()])
+            elif statement.startswith("select") and "join" in statement:
+                self.select_recordings(statement, params)
+            elif statement.startswith("select distinct plant_name"):
+                self.set_result(["plant_name"],
+                                [(name,) for _, name in database.plants.values()])
+
+    def executemany(self, query: str, params_list) -> None:
+        """Apply a statement once per parameter set in a single round trip."""
+        with self.database.lock:
+            self.database.round_trips -= len(params_list) - 1
+        for params in params_list:
+            self.execute(query, params)
+
+    def select_recordings(self, statement: str, params) -> None:
+        """Answer the joined recording queries of the pipelines and the dashboard."""
+        match = re.search(r"p\.plant_name = '([^']*)'", statement)
+        plant_name = params[0] if params and "%s" in statement else None
+        if match:
+            plant_name = next((name for _, name in self.database.plants.values()
+                               if name.lower() == match.group(1)), match.group(1))
+        self.set_result(self.RECORDING_COLUMNS + self.BOTANIST_COLUMNS,
+                        self.database.recording_rows(plant_name))
+
+    def select_readings(self, statement: str, params) -> None:
+        """Answer the dashboard's time-range query, with the columns it names."""
+        columns = re.findall(r" as (\w+)", statement)
+        start, end, *plant_ids = params
+        plant_ids = set(plant_ids) if plant_ids else None
+        names = self.RECORDING_COLUMNS + self.BOTANIST_COLUMNS
+        positions = [names.index(column) for column in columns]
+        botanists = {botanist_id: key for key, botanist_id in self.database.botanists.items()}
+        rows = []
+        for plant_id, soil_moisture, temperature, last_watered, recording_at \
+                in self.database.recordings:
+            if not start <= recording_at < end or \
+                    (plant_ids is not None and plant_id not in plant_ids):
+                continue
+            botanist_id, name = self.database.plants[plant_id]
+            row = (plant_id, name, soil_moisture, temperature, last_watered, recording_at,
+                   *botanists[botanist_id])
+            rows.append(tuple(row[position] for position in positions))
+        self.set_result(columns, rows)
+
+    def set_result(self, columns: list, rows: list) -> None:
+        """Make a result set available to the fetch methods."""
+        self.description = [(column, None, None, None, None, None, None)
+                            for column in columns]
+        self.rows = rows
+
+    def fetchall(self) -> list:
+        """Return and consume every remaining row."""
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size: int = 1) -> list:
+        """Return and consume up to `size` rows."""
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class S3StandIn:
+    """boto3-style S3 client that stores objects under a local directory."""
+
+    class NoSuchKey(Exception):
+        """Raised by get_object for missing keys, like the boto3 modelled exception."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.exceptions = self
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def client(self, *_, **__) -> "S3StandIn":
+        """Used in place of boto3.client."""
+        return self
+
+    def path(self, bucket: str, key: str) -> str:
+        """Local path of an object."""
+        return os.path.join(self.root, bucket, key)
+
+    def count(self, read: int = 0, written: int = 0) -> None:
+        """Record a request and the bytes it moved."""
+        with self.lock:
+            self.requests += 1
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def put_object(self, Bucket: str, Key: str, Body, **_) -> dict:  # pylint: disable=invalid-name
+        """Store an object from bytes or a file-like body."""
+        data = Body.read() if hasattr(Body, "read") else Body
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        self.count(written=len(data))
+        return {"ETag": f'"{os.stat(path).st_mtime_ns:x}"'}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **_) -> None:  # pylint: disable=invalid-name
+        """Copy a local file into the store."""
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+        self.count(written=os.path.getsize(path))
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **_) -> dict:  # pylint: disable=invalid-name
+        """Return an object, or a byte range of it, with a readable body."""
+        path = self.path(Bucket, Key)
+        if not os.path.exists(path):
+            self.count()
+            raise self.NoSuchKey(Key)
+        with open(path, "rb") as file:
+            data = file.read()
+        if Range:
+            start, end = (int(part) for part in Range.split("=")[1].split("-"))
+            data = data[start:end + 1]
+        self.count(read=len(data))
+        return {"Body": BytesIO(data), "ContentLength": len(data),
+                "ETag": f'"{os.stat(path).st_mtime_ns:x}"'}
+
+    def head_object(self, Bucket: str, Key: str, **_) -> dict:  # pylint: disable=invalid-name
+        """Return the size and ETag of an object."""
+        path = self.path(Bucket, Key)
+        self.count()
+        if not os.path.exists(path):
+            raise self.NoSuchKey(Key)
+        return {"ContentLength": os.path.getsize(path),
+                "ETag": f'"{os.stat(path).st_mtime_ns:x}"'}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **_) -> dict:  # pylint: disable=invalid-name
+        """List the objects whose keys start with a prefix."""
+        self.count()
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name),
+                                      bucket_root).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    contents.append({"Key": key, "Size": os.path.getsize(
+                        os.path.join(directory, name))})
+        return {"Contents": sorted(contents, key=lambda item: item["Key"]),
+                "KeyCount": len(contents)}
+
+    def delete_object(self, Bucket: str, Key: str, **_) -> None:  # pylint: disable=invalid-name
+        """Remove an object if it exists."""
+        self.count()
+        path = self.path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,26 +1,39 @@
 """Streamlit Dashboard for Plant Health Monitoring"""
+# pylint: disable=wrong-import-position
 import os
-from io import BytesIO
+import sys
+import time
+import uuid
+import shutil
 from datetime import datetime, timedelta
 import pandas as pd
-import boto3
 import altair as alt
 import streamlit as st
-import pymssql
 from dotenv import load_dotenv
 
+# Shared modules live in ../pipeline locally and are copied alongside the app in the image
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+import profiler
+from read_api_client import ReadApiClient, READ_API_URL
+
 load_dotenv(override=True)
 
-S3_BUCKET = "c14-team-growth-storage"
-FOLDER = "plant_data/"
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "database": os.getenv("DB_NAME"),
-    "username": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "port": os.getenv("DB_PORT"),
-}
-SCHEMA_NAME = os.getenv("SCHEMA_NAME")
+# An authenticating load balancer in front of the read API's /export, if there is one
+READ_API_PUBLIC_URL = os.getenv("READ_API_PUBLIC_URL", "")
+EXPORT_FORMATS = {"CSV": "csv", "Parquet": "parquet"}
+# Exports are written below Streamlit's static folder and downloaded from there, so the
+# file is streamed from disk rather than held in the app's memory
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "exports")
+EXPORT_URL = "app/static/exports"
+EXPORT_TTL_SECONDS = float(os.getenv("EXPORT_TTL_SECONDS", "3600"))
+
+# Only the latest readings are fetched raw; trend charts come from the chart payloads
+REAL_TIME_WINDOW = timedelta(hours=1)
+# Preset time range: (chart payload window, span)
+TIME_RANGES = {"Last hour": ("1h", timedelta(hours=1)),
+               "Last 24 hours": ("24h", timedelta(days=1)),
+               "Last 7 days": ("7d", timedelta(days=7))}
 
 st.set_page_config(
     page_title="LNHM Dashboard",
@@ -32,115 +45,142 @@ st.title("🌱 Liverpool Natural History Museum - Plant Health Monitoring")
 st.write("Monitor real-time and historical plant health data from the botanical wing.")
 
 
-def get_rds_connection():
-    """Establish a connection to the RDS database."""
+@st.cache_resource
+def get_read_api() -> ReadApiClient:
+    """
+    One client of the read API service, which owns the RDS connections and the caches
+    shared by every session of the app.
+    """
+    return ReadApiClient(READ_API_URL)
+
+
+def fetch_real_time_data(plant_id: int) -> pd.DataFrame:
+    """Fetch the readings of a specific plant from the last REAL_TIME_WINDOW."""
+    # Floored to the minute readings arrive at, so renders share the read API's caches
+    now = pd.Timestamp.now("UTC").tz_localize(None).floor("min")
     try:
-        conn = pymssql.connect(
-            server=DB_CONFIG["host"],
-            user=DB_CONFIG["username"],
-            password=DB_CONFIG["password"],
-            database=DB_CONFIG["database"],
-            port=DB_CONFIG["port"],
-        )
-        return conn
-    except pymssql.OperationalError as e:
-        st.error(f"Failed to connect to RDS: {e}")
-        return None
-
-
-def fetch_real_time_data_from_rds(selected_plant: str) -> pd.DataFrame:
-    """Fetch the latest real-time data for a specific plant."""
-    conn = get_rds_connection()
-    if not conn:
+        return get_read_api().readings([plant_id], now - REAL_TIME_WINDOW, None)
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Error fetching real-time data: {e}")
         return pd.DataFrame()
 
-    query = f"""
-        SELECT 
-            p.plant_name,
-            r.soil_moisture,
-            r.temperature,
-            r.last_watered,
-            r.recording_at,
-            b.first_name,
-            b.last_name,
-            b.email,
-            b.phone
-        FROM 
-            {SCHEMA_NAME}.recording r
-        JOIN 
-            {SCHEMA_NAME}.plant p
-        ON 
-            r.plant_id = p.plant_id
-        JOIN 
-            {SCHEMA_NAME}.botanist b
-        ON
-            p.botanist_id = b.botanist_id
-        WHERE 
-            p.plant_name = '{selected_plant}'
-        ORDER BY 
-            r.recording_at DESC;
+
+def fetch_readings(plant_id: int, start: datetime, end: datetime) -> pd.DataFrame:
+    """
+    Fetch one plant's readings between two times, from RDS for the readings not yet
+    archived and from the archive for the rest.
     """
+    try:
+        return get_read_api().readings([plant_id], start, end)
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Error fetching plant readings: {e}")
+        return pd.DataFrame()
 
-    dataframe = pd.read_sql(query, conn)
-    conn.close()
-    return dataframe
 
+def fetch_chart_payload(plant_id: int, window: str) -> pd.DataFrame:
+    """
+    Fetch the downsampled chart series the pipeline keeps for one plant over a
+    standard window, already sorted by time.
+    """
+    try:
+        return get_read_api().chart_payload(plant_id, window)
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Error fetching chart data: {e}")
+        return pd.DataFrame()
 
-def get_plant_names() -> list:
-    """Fetch a list of plant names from the database."""
-    conn = get_rds_connection()
-    if not conn:
-        return []
 
-    query = f"SELECT DISTINCT plant_name FROM {SCHEMA_NAME}.plant;"
-    dataframe = pd.read_sql(query, conn)
-    conn.close()
-    return dataframe["plant_name"].tolist()
+def get_all_plants() -> dict:
+    """Every plant in RDS or the archive by plant_id."""
+    try:
+        return get_read_api().plants()
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Failed to list plants: {e}")
+        return {}
 
 
-def get_file_key(date: str) -> str:
-    """Generate the S3 file key based on the given date."""
-    return f"{FOLDER}{date}.parquet"
+def get_archive_range() -> tuple:
+    """First and last archived reading times, both None if nothing is archived."""
+    try:
+        return get_read_api().archive_range()
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Failed to read the archive catalog: {e}")
+        return None, None
 
 
-def fetch_data_from_s3(bucket: str, file_key: str) -> pd.DataFrame:
-    """Fetch the Parquet file from S3 and return a DataFrame."""
-    s3_client = boto3.client("s3")
+def fetch_plant_summary(start_date: datetime, end_date: datetime,
+                        dry_below: float) -> pd.DataFrame:
+    """Per-plant statistics over the archive, driest plants first."""
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=file_key)
-        dataframe = pd.read_parquet(BytesIO(response["Body"].read()))
-        return dataframe
-    except s3_client.exceptions.NoSuchKey:
-        st.error(f"Data for the selected date ({file_key}) not found in S3.")
+        return get_read_api().plant_summary(start_date, end_date, dry_below)
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Error querying the archive: {e}")
         return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error fetching data from S3: {e}")
+
+
+def fetch_daily_means(plant_ids: tuple, start_date: datetime, end_date: datetime,
+                      column: str) -> pd.DataFrame:
+    """Daily means of one reading for the given plants over the archive."""
+    try:
+        return get_read_api().daily_means(list(plant_ids), start_date, end_date, column)
+    except Exception as e:  # pylint: disable=broad-except
+        st.error(f"Error querying the archive: {e}")
         return pd.DataFrame()
 
 
+def fetch_rolling_stats() -> dict:
+    """
+    Fetch the per-plant rolling statistics written by the minute pipeline,
+    merged across shards when the pipeline runs sharded.
+    """
+    try:
+        return get_read_api().rolling_stats()
+    except Exception:  # pylint: disable=broad-except
+        return {}
+
+
+def as_datetime(column: pd.Series) -> pd.Series:
+    """Return the column as datetimes, only parsing it if it is not already typed."""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, errors="coerce")
+
+
+@profiler.profiled("render_real_time_dashboard")
 def render_real_time_dashboard():
     """Render the real-time data dashboard."""
-    plant_list = get_plant_names()
-    selected_plant = st.sidebar.selectbox("Select Plant by Name", plant_list)
+    plant_ids = {name: plant_id for plant_id, name in get_all_plants().items()}
+    selected_plant = st.sidebar.selectbox("Select Plant by Name", list(plant_ids))
+
+    time_range = st.sidebar.selectbox("Trend Window", list(TIME_RANGES), index=1)
 
     if not selected_plant:
         st.warning("Please select a plant to view real-time data.")
         return
 
-    dataframe = fetch_real_time_data_from_rds(selected_plant)
+    dataframe = fetch_real_time_data(plant_ids[selected_plant])
 
     if dataframe.empty:
         st.warning(f"No real-time data available for {selected_plant}.")
         return
 
-    display_real_time_data(dataframe, selected_plant)
+    chart_data = fetch_chart_payload(plant_ids[selected_plant], TIME_RANGES[time_range][0])
+    display_real_time_data(dataframe, selected_plant, chart_data)
 
 
-def display_real_time_data(dataframe: pd.DataFrame, selected_plant: str) -> None:
-    """Display the latest temperature and moisture readings for the selected plant."""
-    dataframe["recording_at"] = pd.to_datetime(
-        dataframe["recording_at"], errors="coerce"
-    )
+def time_axis_format(times: pd.Series) -> str:
+    """Axis label format for a series of times, with the date once it spans days."""
+    if times.max() - times.min() > timedelta(days=1):
+        return "%d-%m/ %H:%M"
+    return "%H:%M"
+
+
+def display_real_time_data(dataframe: pd.DataFrame, selected_plant: str,
+                           chart_data: pd.DataFrame = None) -> None:
+    """
+    Display the latest temperature and moisture readings for the selected plant, with
+    trends from the chart payload, or from the readings if there is none.
+    """
+    dataframe["recording_at"] = as_datetime(dataframe["recording_at"])
 
     latest_data = dataframe.sort_values(
         "recording_at", ascending=False).iloc[0]
@@ -155,17 +195,33 @@ def display_real_time_data(dataframe: pd.DataFrame, selected_plant: str) -> None
         else "N/A",
     )
 
+    plant_stats = fetch_rolling_stats().get(str(latest_data["plant_id"]), {})
+    if plant_stats:
+        st.sidebar.header("Rolling Statistics")
+        for metric, label, unit in (("temperature", "Temperature", "°C"),
+                                    ("soil_moisture", "Soil Moisture", "%")):
+            summary = plant_stats.get(metric)
+            if summary:
+                st.sidebar.markdown(
+                    f"**{label}:** {summary['mean']:.1f}{unit} ± {summary['std']:.1f} "
+                    f"(range {summary['min']:.1f}-{summary['max']:.1f}, "
+                    f"last {summary['count']} readings)")
+
     st.sidebar.header("Botanist Information")
     st.sidebar.markdown(f"""
-        **Name:** {latest_data['first_name']} {latest_data['last_name']}  
-        **Email:** {latest_data['email']}  
-        **Phone:** {latest_data['phone']}""")
+        **Name:** {latest_data['botanist_first_name']} {latest_data['botanist_last_name']}  
+        **Email:** {latest_data['botanist_email']}  
+        **Phone:** {latest_data['botanist_phone']}""")
 
     st.header(f"{selected_plant}")
 
+    if chart_data is None or chart_data.empty:
+        chart_data = dataframe
+    axis_format = time_axis_format(chart_data["recording_at"])
+
     st.subheader("Real-Time Temperature Trend")
-    temperature_chart = alt.Chart(dataframe).mark_line(color="forestgreen").encode(
-        x=alt.X("recording_at:T", title="Time", axis=alt.Axis(format="%H:%M")),
+    temperature_chart = alt.Chart(chart_data).mark_line(color="forestgreen").encode(
+        x=alt.X("recording_at:T", title="Time", axis=alt.Axis(format=axis_format)),
         y=alt.Y("temperature:Q", title="Temperature (°C)"),
     ).properties(
         width=700,
@@ -174,8 +230,8 @@ def display_real_time_data(dataframe: pd.DataFrame, selected_plant: str) -> None
     st.altair_chart(temperature_chart, use_container_width=True)
 
     st.subheader("Real-Time Soil Moisture Trend")
-    moisture_chart = alt.Chart(dataframe).mark_line(color="forestgreen").encode(
-        x=alt.X("recording_at:T", title="Time", axis=alt.Axis(format="%H:%M")),
+    moisture_chart = alt.Chart(chart_data).mark_line(color="forestgreen").encode(
+        x=alt.X("recording_at:T", title="Time", axis=alt.Axis(format=axis_format)),
         y=alt.Y("soil_moisture:Q", title="Soil Moisture (%)"),
     ).properties(
         width=700,
@@ -184,23 +240,105 @@ def display_real_time_data(dataframe: pd.DataFrame, selected_plant: str) -> None
     st.altair_chart(moisture_chart, use_container_width=True)
 
 
-def render_historical_dashboard(dataframe: pd.DataFrame):
-    """Render the historical data dashboard."""
+@profiler.profiled("render_historical_dashboard")
+def render_historical_dashboard():
+    """Render the historical data dashboard over RDS and the archive."""
+    plant_ids = {name: plant_id for plant_id, name in get_all_plants().items()}
+    selected_plant = st.sidebar.selectbox("Select Plant by Name", list(plant_ids))
+    time_range = st.sidebar.selectbox("Time Range", [*TIME_RANGES, "Custom"])
+
+    # Readings are stored as naive UTC and arrive once a minute
+    now = pd.Timestamp.now("UTC").tz_localize(None).floor("min")
+    if time_range == "Custom":
+        first = get_archive_range()[0]
+        start_date = st.sidebar.date_input(
+            "Start Date", now - timedelta(1),
+            min_value=first.to_pydatetime() if first is not None else None)
+        end_date = st.sidebar.date_input("End Date", now)
+        if start_date > end_date:
+            st.warning("Start date cannot be after end date.")
+            return
+        # The end date is inclusive, so readings are kept up to midnight after it
+        start_date, end_date = pd.to_datetime(start_date), pd.to_datetime(end_date) + timedelta(1)
+    else:
+        start_date, end_date = now - TIME_RANGES[time_range][1], now
 
-    plant_list = dataframe["plant_name"].unique()
-    selected_plant = st.sidebar.selectbox("Select Plant by Name", plant_list)
-    start_date = st.sidebar.date_input("Start Date", datetime.today()-timedelta(1)).strftime(
-        "%Y-%m-%d"
-    )
-    end_date = st.sidebar.date_input(
-        "End Date", datetime.today()).strftime("%Y-%m-%d")
+    if not selected_plant:
+        st.warning("Please select a plant to view historical data.")
+        return
 
-    if start_date > end_date:
-        st.warning("Start date cannot be after end date.")
+    render_export_controls(plant_ids, selected_plant, start_date, end_date)
+
+    # Preset ranges are charted from the pipeline's payloads, whatever the history size
+    dataframe = pd.DataFrame()
+    if time_range != "Custom":
+        dataframe = fetch_chart_payload(plant_ids[selected_plant], TIME_RANGES[time_range][0])
+    if dataframe.empty:
+        dataframe = fetch_readings(plant_ids[selected_plant], start_date, end_date)
+    if dataframe.empty:
+        st.warning(f"No data available for {selected_plant} in this time range.")
         return
 
-    display_historical_data(dataframe, selected_plant, pd.to_datetime(
-        start_date), pd.to_datetime(end_date))
+    display_historical_data(dataframe, selected_plant, start_date, end_date)
+
+
+def render_export_controls(plant_ids: dict, selected_plant: str,
+                           start_date: datetime, end_date: datetime) -> None:
+    """
+    Export the chosen plants over the selected range. The read API streams the file in
+    chunks, which are written to a file under an unguessable name in the static folder
+    and downloaded from there. Behind a load balancer at READ_API_PUBLIC_URL, browsers
+    download the stream directly instead.
+    """
+    st.sidebar.header("Export Readings")
+    export_plants = st.sidebar.multiselect("Plants to Export", list(plant_ids),
+                                           default=[selected_plant])
+    export_format = st.sidebar.radio("Format", list(EXPORT_FORMATS), horizontal=True)
+    if not export_plants:
+        st.sidebar.caption("Select at least one plant to export.")
+        return
+    selected_ids = [plant_ids[name] for name in export_plants]
+    file_format = EXPORT_FORMATS[export_format]
+    if READ_API_PUBLIC_URL:
+        st.sidebar.link_button(
+            f"Download {export_format}",
+            get_read_api().export_url(selected_ids, start_date, end_date, file_format,
+                                      base_url=READ_API_PUBLIC_URL))
+        return
+    request = (tuple(selected_ids), str(start_date), str(end_date), file_format)
+    if st.sidebar.button(f"Prepare {export_format} Export"):
+        file_name = (f"readings_{pd.Timestamp(start_date):%Y%m%d%H%M}_"
+                     f"{pd.Timestamp(end_date):%Y%m%d%H%M}.{file_format}")
+        try:
+            st.session_state["export"] = (request, write_export(
+                selected_ids, start_date, end_date, file_format, file_name))
+        except Exception as e:  # pylint: disable=broad-except
+            st.sidebar.error(f"Error exporting readings: {e}")
+            return
+    prepared = st.session_state.get("export")
+    if prepared and prepared[0] == request:
+        url, file_name = prepared[1]
+        st.sidebar.markdown(f'<a href="{url}" download="{file_name}">Download '
+                            f'{file_name}</a>', unsafe_allow_html=True)
+
+
+def write_export(plant_ids: list, start_date: datetime, end_date: datetime,
+                 file_format: str, file_name: str) -> tuple:
+    """
+    Stream an export into its own directory under EXPORT_DIR, after removing exports
+    older than EXPORT_TTL_SECONDS, and return its URL and file name.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    expired = time.time() - EXPORT_TTL_SECONDS
+    for name in os.listdir(EXPORT_DIR):
+        if os.path.getmtime(os.path.join(EXPORT_DIR, name)) < expired:
+            shutil.rmtree(os.path.join(EXPORT_DIR, name), ignore_errors=True)
+
+    token = uuid.uuid4().hex
+    os.makedirs(os.path.join(EXPORT_DIR, token))
+    get_read_api().export_to_file(os.path.join(EXPORT_DIR, token, file_name), plant_ids,
+                                  start_date, end_date, file_format)
+    return f"{EXPORT_URL}/{token}/{file_name}", file_name
 
 
 def display_historical_data(dataframe: pd.DataFrame, selected_plant: str,
@@ -209,12 +347,10 @@ def display_historical_data(dataframe: pd.DataFrame, selected_plant: str,
     if selected_plant:
         dataframe = dataframe[dataframe["plant_name"] == selected_plant]
 
-    dataframe["recording_at"] = pd.to_datetime(
-        dataframe["recording_at"], errors="coerce"
-    )
+    dataframe["recording_at"] = as_datetime(dataframe["recording_at"])
     dataframe = dataframe[
         (dataframe["recording_at"] >= start_date) & (
-            dataframe["recording_at"] <= end_date)
+            dataframe["recording_at"] < end_date)
     ]
 
     st.header(f"{selected_plant}")
@@ -242,18 +378,73 @@ def display_historical_data(dataframe: pd.DataFrame, selected_plant: str,
     st.altair_chart(moisture_chart, use_container_width=True)
 
 
+@profiler.profiled("render_comparison_dashboard")
+def render_comparison_dashboard():
+    """Render the comparison of every plant over a period of the archive."""
+    first, last = get_archive_range()
+    if last is None:
+        st.warning("No archived data available yet.")
+        return
+
+    start_date = st.sidebar.date_input(
+        "Start Date", max(first, last - timedelta(30)).to_pydatetime(),
+        min_value=first.to_pydatetime(), max_value=last.to_pydatetime())
+    end_date = st.sidebar.date_input(
+        "End Date", last.to_pydatetime(),
+        min_value=first.to_pydatetime(), max_value=last.to_pydatetime())
+    dry_below = st.sidebar.slider("Dry Below Soil Moisture (%)", 0, 100, 20)
+    if start_date > end_date:
+        st.warning("Start date cannot be after end date.")
+        return
+    # The end date is inclusive, so readings are kept up to midnight after it
+    start_date, end_date = pd.to_datetime(start_date), pd.to_datetime(end_date) + timedelta(1)
+
+    summary = fetch_plant_summary(start_date, end_date, float(dry_below))
+    if summary.empty:
+        st.warning("No archived data available in this date range.")
+        return
+
+    st.header("Plant Comparison")
+    st.subheader(f"Share of Readings Below {dry_below}% Soil Moisture")
+    dry_chart = alt.Chart(summary.head(20)).mark_bar(color="forestgreen").encode(
+        x=alt.X("dry_share:Q", title="Share of Readings", axis=alt.Axis(format="%")),
+        y=alt.Y("plant_name:N", title="Plant", sort="-x"),
+        tooltip=["plant_id", "plant_name", "dry_readings", "readings"],
+    )
+    st.altair_chart(dry_chart, use_container_width=True)
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+    names = dict(zip(summary["plant_id"], summary["plant_name"]))
+    selected = st.multiselect("Compare Plants", list(names), default=list(names)[:5],
+                              format_func=lambda plant_id: f"{names[plant_id]} ({plant_id})")
+    metric = st.selectbox("Reading", ["soil_moisture", "temperature"],
+                          format_func=lambda column: column.replace("_", " ").title())
+    if not selected:
+        return
+    daily = fetch_daily_means(tuple(selected), start_date, end_date, metric)
+    if daily.empty:
+        return
+    daily["plant_name"] = daily["plant_id"].map(names)
+    st.subheader("Daily Mean")
+    daily_chart = alt.Chart(daily).mark_line().encode(
+        x=alt.X("day:T", title="Date"),
+        y=alt.Y(f"{metric}:Q", title=metric.replace("_", " ").title()),
+        color=alt.Color("plant_name:N", title="Plant"),
+    )
+    st.altair_chart(daily_chart, use_container_width=True)
+
+
 def run_streamlit():
     """Main function to run the Streamlit app."""
     st.sidebar.title("Navigation")
-    page = st.sidebar.radio("Select Dashboard", ["Real-Time", "Historical"])
+    page = st.sidebar.radio("Select Dashboard", ["Real-Time", "Historical", "Comparison"])
 
     if page == "Real-Time":
         render_real_time_dashboard()
     elif page == "Historical":
-        current_date = datetime.today().strftime("%Y-%m-%d")
-        file_key = get_file_key(current_date)
-        dataframe = fetch_data_from_s3(S3_BUCKET, file_key)
-        render_historical_dashboard(dataframe)
+        render_historical_dashboard()
+    elif page == "Comparison":
+        render_comparison_dashboard()
 
 
 if __name__ == "__main__":
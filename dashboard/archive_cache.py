@@ -0,0 +1,145 @@
+"""
+Local on-disk cache of archive files downloaded from S3.
+
+Each Parquet object is stored once as an uncompressed Arrow IPC file, keyed by its S3 key
+and ETag, and read back through a memory map. Repeat views of a day therefore cost no
+download and no parse, and the pages are shared through the OS page cache instead of
+being copied into every session. The cache has a size budget and evicts the least
+recently used files when it is exceeded.
+
+Files are memory-mapped while the cache lock is held, so eviction cannot delete a file
+between finding it and mapping it. A file evicted later stays readable through the maps
+already made of it, until they are released.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logging.basicConfig(level=logging.INFO)
+
+CACHE_DIR = os.getenv("ARCHIVE_CACHE_DIR", "/tmp/archive_cache")
+MAX_BYTES = int(float(os.getenv("ARCHIVE_CACHE_MB", "512")) * 2**20)
+INDEX_FILE = "index.json"
+
+
+class ArchiveCache:
+    """LRU cache of S3 archive objects as memory-mapped Arrow IPC files."""
+
+    def __init__(self, s3_client, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.s3_client = s3_client
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.load_index()
+        self.hits = 0
+        self.misses = 0
+
+    def load_index(self) -> dict:
+        """Read the index of cached files, dropping entries whose file has gone."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as file:
+            index = json.load(file)
+        return {key: entry for key, entry in index.items()
+                if os.path.exists(os.path.join(self.directory, entry["file"]))}
+
+    def save_index(self) -> None:
+        """Write the index atomically."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self.index, file)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def file_name(cache_key: str, etag: str) -> str:
+        """Cache file name for one version of an object."""
+        return hashlib.sha1(f"{cache_key}|{etag}".encode("utf-8")).hexdigest() + ".arrow"
+
+    def read(self, bucket: str, key: str, revalidate: bool = True) -> pa.Table:
+        """
+        Return an archive object as a memory-mapped Arrow table.
+
+        With `revalidate`, a cached copy is only used if the object's ETag is unchanged,
+        which costs one HEAD request. Past days' files never change, so callers can skip
+        revalidation for them and avoid the network entirely.
+        """
+        cache_key = f"{bucket}/{key}"
+        with self.lock:
+            entry = self.index.get(cache_key)
+
+        if entry and revalidate:
+            etag = self.s3_client.head_object(Bucket=bucket, Key=key)["ETag"]
+            if etag != entry["etag"]:
+                entry = None
+
+        if entry:
+            with self.lock:
+                # The entry may have been evicted or replaced during the HEAD request
+                if self.index.get(cache_key) is entry:
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    return self.open(entry["file"])
+
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        table = pq.read_table(BytesIO(response["Body"].read()))
+        return self.store(cache_key, response.get("ETag", ""), table)
+
+    def open(self, file_name: str) -> pa.Table:
+        """
+        Memory-map a cached file; its pages are only loaded when read. Called with the
+        lock held, so the file cannot be evicted until it is mapped.
+        """
+        source = pa.memory_map(os.path.join(self.directory, file_name), "r")
+        return pa.ipc.open_file(source).read_all()
+
+    def store(self, cache_key: str, etag: str, table: pa.Table) -> pa.Table:
+        """
+        Write a table to the cache, evicting old files if over budget, and return it
+        memory-mapped from the cached file.
+        """
+        file_name = self.file_name(cache_key, etag)
+        path = os.path.join(self.directory, file_name)
+        with pa.OSFile(f"{path}.tmp", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+
+        with self.lock:
+            self.misses += 1
+            previous = self.index.get(cache_key)
+            if previous and previous["file"] != file_name:
+                self.remove(previous["file"])
+            self.index[cache_key] = {"etag": etag, "file": file_name,
+                                     "size": os.path.getsize(path), "last_used": time.time()}
+            self.evict(keep=cache_key)
+            self.save_index()
+            return self.open(file_name)
+
+    def evict(self, keep: str) -> None:
+        """Remove least recently used files until the cache fits its budget."""
+        total = sum(entry["size"] for entry in self.index.values())
+        for cache_key, entry in sorted(self.index.items(),
+                                       key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if cache_key == keep:
+                continue
+            self.remove(entry["file"])
+            del self.index[cache_key]
+            total -= entry["size"]
+            logging.info("Evicted %s from the archive cache.", cache_key)
+
+    def remove(self, file_name: str) -> None:
+        """Delete a cached file if it still exists."""
+        try:
+            os.remove(os.path.join(self.directory, file_name))
+        except FileNotFoundError:
+            pass
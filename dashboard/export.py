@@ -0,0 +1,117 @@
+"""
+Streaming export of plant readings as CSV or Parquet.
+
+An export is read through the tiered reader one time chunk at a time, EXPORT_CHUNK_HOURS
+hours by default, and each chunk is encoded and handed on before the next one is read.
+Only one chunk of readings is held in memory however long the range is, and the tier
+caches are bypassed so an export does not fill them. Ranges are capped at
+EXPORT_MAX_DAYS. CSV chunks are appended without repeating the header, and each Parquet
+chunk is written as one row group of a single file.
+"""
+import io
+import os
+import logging
+from typing import Iterator
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tiered_reader import READING_SCHEMA, TieredReader, output_columns
+
+logging.basicConfig(level=logging.INFO)
+
+EXPORT_CHUNK = pd.Timedelta(hours=float(os.getenv("EXPORT_CHUNK_HOURS", "24")))
+EXPORT_MAX_RANGE = pd.Timedelta(days=float(os.getenv("EXPORT_MAX_DAYS", "366")))
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file whose contents are handed out and dropped as they are written."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        """Always writable."""
+        return True
+
+    def write(self, data) -> int:
+        """Keep the data until the next drain."""
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        """Bytes written in total, which the Parquet writer uses as file offsets."""
+        return self.position
+
+    def drain(self) -> bytes:
+        """Everything written since the last drain."""
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def time_chunks(start: pd.Timestamp, end: pd.Timestamp,
+                chunk: pd.Timedelta = EXPORT_CHUNK) -> Iterator[tuple]:
+    """[start, end) split into consecutive chunks aligned to the chunk size."""
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(end, (chunk_start + chunk).floor(chunk))
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+
+def frames(reader: TieredReader, plant_ids: list, start: pd.Timestamp, end: pd.Timestamp,
+           columns: list = None, chunk: pd.Timedelta = EXPORT_CHUNK) -> Iterator[pd.DataFrame]:
+    """The readings of [start, end), one non-empty chunk at a time in time order."""
+    for chunk_start, chunk_end in time_chunks(start, end, chunk):
+        dataframe = reader.read(plant_ids, chunk_start, chunk_end, columns, cache=False)
+        if not dataframe.empty:
+            yield dataframe.sort_values(["recording_at", "plant_id"], kind="stable")
+
+
+def export(reader: TieredReader, plant_ids: list, start, end, export_format: str = "csv",
+           columns: list = None, chunk: pd.Timedelta = EXPORT_CHUNK) -> Iterator[bytes]:
+    """
+    The readings of the given plants (all plants if None) in [start, end) encoded as
+    `export_format`, as a stream of byte chunks. The arguments are checked straight
+    away, and nothing is read until the stream is consumed.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, expected one of "
+                         f"{list(FORMATS)}")
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if end - start > EXPORT_MAX_RANGE:
+        raise ValueError(f"Exports are limited to {EXPORT_MAX_RANGE.days} days")
+    columns = output_columns(columns)
+    chunks = frames(reader, plant_ids, start, end, columns, chunk)
+    if export_format == "csv":
+        return csv_chunks(chunks, columns)
+    return parquet_chunks(chunks, columns)
+
+
+def csv_chunks(chunks: Iterator[pd.DataFrame], columns: list) -> Iterator[bytes]:
+    """CSV with one header row, a chunk of rows at a time."""
+    yield pd.DataFrame(columns=columns).to_csv(index=False).encode("utf-8")
+    rows = 0
+    for dataframe in chunks:
+        rows += len(dataframe)
+        yield dataframe[columns].to_csv(index=False, header=False,
+                                        date_format="%Y-%m-%d %H:%M:%S").encode("utf-8")
+    logging.info("Exported %d rows as CSV.", rows)
+
+
+def parquet_chunks(chunks: Iterator[pd.DataFrame], columns: list) -> Iterator[bytes]:
+    """A Parquet file with a row group per chunk, its bytes handed on as they are written."""
+    schema = pa.schema([READING_SCHEMA.field(name) for name in columns])
+    buffer = ChunkBuffer()
+    rows = 0
+    with pq.ParquetWriter(buffer, schema, compression="zstd") as writer:
+        for dataframe in chunks:
+            rows += len(dataframe)
+            writer.write_table(pa.Table.from_pandas(dataframe[columns], schema=schema,
+                                                    preserve_index=False))
+            yield buffer.drain()
+    yield buffer.drain()
+    logging.info("Exported %d rows as Parquet.", rows)
@@ -0,0 +1,500 @@
+"""
+Read API service between the dashboard and RDS and S3.
+
+Every Streamlit session used to open its own RDS connections and download from S3, so
+concurrent users multiplied the load on both. This service runs next to the dashboard and
+owns one bounded pool of RDS connections, the tiered reader with its result caches, the
+on-disk archive cache and the archive query layer, and every session reads through it.
+
+Time-range endpoints return Arrow IPC streams, or compact JSON with `format=json`, and
+are paginated with a cursor on (plant_id, recording_at), so pages stay consistent while
+new readings arrive. Identical requests that arrive while one is already being fetched
+wait for that fetch instead of starting their own.
+"""
+# pylint: disable=wrong-import-position
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import boto3
+import pandas as pd
+import pymssql
+from dotenv import load_dotenv
+
+# Shared modules live in ../pipeline locally and are copied alongside the service in the image
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+from archive_cache import ArchiveCache
+from archive_catalog import ArchiveCatalog
+from archive_query import ArchiveQuery, daily_means
+import chart_payloads
+import export
+import rolling_stats
+from read_api_client import ARROW_TYPE, JSON_TYPE, NEXT_CURSOR_HEADER, write_ipc
+from tiered_reader import TieredReader, ResultCache
+
+load_dotenv(override=True)
+logging.basicConfig(level=logging.INFO)
+
+READ_API_HOST = os.getenv("READ_API_HOST", "127.0.0.1")
+READ_API_PORT = int(os.getenv("READ_API_PORT", "8502"))
+POOL_SIZE = int(os.getenv("READ_API_POOL_SIZE", "4"))
+PAGE_ROWS = int(os.getenv("READ_API_PAGE_ROWS", "50000"))
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+ARCHIVE_RESULT_SECONDS = float(os.getenv("ARCHIVE_RESULT_SECONDS", "600"))
+STATS_RESULT_SECONDS = float(os.getenv("STATS_RESULT_SECONDS", "60"))
+S3_BUCKET = os.getenv("S3_BUCKET", "c14-team-growth-storage")
+FOLDER = "plant_data/"
+
+
+class PooledConnection:
+    """A connection borrowed from a pool. Closing it hands it back."""
+
+    def __init__(self, pool: "ConnectionPool", connection):
+        self.pool = pool
+        self.connection = connection
+        self.broken = False
+
+    @contextmanager
+    def cursor(self):
+        """A cursor of the connection. A database error marks the connection as broken."""
+        try:
+            with self.connection.cursor() as cursor:
+                yield cursor
+        except pymssql.Error:
+            self.broken = True
+            raise
+
+    def close(self) -> None:
+        """Return the connection to the pool, or discard it if it is broken."""
+        if self.connection is not None:
+            self.pool.release(self.connection, self.broken)
+            self.connection = None
+
+
+class ConnectionPool:
+    """
+    At most `size` database connections shared by every request. Idle connections are
+    reused, and requests wait for one to be returned when all are in use.
+    """
+
+    def __init__(self, connect, size: int = POOL_SIZE):
+        self.connect = connect
+        self.size = size
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def acquire(self) -> PooledConnection:
+        """Borrow a connection, opening one if none is idle."""
+        self.slots.acquire()
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                self.slots.release()
+                raise
+            with self.lock:
+                self.opened += 1
+        return PooledConnection(self, connection)
+
+    def release(self, connection, broken: bool = False) -> None:
+        """Take a connection back, closing it instead if it is broken."""
+        if broken:
+            try:
+                connection.close()
+            except pymssql.Error as e:
+                logging.warning("Failed to close a broken connection: %s", e)
+        else:
+            with self.lock:
+                self.idle.append(connection)
+        self.slots.release()
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class Coalescer:
+    """Runs identical concurrent calls once and hands every caller the same result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.fetches = 0
+        self.coalesced = 0
+
+    def run(self, key, compute):
+        """The result of `compute()`, shared with any call for `key` already in flight."""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                self.fetches += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(compute())
+            except Exception as e:  # pylint: disable=broad-except
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+        return future.result()
+
+
+def encode_cursor(plant_id: int, recording_at: pd.Timestamp) -> str:
+    """Cursor of the page that starts after the given reading."""
+    return f"{int(plant_id)}|{pd.Timestamp(recording_at).isoformat()}"
+
+
+def paginate(dataframe: pd.DataFrame, cursor: str = None, limit: int = PAGE_ROWS) -> tuple:
+    """
+    The page of readings sorted by plant_id and recording_at that follows `cursor`, and
+    the cursor of the next page, or None if this is the last page.
+    """
+    start = 0
+    if cursor:
+        plant_id, recording_at = cursor.split("|", 1)
+        plant_id, recording_at = int(plant_id), pd.Timestamp(recording_at)
+        after = ((dataframe["plant_id"] > plant_id) | (
+            (dataframe["plant_id"] == plant_id) & (dataframe["recording_at"] > recording_at))
+        ).to_numpy()
+        start = int(after.argmax()) if after.any() else len(dataframe)
+    page = dataframe.iloc[start:start + limit]
+    if start + limit >= len(dataframe):
+        return page, None
+    last = page.iloc[-1]
+    return page, encode_cursor(last["plant_id"], last["recording_at"])
+
+
+class ReadService:
+    """
+    The reads the dashboard needs, over one connection pool and shared caches.
+
+    `connect` opens a pymssql-style connection. `filesystem` is the pyarrow filesystem
+    holding the archive bucket, S3 by default.
+    """
+
+    def __init__(self, connect, s3_client, schema_name: str, bucket: str = S3_BUCKET,
+                 prefix: str = FOLDER, archive_cache: ArchiveCache = None,
+                 filesystem=None, pool_size: int = POOL_SIZE,
+                 charts_location: str = chart_payloads.PAYLOADS_LOCATION,
+                 stats_location: str = rolling_stats.SNAPSHOT_LOCATION):
+        self.s3_client = s3_client
+        self.charts_location = charts_location
+        self.stats_location = stats_location
+        self.bucket = bucket
+        self.prefix = prefix
+        self.filesystem = filesystem
+        self.pool = ConnectionPool(connect, pool_size)
+        self.catalog_lock = threading.Lock()
+        self.catalog = self.query = None
+        self.catalog_refreshed = 0.0
+        # Backfills rewrite archive files under the same key, so cached copies are
+        # revalidated against the object's ETag
+        read_full = None if archive_cache is None else \
+            lambda key: archive_cache.read(bucket, key)
+        self.reader = TieredReader(self.pool.acquire, self.current_catalog, schema_name,
+                                   read_full=read_full)
+        self.coalescer = Coalescer()
+        self.archive_results = ResultCache(ARCHIVE_RESULT_SECONDS)
+        self.stats_results = ResultCache(STATS_RESULT_SECONDS)
+
+    def current_catalog(self) -> ArchiveCatalog:
+        """The archive catalog, refreshed from the manifests every CATALOG_REFRESH_SECONDS."""
+        with self.catalog_lock:
+            if self.catalog is None or \
+                    time.monotonic() - self.catalog_refreshed > CATALOG_REFRESH_SECONDS:
+                self.catalog = ArchiveCatalog(self.s3_client, self.bucket,
+                                              self.prefix).refresh()
+                self.query = ArchiveQuery(self.catalog, self.filesystem)
+                self.catalog_refreshed = time.monotonic()
+            return self.catalog
+
+    def plants(self) -> pd.DataFrame:
+        """Every plant in RDS or the archive."""
+        names = self.coalescer.run(("plants",), self.reader.plants)
+        return pd.DataFrame({"plant_id": list(names), "plant_name": list(names.values())})
+
+    def readings(self, plant_ids: list = None, start=None, end=None,
+                 columns: list = None) -> pd.DataFrame:
+        """Readings of the given plants in [start, end), sorted by plant and time."""
+        key = ("readings", None if plant_ids is None else tuple(sorted(plant_ids)),
+               start, end, None if columns is None else tuple(columns))
+        return self.coalescer.run(
+            key, lambda: self.reader.read(plant_ids, start, end, columns))
+
+    def archive_result(self, key: tuple, compute):
+        """An archive query result, cached until the archive changes or it expires."""
+        catalog = self.current_catalog()
+        key = (*key, catalog.time_range()[1], len(catalog.manifests))
+        return self.archive_results.get(key, lambda: self.coalescer.run(key, compute))
+
+    def archive_range(self) -> dict:
+        """First and last archived reading times as ISO strings, or None."""
+        return {name: None if value is None else value.isoformat()
+                for name, value in zip(("first", "last"), self.current_catalog().time_range())}
+
+    def plant_summary(self, start=None, end=None, dry_below: float = 20.0) -> pd.DataFrame:
+        """Per-plant statistics over the archive, driest plants first."""
+        return self.archive_result(("summary", start, end, dry_below),
+                                   lambda: self.query.plant_summary(start, end, dry_below))
+
+    def daily_means(self, plant_ids: list, start, end, column: str) -> pd.DataFrame:
+        """Daily means of one reading for the given plants over the archive."""
+        def compute() -> pd.DataFrame:
+            return daily_means(self.query.scan(["plant_id", "recording_at", column],
+                                               plant_ids, start, end), column)
+        return self.archive_result(
+            ("daily_means", tuple(sorted(plant_ids)), start, end, column), compute)
+
+    def rolling_stats(self) -> dict:
+        """
+        The per-plant rolling statistics written by the minute pipeline, merging the
+        per-shard snapshots when the pipeline runs sharded.
+        """
+        return self.stats_results.get(("rolling_stats",), lambda: self.coalescer.run(
+            ("rolling_stats",), lambda: rolling_stats.read_plant_summaries(
+                self.stats_location)))
+
+    def chart_payload(self, plant_id: int, window: str) -> pd.DataFrame:
+        """
+        The pipeline's downsampled chart series of one plant over a standard window, empty
+        if the pipeline has not written any.
+        """
+        if window not in chart_payloads.WINDOWS:
+            raise ValueError(f"Unknown window {window}, expected one of "
+                             f"{list(chart_payloads.WINDOWS)}")
+
+        def load() -> dict:
+            if not self.charts_location:
+                return {}
+            payloads = chart_payloads.load_all(self.charts_location)
+            return {key: series.reset_index(drop=True)
+                    for key, series in payloads.groupby(["window", "plant_id"])}
+        series = self.stats_results.get(("chart_payloads",), lambda: self.coalescer.run(
+            ("chart_payloads",), load))
+        return series.get((window, plant_id), chart_payloads.empty_payloads())
+
+    def stats(self) -> dict:
+        """Backend query, cache and coalescing counters."""
+        return {
+            "connections_opened": self.pool.opened,
+            "hot_queries": self.reader.hot_queries,
+            "cold_reads": self.reader.cold_reads,
+            "hot_cache_hits": self.reader.hot_cache.hits,
+            "cold_cache_hits": self.reader.cold_cache.hits,
+            "archive_files_scanned": 0 if self.query is None else self.query.files_scanned,
+            "archive_cache_hits": self.archive_results.hits,
+            "fetches": self.coalescer.fetches,
+            "coalesced": self.coalescer.coalesced,
+        }
+
+
+def single(params: dict, name: str, default=None):
+    """The one value of a query parameter, or `default`."""
+    values = params.get(name)
+    return values[-1] if values else default
+
+
+def plant_ids_param(params: dict) -> list:
+    """The plant_id query parameters as integers, or None if there are none."""
+    values = params.get("plant_id")
+    return None if not values else [int(value) for value in values]
+
+
+def time_param(params: dict, name: str) -> pd.Timestamp:
+    """A time query parameter as a naive UTC timestamp, or None."""
+    value = single(params, name)
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    return timestamp if timestamp.tz is None else \
+        timestamp.tz_convert("UTC").tz_localize(None)
+
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    """HTTP handler of the read API. `service` is set by `make_server`."""
+
+    service: ReadService = None
+    protocol_version = "HTTP/1.1"
+    routes = {
+        "/plants": "get_plants",
+        "/readings": "get_readings",
+        "/archive/range": "get_archive_range",
+        "/archive/summary": "get_archive_summary",
+        "/archive/daily-means": "get_daily_means",
+        "/charts": "get_chart",
+        "/export": "get_export",
+        "/rolling-stats": "get_rolling_stats",
+        "/stats": "get_stats",
+    }
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Dispatch a GET request to its endpoint."""
+        url = urlparse(self.path)
+        route = self.routes.get(url.path)
+        if route is None:
+            self.send_body(404, JSON_TYPE, json.dumps({"error": "Not found"}).encode())
+            return
+        try:
+            getattr(self, route)(parse_qs(url.query))
+        except ValueError as e:
+            self.send_body(400, JSON_TYPE, json.dumps({"error": str(e)}).encode())
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Failed to serve %s: %s", self.path, e)
+            self.send_body(500, JSON_TYPE, json.dumps({"error": str(e)}).encode())
+
+    def send_body(self, status: int, content_type: str, body: bytes, headers: dict = None):
+        """Send a complete response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_frame(self, dataframe: pd.DataFrame, params: dict, next_cursor: str = None):
+        """Send a frame as Arrow IPC, or as JSON with `format=json`."""
+        headers = {} if next_cursor is None else {NEXT_CURSOR_HEADER: next_cursor}
+        response_format = single(params, "format", "arrow")
+        if response_format == "arrow":
+            self.send_body(200, ARROW_TYPE, write_ipc(dataframe), headers)
+        elif response_format == "json":
+            self.send_body(200, JSON_TYPE, dataframe.to_json(
+                orient="split", index=False, date_format="iso", date_unit="s").encode(),
+                headers)
+        else:
+            raise ValueError(f"Unknown format {response_format}, expected arrow or json")
+
+    def get_plants(self, params: dict):
+        """GET /plants: plant_id and plant_name of every plant."""
+        self.send_frame(self.service.plants(), params)
+
+    def get_readings(self, params: dict):
+        """
+        GET /readings?plant_id=&start=&end=&columns=&limit=&cursor=: one page of readings
+        in [start, end), with the next page's cursor in the X-Next-Cursor header.
+        """
+        columns = single(params, "columns")
+        limit = min(int(single(params, "limit", PAGE_ROWS)), PAGE_ROWS)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        dataframe = self.service.readings(
+            plant_ids_param(params), time_param(params, "start"), time_param(params, "end"),
+            None if columns is None else columns.split(","))
+        page, next_cursor = paginate(dataframe, single(params, "cursor"), limit)
+        self.send_frame(page, params, next_cursor)
+
+    def get_archive_range(self, _: dict):
+        """GET /archive/range: the first and last archived reading times."""
+        self.send_body(200, JSON_TYPE, json.dumps(self.service.archive_range()).encode())
+
+    def get_archive_summary(self, params: dict):
+        """GET /archive/summary?start=&end=&dry_below=: per-plant statistics."""
+        self.send_frame(self.service.plant_summary(
+            time_param(params, "start"), time_param(params, "end"),
+            float(single(params, "dry_below", 20.0))), params)
+
+    def get_daily_means(self, params: dict):
+        """GET /archive/daily-means?plant_id=&start=&end=&column=: daily means per plant."""
+        plant_ids = plant_ids_param(params)
+        if not plant_ids:
+            raise ValueError("At least one plant_id is required")
+        self.send_frame(self.service.daily_means(
+            plant_ids, time_param(params, "start"), time_param(params, "end"),
+            single(params, "column", "soil_moisture")), params)
+
+    def get_chart(self, params: dict):
+        """GET /charts?plant_id=&window=: one plant's chart series for a window."""
+        plant_ids = plant_ids_param(params)
+        if not plant_ids:
+            raise ValueError("A plant_id is required")
+        self.send_frame(self.service.chart_payload(
+            plant_ids[0], single(params, "window", "24h")), params)
+
+    def get_export(self, params: dict):
+        """
+        GET /export?plant_id=&start=&end=&columns=&format=csv|parquet: every reading in
+        [start, end) as a file download, streamed with chunked transfer encoding.
+        """
+        start, end = time_param(params, "start"), time_param(params, "end")
+        if start is None or end is None:
+            raise ValueError("start and end are required")
+        export_format = single(params, "format", "csv")
+        columns = single(params, "columns")
+        chunks = export.export(self.service.reader, plant_ids_param(params), start, end,
+                               export_format, None if columns is None else columns.split(","))
+        self.send_response(200)
+        self.send_header("Content-Type", export.FORMATS[export_format])
+        self.send_header("Content-Disposition", f'attachment; filename="readings_'
+                         f'{start:%Y%m%d%H%M}_{end:%Y%m%d%H%M}.{export_format}"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except Exception as e:  # pylint: disable=broad-except
+            # The status has already been sent, so the download is cut short instead
+            logging.error("Export of %s failed part way: %s", self.path, e)
+            self.close_connection = True
+
+    def get_rolling_stats(self, _: dict):
+        """GET /rolling-stats: the minute pipeline's rolling statistics."""
+        self.send_body(200, JSON_TYPE, json.dumps(self.service.rolling_stats()).encode())
+
+    def get_stats(self, _: dict):
+        """GET /stats: the service's counters."""
+        self.send_body(200, JSON_TYPE, json.dumps(self.service.stats()).encode())
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests at debug level instead of to stderr."""
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(service: ReadService, host: str = READ_API_HOST,
+                port: int = READ_API_PORT) -> ThreadingHTTPServer:
+    """A threaded HTTP server serving the read API for `service`."""
+    handler = type("BoundReadApiHandler", (ReadApiHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main() -> None:
+    """Serve the read API until interrupted."""
+    s3_client = boto3.client("s3")
+    service = ReadService(
+        lambda: pymssql.connect(server=os.getenv("DB_HOST"), user=os.getenv("DB_USER"),
+                                password=os.getenv("DB_PASSWORD"),
+                                database=os.getenv("DB_NAME"), port=os.getenv("DB_PORT")),
+        s3_client, os.getenv("SCHEMA_NAME"), archive_cache=ArchiveCache(s3_client))
+    server = make_server(service)
+    logging.info("Read API listening on %s:%d.", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.pool.close()
+
+
+if __name__ == "__main__":
+    main()
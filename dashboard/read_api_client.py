@@ -0,0 +1,164 @@
+"""
+Client of the read API service (`read_api.py`), used by the dashboard.
+
+Frames travel as Arrow IPC streams, so column types arrive intact and nothing is parsed
+on the dashboard's side. Time-range endpoints are paginated: each page names the cursor
+of the next one in a response header, and the client follows it until the range is done.
+"""
+import os
+import logging
+from typing import Iterator
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import requests
+
+logging.basicConfig(level=logging.INFO)
+
+READ_API_URL = os.getenv("READ_API_URL", "http://127.0.0.1:8502")
+READ_API_TIMEOUT = float(os.getenv("READ_API_TIMEOUT", "60"))
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+JSON_TYPE = "application/json"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def write_ipc(dataframe: pd.DataFrame) -> bytes:
+    """A DataFrame as an Arrow IPC stream."""
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def read_ipc(data: bytes) -> pd.DataFrame:
+    """A DataFrame from an Arrow IPC stream."""
+    return ipc.open_stream(pa.BufferReader(data)).read_all().to_pandas()
+
+
+def time_param(value) -> str:
+    """A time as the ISO string the API expects, or None."""
+    return None if value is None else pd.Timestamp(value).isoformat()
+
+
+class ReadApiClient:
+    """Calls the read API over HTTP with one keep-alive session."""
+
+    def __init__(self, base_url: str = READ_API_URL, session: requests.Session = None,
+                 timeout: float = READ_API_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def get(self, path: str, params: dict = None) -> requests.Response:
+        """GET an endpoint, raising on an error status."""
+        try:
+            response = self.session.get(f"{self.base_url}{path}", params=params,
+                                        timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.error("Read API request to %s failed: %s", path, e)
+            raise
+        return response
+
+    def frame(self, path: str, params: dict = None) -> pd.DataFrame:
+        """Every page of a frame endpoint as one DataFrame."""
+        params = {**(params or {}), "format": "arrow"}
+        pages = []
+        while True:
+            response = self.get(path, params)
+            pages.append(read_ipc(response.content))
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if not cursor:
+                break
+            params["cursor"] = cursor
+        if len(pages) == 1:
+            return pages[0]
+        return pd.concat(pages, ignore_index=True)
+
+    def plants(self) -> dict:
+        """Names of every plant in RDS or the archive, by plant_id."""
+        dataframe = self.frame("/plants")
+        return dict(zip(dataframe["plant_id"].tolist(), dataframe["plant_name"]))
+
+    def readings(self, plant_ids: list = None, start=None, end=None,
+                 columns: list = None) -> pd.DataFrame:
+        """Readings of the given plants in [start, end) across RDS and the archive."""
+        return self.frame("/readings", {
+            "plant_id": plant_ids, "start": time_param(start), "end": time_param(end),
+            "columns": None if columns is None else ",".join(columns)})
+
+    def archive_range(self) -> tuple:
+        """First and last archived reading times, both None if nothing is archived."""
+        times = self.get("/archive/range").json()
+        return tuple(None if times[name] is None else pd.Timestamp(times[name])
+                     for name in ("first", "last"))
+
+    def plant_summary(self, start=None, end=None, dry_below: float = 20.0) -> pd.DataFrame:
+        """Per-plant statistics over the archive, driest plants first."""
+        return self.frame("/archive/summary", {
+            "start": time_param(start), "end": time_param(end), "dry_below": dry_below})
+
+    def daily_means(self, plant_ids: list, start, end, column: str) -> pd.DataFrame:
+        """Daily means of one reading for the given plants over the archive."""
+        return self.frame("/archive/daily-means", {
+            "plant_id": plant_ids, "start": time_param(start), "end": time_param(end),
+            "column": column})
+
+    def chart_payload(self, plant_id: int, window: str) -> pd.DataFrame:
+        """The pipeline's downsampled chart series of one plant over a standard window."""
+        return self.frame("/charts", {"plant_id": plant_id, "window": window})
+
+    def export_params(self, plant_ids: list, start, end, export_format: str = "csv",
+                      columns: list = None) -> dict:
+        """Query parameters of an export."""
+        return {"plant_id": plant_ids, "start": time_param(start), "end": time_param(end),
+                "format": export_format,
+                "columns": None if columns is None else ",".join(columns)}
+
+    def export_url(self, plant_ids: list, start, end, export_format: str = "csv",
+                   columns: list = None, base_url: str = None) -> str:
+        """
+        URL a browser can download an export from, streamed by the service itself.
+        `base_url` is where browsers reach the service, if not at the client's URL.
+        """
+        return requests.Request("GET", f"{(base_url or self.base_url).rstrip('/')}/export",
+                                params=self.export_params(plant_ids, start, end,
+                                                          export_format, columns)
+                                ).prepare().url
+
+    def export(self, plant_ids: list, start, end, export_format: str = "csv",
+               columns: list = None, chunk_bytes: int = 2**20) -> Iterator[bytes]:
+        """An export as a stream of byte chunks."""
+        with self.session.get(f"{self.base_url}/export", stream=True, timeout=self.timeout,
+                              params=self.export_params(plant_ids, start, end,
+                                                        export_format, columns)) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_bytes)
+
+    def export_to_file(self, path: str, plant_ids: list, start, end,
+                       export_format: str = "csv", columns: list = None) -> int:
+        """
+        Write an export to `path` chunk by chunk as it is streamed, so it is never held
+        in memory whole. The file only appears once complete. Returns its size in bytes.
+        """
+        partial = f"{path}.part"
+        size = 0
+        try:
+            with open(partial, "wb") as file:
+                for chunk in self.export(plant_ids, start, end, export_format, columns):
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return size
+
+    def rolling_stats(self) -> dict:
+        """The minute pipeline's per-plant rolling statistics, by plant_id string."""
+        return self.get("/rolling-stats").json()
+
+    def stats(self) -> dict:
+        """The service's backend query, cache and coalescing counters."""
+        return self.get("/stats").json()
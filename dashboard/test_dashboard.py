@@ -0,0 +1,432 @@
+"""Tests for the dashboard's data access modules."""
+import io
+import os
+import time
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymssql
+import requests
+from archive_cache import ArchiveCache
+from read_api import Coalescer, ConnectionPool, ReadService, make_server, paginate
+from read_api_client import ReadApiClient
+# Importing read_api puts ../pipeline on the path
+import chart_payloads  # pylint: disable=wrong-import-order
+import export
+from tiered_reader import TieredReader, hot_query
+
+
+def parquet_object(dataframe: pd.DataFrame, etag: str = '"v1"') -> dict:
+    """A get_object response holding a DataFrame as Parquet."""
+    buffer = io.BytesIO()
+    dataframe.to_parquet(buffer)
+    return {"Body": io.BytesIO(buffer.getvalue()), "ETag": etag}
+
+
+class TestArchiveCache(unittest.TestCase):
+    """Tests for the on-disk archive cache."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dataframe = pd.DataFrame({"plant_id": [1, 2], "temperature": [12.5, 13.0]})
+        self.s3_client = MagicMock()
+        self.s3_client.get_object.side_effect = lambda **_: parquet_object(self.dataframe)
+        self.s3_client.head_object.return_value = {"ETag": '"v1"'}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_repeat_reads_do_not_download_again(self):
+        """Only the first read downloads the object."""
+        cache = ArchiveCache(self.s3_client, self.directory.name)
+        first = cache.read("bucket", "plant_data/2024-12-01.parquet", revalidate=False)
+        second = cache.read("bucket", "plant_data/2024-12-01.parquet", revalidate=False)
+
+        pd.testing.assert_frame_equal(first.to_pandas(), self.dataframe)
+        pd.testing.assert_frame_equal(second.to_pandas(), self.dataframe)
+        self.s3_client.get_object.assert_called_once()
+        self.s3_client.head_object.assert_not_called()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_changed_etag_downloads_again(self):
+        """A new version of the object replaces the cached one."""
+        cache = ArchiveCache(self.s3_client, self.directory.name)
+        cache.read("bucket", "plant_data/today.parquet")
+        self.s3_client.head_object.return_value = {"ETag": '"v2"'}
+        cache.read("bucket", "plant_data/today.parquet")
+
+        self.assertEqual(self.s3_client.get_object.call_count, 2)
+        self.assertEqual(len(cache.index), 1)
+
+    def test_index_survives_restart(self):
+        """A new cache over the same directory reuses the files already there."""
+        ArchiveCache(self.s3_client, self.directory.name).read(
+            "bucket", "plant_data/2024-12-01.parquet")
+        cache = ArchiveCache(self.s3_client, self.directory.name)
+        cache.read("bucket", "plant_data/2024-12-01.parquet")
+
+        self.s3_client.get_object.assert_called_once()
+
+    def test_least_recently_used_file_is_evicted(self):
+        """Files beyond the size budget are evicted oldest first."""
+        cache = ArchiveCache(self.s3_client, self.directory.name, max_bytes=1)
+        cache.read("bucket", "plant_data/2024-12-01.parquet")
+        cache.read("bucket", "plant_data/2024-12-02.parquet")
+
+        self.assertEqual(list(cache.index), ["bucket/plant_data/2024-12-02.parquet"])
+
+    def test_file_evicted_during_revalidation_is_downloaded_again(self):
+        """A read whose file is evicted while it is revalidated does not open it."""
+        cache = ArchiveCache(self.s3_client, self.directory.name, max_bytes=1)
+        cache.read("bucket", "plant_data/2024-12-01.parquet")
+
+        def evict_during_head(**_):
+            cache.read("bucket", "plant_data/2024-12-02.parquet", revalidate=False)
+            return {"ETag": '"v1"'}
+        self.s3_client.head_object.side_effect = evict_during_head
+        table = cache.read("bucket", "plant_data/2024-12-01.parquet")
+
+        pd.testing.assert_frame_equal(table.to_pandas(), self.dataframe)
+        self.assertEqual(self.s3_client.get_object.call_count, 3)
+
+    def test_evicted_file_stays_readable(self):
+        """A table read before its file is evicted can still be read afterwards."""
+        cache = ArchiveCache(self.s3_client, self.directory.name, max_bytes=1)
+        table = cache.read("bucket", "plant_data/2024-12-01.parquet")
+        cache.read("bucket", "plant_data/2024-12-02.parquet")
+
+        self.assertEqual(list(cache.index), ["bucket/plant_data/2024-12-02.parquet"])
+        pd.testing.assert_frame_equal(table.to_pandas(), self.dataframe)
+
+
+class TestTieredReader(unittest.TestCase):
+    """Tests for the reader spanning RDS and the archive."""
+
+    def setUp(self):
+        times = pd.date_range("2024-12-01 22:00", periods=6, freq="h")
+        self.archived = pd.DataFrame({
+            "plant_id": [1, 1, 1, 1], "recording_at": times[:4].as_unit("us"),
+            "temperature": [10.0, 11.0, 12.0, 13.0]})
+        self.catalog = MagicMock()
+        self.catalog.time_range.return_value = (times[0], times[3])
+        self.catalog.read_table.side_effect = lambda plant_ids, start, end, columns, **_: \
+            pa.Table.from_pandas(self.archived[self.archived["recording_at"].between(
+                start, end)][columns], preserve_index=False)
+        # RDS still holds the last archived hour alongside the newer readings
+        self.connection = MagicMock()
+        cursor = self.connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(1, 13.0, times[3].to_pydatetime()),
+                                        (1, 14.0, times[4].to_pydatetime()),
+                                        (1, 15.0, times[5].to_pydatetime())]
+        self.reader = TieredReader(lambda: self.connection, lambda: self.catalog, "gamma")
+
+    def test_read_spans_both_tiers_once(self):
+        """A window across the boundary returns each reading once, typed and sorted."""
+        dataframe = self.reader.read([1], "2024-12-01 23:00", "2024-12-02 04:00",
+                                     ["temperature"])
+
+        self.assertEqual(list(dataframe.columns), ["plant_id", "temperature", "recording_at"])
+        self.assertEqual(dataframe["temperature"].tolist(), [11.0, 12.0, 13.0, 14.0, 15.0])
+        self.assertEqual(str(dataframe["recording_at"].dtype), "datetime64[ns]")
+        self.assertEqual(str(dataframe["plant_id"].dtype), "int64")
+        self.assertEqual((self.reader.hot_queries, self.reader.cold_reads), (1, 1))
+
+    def test_each_tier_is_cached(self):
+        """Repeated reads are answered from the tier caches."""
+        for _ in range(3):
+            self.reader.read([1], "2024-12-01 23:00", "2024-12-02 04:00", ["temperature"])
+
+        self.assertEqual((self.reader.hot_queries, self.reader.cold_reads), (1, 1))
+        self.assertEqual(self.reader.hot_cache.hits, 2)
+        self.assertEqual(self.reader.cold_cache.hits, 2)
+
+    def test_windows_skip_unneeded_tiers(self):
+        """Old windows only read the archive, and without an archive only RDS is read."""
+        self.reader.read([1], "2024-11-01", "2024-11-02", ["temperature"])
+        self.assertEqual((self.reader.hot_queries, self.reader.cold_reads), (0, 1))
+
+        self.catalog.time_range.return_value = (None, None)
+        dataframe = self.reader.read([1], "2024-12-01", "2024-12-03", ["temperature"])
+        self.assertEqual((self.reader.hot_queries, self.reader.cold_reads), (1, 1))
+        self.assertEqual(len(dataframe), 3)
+
+    def test_slow_archive_reads_do_not_hold_up_rds_reads(self):
+        """A recent-only read returns while other requests are still reading the archive."""
+        started, release = threading.Semaphore(0), threading.Event()
+        read_table = self.catalog.read_table.side_effect
+
+        def slow_read_table(*args, **kwargs):
+            started.release()
+            release.wait(10)
+            return read_table(*args, **kwargs)
+        self.catalog.read_table.side_effect = slow_read_table
+        slow = [threading.Thread(target=self.reader.read, args=(
+            [1], start, "2024-12-02 04:00", ["temperature"])) for start in
+            ("2024-12-01 22:00", "2024-12-01 23:00", "2024-12-02 00:00")]
+        for thread in slow:
+            thread.start()
+        for _ in slow[:2]:
+            self.assertTrue(started.acquire(timeout=5))
+
+        began = time.monotonic()
+        dataframe = self.reader.read([1], "2024-12-02 03:00", "2024-12-02 04:00",
+                                     ["temperature"], cache=False)
+        elapsed = time.monotonic() - began
+        release.set()
+        for thread in slow:
+            thread.join(10)
+
+        self.assertLess(elapsed, 1)
+        self.assertEqual(dataframe["temperature"].tolist(), [15.0])
+
+    def test_hot_query_joins_only_needed_tables(self):
+        """The RDS query only joins plant and botanist when their columns are needed."""
+        self.assertNotIn("JOIN", hot_query("gamma", (1,), ["plant_id", "recording_at"]))
+        query = hot_query("gamma", None, ["plant_id", "plant_name", "recording_at"])
+        self.assertIn("JOIN gamma.plant p", query)
+        self.assertNotIn("botanist", query)
+        self.assertNotIn("IN (", query)
+
+
+class TestReadApi(unittest.TestCase):
+    """Tests for the read API service and its client."""
+
+    def setUp(self):
+        times = pd.date_range("2024-12-02 00:00", periods=5, freq="min")
+        self.connections = []
+        rows = [(plant_id, 10.0 + i, recorded.to_pydatetime())
+                for plant_id in (1, 2) for i, recorded in enumerate(times)]
+
+        def connect():
+            connection = MagicMock()
+            cursor = connection.cursor.return_value.__enter__.return_value
+            cursor.fetchall.side_effect = lambda: time.sleep(0.05) or rows
+            self.connections.append(connection)
+            return connection
+
+        self.service = ReadService(connect, MagicMock(), "gamma")
+        self.service.catalog = MagicMock()
+        self.service.catalog.time_range.return_value = (None, None)
+        self.service.catalog_refreshed = time.monotonic()
+        self.server = make_server(self.service, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = ReadApiClient(f"http://127.0.0.1:{self.server.server_address[1]}")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_readings_are_paged_through_with_a_cursor(self):
+        """Pages of the readings endpoint add up to the whole range, each reading once."""
+        dataframe = self.client.frame("/readings", {
+            "start": "2024-12-02T00:00:00", "end": "2024-12-03T00:00:00",
+            "columns": "temperature", "limit": 3})
+
+        self.assertEqual(len(dataframe), 10)
+        self.assertEqual(dataframe["plant_id"].tolist(), [1] * 5 + [2] * 5)
+        self.assertEqual(str(dataframe["recording_at"].dtype), "datetime64[ns]")
+        self.assertEqual(self.service.reader.hot_queries, 1)
+
+    def test_json_format(self):
+        """With format=json, frames are sent as compact split-oriented JSON."""
+        response = self.client.get("/readings", {
+            "plant_id": 1, "start": "2024-12-02", "end": "2024-12-03",
+            "columns": "temperature", "format": "json"})
+
+        body = response.json()
+        self.assertEqual(body["columns"], ["plant_id", "temperature", "recording_at"])
+        self.assertEqual(body["data"][0], [1, 10.0, "2024-12-02T00:00:00"])
+
+    def test_identical_concurrent_requests_are_coalesced(self):
+        """Concurrent identical requests share one backend query and one connection."""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.client.readings(
+            [1, 2], "2024-12-02", "2024-12-03", ["temperature"]))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(len(result) == 10 for result in results))
+        self.assertEqual(self.service.reader.hot_queries, 1)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.client.stats()["hot_queries"], 1)
+
+    def test_chart_payloads_are_served_per_plant_and_window(self):
+        """Chart series come from the pipeline's payload file, one plant and window at a time."""
+        with tempfile.TemporaryDirectory() as directory:
+            self.service.charts_location = f"{directory}/charts.arrow"
+            now = pd.Timestamp("2024-12-02 00:04")
+            readings = self.service.readings(None, "2024-12-02", "2024-12-03", ["temperature"])
+            chart_payloads.update(readings.assign(plant_name="Rose", soil_moisture=50.0),
+                                  self.service.charts_location, now)
+
+            series = self.client.chart_payload(2, "1h")
+            missing = self.client.session.get(f"{self.client.base_url}/charts",
+                                              params={"plant_id": 2, "window": "3d"})
+
+        self.assertEqual(series["plant_id"].unique().tolist(), [2])
+        self.assertEqual(series["temperature"].tolist(), [10.0, 11.0, 12.0, 13.0, 14.0])
+        self.assertEqual(missing.status_code, 400)
+
+    def test_bad_parameters_are_rejected(self):
+        """Malformed parameters get a 400 response rather than a server error."""
+        response = self.client.session.get(f"{self.client.base_url}/readings",
+                                           params={"plant_id": "one"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_is_streamed_as_csv(self):
+        """An export arrives as a chunked CSV download and leaves the tier caches empty."""
+        data = b"".join(self.client.export([1, 2], "2024-12-02", "2024-12-03",
+                                           columns=["temperature"]))
+        response = self.client.session.get(self.client.export_url(
+            [1], "2024-12-02", "2024-12-03", "parquet", ["temperature"]))
+        bad = self.client.session.get(self.client.export_url(
+            [1], "2024-12-02", "2024-12-03", "xlsx"))
+
+        lines = data.decode().splitlines()
+        self.assertEqual(lines[0], "plant_id,temperature,recording_at")
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[1], "1,10.0,2024-12-02 00:00:00")
+        self.assertEqual(response.headers["Transfer-Encoding"], "chunked")
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        self.assertEqual(pq.read_table(io.BytesIO(response.content)).num_rows, 10)
+        self.assertEqual(bad.status_code, 400)
+        self.assertFalse(self.service.reader.hot_cache.entries)
+
+    def test_export_is_written_to_a_file(self):
+        """An export written to disk appears whole, and a failed one leaves nothing."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "readings.csv")
+            size = self.client.export_to_file(path, [1, 2], "2024-12-02", "2024-12-03",
+                                              columns=["temperature"])
+            with self.assertRaises(requests.HTTPError):
+                self.client.export_to_file(os.path.join(directory, "bad.xlsx"), [1],
+                                           "2024-12-02", "2024-12-03", "xlsx")
+
+            self.assertEqual(os.path.getsize(path), size)
+            self.assertEqual(sorted(os.listdir(directory)), ["readings.csv"])
+
+
+class TestExport(unittest.TestCase):
+    """Tests for the chunked export encoders."""
+
+    def setUp(self):
+        times = pd.date_range("2024-12-01 22:00", "2024-12-03 01:00", freq="h")
+        self.readings = pd.DataFrame({
+            "plant_id": [1] * len(times), "plant_name": ["Rose"] * len(times),
+            "temperature": range(len(times)), "soil_moisture": 50.0,
+            "recording_at": times.as_unit("ns")})
+        self.reader = MagicMock()
+        self.reader.read.side_effect = lambda plant_ids, start, end, columns, cache: \
+            self.readings[(self.readings["recording_at"] >= start)
+                          & (self.readings["recording_at"] < end)][columns]
+
+    def test_time_chunks_are_aligned(self):
+        """Chunks cover the range once, breaking at chunk boundaries."""
+        chunks = list(export.time_chunks(pd.Timestamp("2024-12-01 22:00"),
+                                         pd.Timestamp("2024-12-03 01:30"), pd.Timedelta(days=1)))
+        self.assertEqual([start.strftime("%d %H:%M") for start, _ in chunks],
+                         ["01 22:00", "02 00:00", "03 00:00"])
+        self.assertEqual(chunks[-1][1], pd.Timestamp("2024-12-03 01:30"))
+
+    def test_parquet_has_a_row_group_per_chunk(self):
+        """Each chunk of readings becomes one row group, read a chunk at a time uncached."""
+        data = b"".join(export.export(self.reader, [1], "2024-12-01 22:00", "2024-12-03 02:00",
+                                      "parquet", ["temperature"], pd.Timedelta(days=1)))
+
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        self.assertEqual(parquet.read().to_pandas()["temperature"].tolist(),
+                         self.readings["temperature"].tolist())
+        self.assertEqual(self.reader.read.call_count, 3)
+        self.assertFalse(self.reader.read.call_args.kwargs["cache"])
+
+    def test_bad_arguments_are_rejected_before_reading(self):
+        """An unknown format or column fails straight away, before anything is read."""
+        with self.assertRaises(ValueError):
+            export.export(self.reader, [1], "2024-12-02", "2024-12-03", "xlsx")
+        with self.assertRaises(ValueError):
+            export.export(self.reader, [1], "2024-12-02", "2024-12-03", columns=["height"])
+        with self.assertRaises(ValueError):
+            export.export(self.reader, [1], "2023-01-01", "2024-12-03")
+        self.reader.read.assert_not_called()
+
+
+class TestReadApiParts(unittest.TestCase):
+    """Tests for the pool, coalescer and pagination behind the read API."""
+
+    def test_pool_reuses_connections_and_drops_broken_ones(self):
+        """Returned connections are reused, and ones that failed are closed."""
+        pool = ConnectionPool(MagicMock, size=2)
+        first = pool.acquire()
+        connection = first.connection
+        first.close()
+        second = pool.acquire()
+        self.assertIs(second.connection, connection)
+        second.connection.cursor.return_value.__enter__.side_effect = pymssql.OperationalError
+        with self.assertRaises(pymssql.OperationalError):
+            with second.cursor():
+                pass
+        second.close()
+
+        self.assertEqual(pool.opened, 1)
+        self.assertEqual(pool.idle, [])
+
+    def test_archive_cache_reads_are_revalidated(self):
+        """Whole-file archive reads check the cached copy is still the object in S3."""
+        archive_cache = MagicMock()
+        service = ReadService(MagicMock, MagicMock(), "gamma", bucket="bucket",
+                              archive_cache=archive_cache)
+        service.reader.read_full("plant_data/2024-12-01.parquet")
+
+        archive_cache.read.assert_called_once_with("bucket", "plant_data/2024-12-01.parquet")
+
+    def test_coalescer_runs_concurrent_calls_once(self):
+        """Calls for a key already in flight wait for it instead of running again."""
+        coalescer = Coalescer()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            coalescer.run("key", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while coalescer.fetches + coalescer.coalesced < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((len(calls), results), (1, ["result"] * 5))
+        self.assertEqual(coalescer.run("key", lambda: "again"), "again")
+
+    def test_paginate_follows_cursor_to_the_end(self):
+        """Each page starts after the previous page's cursor, and the last has none."""
+        dataframe = pd.DataFrame({
+            "plant_id": [1, 1, 2, 2, 2],
+            "recording_at": pd.to_datetime(["2024-12-02 00:00", "2024-12-02 00:01"] * 2
+                                           + ["2024-12-02 00:02"])})
+        pages, cursor = [], None
+        while True:
+            page, cursor = paginate(dataframe, cursor, limit=2)
+            pages.append(len(page))
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, [2, 2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
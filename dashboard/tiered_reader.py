@@ -0,0 +1,266 @@
+"""
+Single reader for plant readings across the hot tier in RDS and the cold tier in S3.
+
+RDS only holds the readings recorded since the archive job last ran, and everything older
+is in the Parquet archive. A read of `(plants, start, end, columns)` is split at the
+latest archived reading: the archive catalog is read up to it and RDS from shortly before
+it, so readings recorded around an archive run are never missed. Both tiers are read
+concurrently, converted to one schema, and rows present in both are kept once.
+
+Each tier has its own result cache. Hot results change every minute and are only kept
+for HOT_CACHE_SECONDS, while cold results only change when the archive does and are
+keyed by the archive boundary, so they can be kept for COLD_CACHE_SECONDS. Cold reads
+start at midnight, so sliding windows such as "last 3 days" reuse them all day.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+
+logging.basicConfig(level=logging.INFO)
+
+HOT_CACHE_SECONDS = float(os.getenv("HOT_CACHE_SECONDS", "30"))
+COLD_CACHE_SECONDS = float(os.getenv("COLD_CACHE_SECONDS", "3600"))
+CACHE_ENTRIES = int(os.getenv("TIER_CACHE_ENTRIES", "256"))
+TIER_OVERLAP = pd.Timedelta(hours=float(os.getenv("TIER_OVERLAP_HOURS", "24")))
+COLD_READ_WORKERS = int(os.getenv("TIER_COLD_READ_WORKERS", "4"))
+# Open-ended reads are bounded by dates SQL Server's DATETIME can hold
+EARLIEST = pd.Timestamp("1900-01-01")
+LATEST = pd.Timestamp("2200-01-01")
+
+READING_SCHEMA = pa.schema([
+    ("plant_id", pa.int64()),
+    ("plant_name", pa.string()),
+    ("soil_moisture", pa.float64()),
+    ("temperature", pa.float64()),
+    ("last_watered", pa.timestamp("ns")),
+    ("recording_at", pa.timestamp("ns")),
+    ("botanist_first_name", pa.string()),
+    ("botanist_last_name", pa.string()),
+    ("botanist_email", pa.string()),
+    ("botanist_phone", pa.string()),
+])
+# Column expressions of the RDS query, and the table alias each one needs
+HOT_COLUMNS = {
+    "plant_id": ("r.plant_id", "r"),
+    "plant_name": ("p.plant_name", "p"),
+    "soil_moisture": ("r.soil_moisture", "r"),
+    "temperature": ("r.temperature", "r"),
+    "last_watered": ("r.last_watered", "r"),
+    "recording_at": ("r.recording_at", "r"),
+    "botanist_first_name": ("b.first_name", "b"),
+    "botanist_last_name": ("b.last_name", "b"),
+    "botanist_email": ("b.email", "b"),
+    "botanist_phone": ("b.phone", "b"),
+}
+KEY_COLUMNS = ["plant_id", "recording_at"]
+
+
+class ResultCache:
+    """Thread-safe LRU cache of query results that expire after a fixed time."""
+
+    def __init__(self, ttl: float, max_entries: int = CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """The cached result for `key`, or the result of `compute()`, which is then cached."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        """Drop every cached result."""
+        with self.lock:
+            self.entries.clear()
+
+
+def output_columns(columns: list = None) -> list:
+    """The requested columns, always including the key columns, in schema order."""
+    if columns is None:
+        return READING_SCHEMA.names
+    unknown = set(columns) - set(READING_SCHEMA.names)
+    if unknown:
+        raise ValueError(f"Unknown columns: {sorted(unknown)}")
+    wanted = set(columns) | set(KEY_COLUMNS)
+    return [name for name in READING_SCHEMA.names if name in wanted]
+
+
+def conform(dataframe: pd.DataFrame, columns: list) -> pa.Table:
+    """A tier's rows as a table with the reader's schema, timestamps as naive UTC."""
+    dataframe = dataframe.copy()
+    for column in ("last_watered", "recording_at"):
+        if column in dataframe:
+            values = pd.to_datetime(dataframe[column])
+            if values.dt.tz is not None:
+                values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+            dataframe[column] = values
+    schema = pa.schema([READING_SCHEMA.field(name) for name in columns])
+    return pa.Table.from_pandas(dataframe[columns], preserve_index=False).cast(schema)
+
+
+def conform_table(table: pa.Table, columns: list) -> pa.Table:
+    """
+    An archive table with the reader's schema, cast without going through pandas, so
+    rows read from memory-mapped cache files are not copied until they are returned.
+    Casting a timezone-aware timestamp to a naive one keeps it in UTC.
+    """
+    schema = pa.schema([READING_SCHEMA.field(name) for name in columns])
+    return table.select(columns).cast(schema)
+
+
+def hot_query(schema_name: str, plant_ids: list, columns: list) -> str:
+    """SQL selecting the requested columns, joining only the tables they need."""
+    aliases = {HOT_COLUMNS[name][1] for name in columns}
+    query = (f"SELECT {', '.join(f'{HOT_COLUMNS[name][0]} AS {name}' for name in columns)} "
+             f"FROM {schema_name}.recording r ")
+    if aliases & {"p", "b"}:
+        query += f"JOIN {schema_name}.plant p ON r.plant_id = p.plant_id "
+    if "b" in aliases:
+        query += f"JOIN {schema_name}.botanist b ON p.botanist_id = b.botanist_id "
+    query += "WHERE r.recording_at >= %s AND r.recording_at < %s"
+    if plant_ids is not None:
+        query += f" AND r.plant_id IN ({', '.join(['%s'] * len(plant_ids))})"
+    return query
+
+
+class TieredReader:
+    """
+    Reads plant readings from RDS and the archive as one frame.
+
+    `connect` returns a new pymssql-style connection, `catalog` returns the current
+    `archive_catalog.ArchiveCatalog`, and `read_full(key)`, if given, reads a whole
+    archive file as an Arrow table, such as through the dashboard's archive cache.
+    """
+
+    def __init__(self, connect, catalog, schema_name: str, read_full=None,
+                 overlap: pd.Timedelta = TIER_OVERLAP):
+        self.connect = connect
+        self.catalog = catalog
+        self.schema_name = schema_name
+        self.read_full = read_full
+        self.overlap = overlap
+        self.hot_cache = ResultCache(HOT_CACHE_SECONDS)
+        self.cold_cache = ResultCache(COLD_CACHE_SECONDS)
+        self.executor = ThreadPoolExecutor(max_workers=COLD_READ_WORKERS,
+                                           thread_name_prefix="cold")
+        self.hot_queries = 0
+        self.cold_reads = 0
+
+    def windows(self, boundary: pd.Timestamp, start: pd.Timestamp,
+                end: pd.Timestamp) -> tuple:
+        """
+        The (start, end) of the cold and hot windows of a read given the latest archived
+        reading, either None if the tier is not needed. The cold end is inclusive and
+        the hot end exclusive.
+        """
+        if boundary is None:
+            return None, (start, end)
+        cold = (start.floor("D"), min(end, boundary)) if start <= boundary else None
+        hot_start = max(start, boundary - self.overlap)
+        hot = (hot_start, end) if hot_start < end else None
+        return cold, hot
+
+    def query_hot(self, query: str, params: tuple) -> list:
+        """Run a query on a new connection and return its rows."""
+        self.hot_queries += 1
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+        finally:
+            connection.close()
+
+    def read_hot(self, plant_ids: tuple, start: pd.Timestamp, end: pd.Timestamp,
+                 columns: tuple, cache: bool = True) -> pa.Table:
+        """Readings from RDS in [start, end)."""
+        def query() -> pa.Table:
+            rows = self.query_hot(hot_query(self.schema_name, plant_ids, list(columns)),
+                                  (start.to_pydatetime(), end.to_pydatetime(),
+                                   *(plant_ids or ())))
+            return conform(pd.DataFrame(rows, columns=list(columns)), list(columns))
+        if not cache:
+            return query()
+        return self.hot_cache.get(("readings", plant_ids, start, end, columns), query)
+
+    def read_cold(self, catalog, boundary: pd.Timestamp, plant_ids: tuple,
+                  start: pd.Timestamp, end: pd.Timestamp, columns: tuple,
+                  cache: bool = True) -> pa.Table:
+        """Readings from the archive in [start, end]."""
+        def read() -> pa.Table:
+            self.cold_reads += 1
+            table = catalog.read_table(None if plant_ids is None else list(plant_ids),
+                                       start, end, list(columns), read_full=self.read_full)
+            if table is None:
+                return conform(pd.DataFrame(columns=list(columns)), list(columns))
+            return conform_table(table, list(columns))
+        if not cache:
+            return read()
+        return self.cold_cache.get((plant_ids, start, end, columns, boundary), read)
+
+    def plants(self) -> dict:
+        """Names of every plant in either tier, by plant_id."""
+        def query() -> dict:
+            rows = self.query_hot(
+                f"SELECT plant_id, plant_name FROM {self.schema_name}.plant", ())
+            return {int(plant_id): name for plant_id, name in rows}
+        names = dict(self.catalog().plants())
+        names.update(self.hot_cache.get(("plants",), query))
+        return dict(sorted(names.items()))
+
+    def read(self, plant_ids=None, start=None, end=None, columns: list = None,
+             cache: bool = True) -> pd.DataFrame:
+        """
+        Readings of the given plants (all plants if None) recorded in [start, end),
+        with the requested columns plus plant_id and recording_at, sorted by plant and
+        time. Readings found in both tiers are returned once. One-off reads, such as
+        exports, can bypass the tier caches with `cache=False`. A read spanning both
+        tiers reads the archive on the executor while it queries RDS in the calling
+        thread; reads of one tier run in the calling thread, so they never wait behind
+        other requests' archive reads.
+        """
+        columns = tuple(output_columns(columns))
+        plant_ids = None if plant_ids is None else tuple(sorted(plant_ids))
+        start = EARLIEST if start is None else pd.Timestamp(start)
+        end = LATEST if end is None else pd.Timestamp(end)
+        catalog = self.catalog()
+        boundary = catalog.time_range()[1]
+        cold, hot = self.windows(boundary, start, end)
+
+        tables = []
+        if cold is not None and hot is not None:
+            future = self.executor.submit(
+                self.read_cold, catalog, boundary, plant_ids, *cold, columns, cache)
+            hot_table = self.read_hot(plant_ids, *hot, columns, cache)
+            tables = [future.result(), hot_table]
+        elif cold is not None:
+            tables = [self.read_cold(catalog, boundary, plant_ids, *cold, columns, cache)]
+        elif hot is not None:
+            tables = [self.read_hot(plant_ids, *hot, columns, cache)]
+        if not tables:
+            return conform(pd.DataFrame(columns=list(columns)), list(columns)).to_pandas()
+
+        dataframe = pa.concat_tables(tables).to_pandas()
+        dataframe = dataframe[dataframe["recording_at"].between(start, end, inclusive="left")]
+        return dataframe.drop_duplicates(KEY_COLUMNS).sort_values(
+            KEY_COLUMNS, kind="stable").reset_index(drop=True)
@@ -0,0 +1,372 @@
+"""
+Manifests and a catalog for the Parquet archive in S3.
+
+The RDS -> S3 job writes each archive file sorted by plant with one or more row groups per
+plant, and puts a small JSON manifest next to it (`<day>.manifest.json` beside
+`<day>.parquet`). The manifest lists the plants present with their row counts, first and
+last `recording_at`, and the byte ranges of their row groups, as well as where the
+Parquet footer starts.
+
+`ArchiveCatalog` reads the manifests to answer what data exists without touching the
+archive files, and to plan reads of only the footer and the row groups needed for a set
+of plants and a time range, fetched with ranged GETs. When the compaction job has merged
+a month of daily files, the catalog pointer (`_catalog.json`) makes readers use the
+compacted file in their place.
+"""
+import io
+import os
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logging.basicConfig(level=logging.INFO)
+
+MANIFEST_SUFFIX = ".manifest.json"
+CATALOG_POINTER = "_catalog.json"
+COMPACTED_FOLDER = "monthly/"
+MANIFEST_VERSION = 1
+ARCHIVE_ROW_GROUP_ROWS = int(os.getenv("ARCHIVE_ROW_GROUP_ROWS", "65536"))
+ARCHIVE_MIN_ROW_GROUP_ROWS = int(os.getenv("ARCHIVE_MIN_ROW_GROUP_ROWS", "1000"))
+MAX_FULL_READ_RATIO = float(os.getenv("ARCHIVE_FULL_READ_RATIO", "0.5"))
+
+
+def manifest_key(archive_key: str) -> str:
+    """Key of the manifest written next to an archive object."""
+    return f"{os.path.splitext(archive_key)[0]}{MANIFEST_SUFFIX}"
+
+
+def write_archive(dataframe: pd.DataFrame, path, compression: str = "snappy",
+                  row_group_rows: int = ARCHIVE_ROW_GROUP_ROWS,
+                  min_row_group_rows: int = ARCHIVE_MIN_ROW_GROUP_ROWS,
+                  compression_level: int = None) -> str:
+    """
+    Write readings sorted by plant_id and recording_at, starting a new row group at
+    plant boundaries so one plant's rows can be fetched without the rest of the file.
+    Plants with few rows share a row group until it holds `min_row_group_rows`.
+    `dataframe` can also be an Arrow table, which avoids a pandas copy of large inputs.
+    """
+    table = dataframe if isinstance(dataframe, pa.Table) else pa.Table.from_pandas(
+        dataframe, preserve_index=False)
+    table = table.sort_by([("plant_id", "ascending"), ("recording_at", "ascending")])
+    plant_ids = table.column("plant_id").to_numpy()
+    plant_starts = [*(np.flatnonzero(plant_ids[1:] != plant_ids[:-1]) + 1), len(table)]
+
+    with pq.ParquetWriter(path, table.schema, compression=compression,
+                          compression_level=compression_level) as writer:
+        if not len(table):
+            writer.write_table(table)
+        start = 0
+        for end in plant_starts:
+            if end - start >= min_row_group_rows or end == len(table):
+                writer.write_table(table.slice(start, end - start),
+                                   row_group_size=row_group_rows)
+                start = end
+    return path
+
+
+def timestamp_text(value) -> str:
+    """ISO text of a timestamp for the manifest."""
+    return pd.Timestamp(value).isoformat()
+
+
+def build_manifest(source, archive_key: str) -> dict:
+    """
+    Describe an archive file: its size, footer position, and the rows, time span and
+    row group byte ranges of every plant in it. `source` is a local path or a BytesIO.
+    """
+    parquet_file = pq.ParquetFile(source)
+    metadata = parquet_file.metadata
+    size = os.path.getsize(source) if isinstance(source, str) else source.getbuffer().nbytes
+    footer_length = metadata.serialized_size + 8
+
+    spans = []
+    for index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(index)
+        columns = [row_group.column(i) for i in range(row_group.num_columns)]
+        spans.append({"index": index,
+                      "offset": min(min(offset for offset in (column.dictionary_page_offset,
+                                                              column.data_page_offset) if offset)
+                                    for column in columns),
+                      "length": sum(column.total_compressed_size for column in columns)})
+
+    table = parquet_file.read(columns=["plant_id", "plant_name", "recording_at"])
+    row_counts = [metadata.row_group(index).num_rows for index in range(len(spans))]
+    table = table.append_column("row_group", pa.array(
+        np.repeat(np.arange(len(spans)), row_counts), pa.int64()))
+    summary = table.group_by(["row_group", "plant_id", "plant_name"]).aggregate(
+        [("recording_at", "min"), ("recording_at", "max"), ([], "count_all")])
+
+    plants = {}
+    for plant in sorted(summary.to_pylist(), key=lambda item: item["row_group"]):
+        entry = plants.setdefault(str(plant["plant_id"]), {
+            "plant_name": plant["plant_name"], "rows": 0,
+            "min_recording_at": None, "max_recording_at": None, "row_groups": []})
+        entry["rows"] += plant["count_all"]
+        first, last = (timestamp_text(plant["recording_at_min"]),
+                       timestamp_text(plant["recording_at_max"]))
+        entry["min_recording_at"] = min(filter(None, (entry["min_recording_at"], first)))
+        entry["max_recording_at"] = max(filter(None, (entry["max_recording_at"], last)))
+        entry["row_groups"].append(spans[plant["row_group"]])
+
+    return {
+        "version": MANIFEST_VERSION,
+        "key": archive_key,
+        "bytes": size,
+        "rows": metadata.num_rows,
+        "footer_offset": size - footer_length,
+        "footer_length": footer_length,
+        "min_recording_at": min((plant["min_recording_at"] for plant in plants.values()),
+                                default=None),
+        "max_recording_at": max((plant["max_recording_at"] for plant in plants.values()),
+                                default=None),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "plants": plants,
+    }
+
+
+def active_manifests(manifests: dict, pointer: dict, prefix: str) -> dict:
+    """
+    The manifests readers should use, given the catalog pointer written by compaction:
+    daily files merged into a compacted file are replaced by it, and compacted files the
+    pointer does not reference, such as those of an unfinished compaction, are ignored.
+    """
+    compacted = pointer.get("compacted", {}).values()
+    replaced = {source for entry in compacted for source in entry["sources"]}
+    current = {entry["key"] for entry in compacted}
+    return {key: manifest for key, manifest in manifests.items()
+            if key not in replaced
+            and (key in current or not key.startswith(f"{prefix}{COMPACTED_FOLDER}"))}
+
+
+def list_keys(s3_client, bucket: str, prefix: str) -> list:
+    """Every key under a prefix, following continuation tokens."""
+    keys = []
+    arguments = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        listing = s3_client.list_objects_v2(**arguments)
+        keys.extend(item["Key"] for item in listing.get("Contents", []))
+        if not listing.get("NextContinuationToken"):
+            return keys
+        arguments["ContinuationToken"] = listing["NextContinuationToken"]
+
+
+class RangeReader(io.RawIOBase):
+    """Read-only file over an S3 object that fetches every read with a ranged GET."""
+
+    def __init__(self, s3_client, bucket: str, key: str, size: int):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+        self.bytes_read = 0
+        self.requests = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def fetch(self, start: int, length: int) -> bytes:
+        """Fetch `length` bytes starting at `start`."""
+        end = min(self.size, start + length) - 1
+        if end < start:
+            return b""
+        response = self.s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")
+        data = response["Body"].read()
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.fetch(self.position, len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class ArchiveCatalog:
+    """What the archive holds, according to the manifests next to its files."""
+
+    def __init__(self, s3_client, bucket: str, prefix: str = "plant_data/"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.manifests = {}
+        self.footers = {}
+
+    def refresh(self) -> "ArchiveCatalog":
+        """Load every manifest under the prefix."""
+        manifests = {}
+        pointer = {}
+        for key in list_keys(self.s3_client, self.bucket, self.prefix):
+            if key.endswith(MANIFEST_SUFFIX) or key == f"{self.prefix}{CATALOG_POINTER}":
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+                document = json.loads(response["Body"].read())
+                if key.endswith(MANIFEST_SUFFIX):
+                    manifests[document["key"]] = document
+                else:
+                    pointer = document
+        manifests = active_manifests(manifests, pointer, self.prefix)
+        self.manifests = manifests
+        logging.info("Loaded %d archive manifests from s3://%s/%s",
+                     len(manifests), self.bucket, self.prefix)
+        return self
+
+    def plants(self) -> dict:
+        """Names of every archived plant, by plant_id."""
+        names = {}
+        for manifest in self.manifests.values():
+            for plant_id, plant in manifest["plants"].items():
+                names[int(plant_id)] = plant["plant_name"]
+        return dict(sorted(names.items()))
+
+    def time_range(self) -> tuple:
+        """First and last archived recording_at, or (None, None) if nothing is archived."""
+        firsts = [m["min_recording_at"] for m in self.manifests.values() if m["rows"]]
+        lasts = [m["max_recording_at"] for m in self.manifests.values() if m["rows"]]
+        if not firsts:
+            return None, None
+        return pd.Timestamp(min(firsts)), pd.Timestamp(max(lasts))
+
+    def plan(self, plant_ids=None, start=None, end=None) -> list:
+        """
+        The archive files and row groups holding readings of the given plants between
+        `start` and `end`, with the bytes a ranged read of them would fetch.
+        """
+        wanted = None if plant_ids is None else {str(plant_id) for plant_id in plant_ids}
+        plans = []
+        for key, manifest in sorted(self.manifests.items()):
+            row_groups = {}
+            for plant_id, plant in manifest["plants"].items():
+                if wanted is not None and plant_id not in wanted:
+                    continue
+                if start is not None and pd.Timestamp(plant["max_recording_at"]) < start:
+                    continue
+                if end is not None and pd.Timestamp(plant["min_recording_at"]) > end:
+                    continue
+                for span in plant["row_groups"]:
+                    row_groups[span["index"]] = span
+            if row_groups:
+                spans = [row_groups[index] for index in sorted(row_groups)]
+                plans.append({"key": key, "row_groups": [span["index"] for span in spans],
+                              "bytes": sum(span["length"] for span in spans)
+                              + manifest["footer_length"],
+                              "file_bytes": manifest["bytes"]})
+        return plans
+
+    def footer(self, key: str) -> pq.FileMetaData:
+        """Parquet metadata of an archive file, fetched once with a single ranged GET."""
+        if key not in self.footers:
+            manifest = self.manifests[key]
+            reader = RangeReader(self.s3_client, self.bucket, key, manifest["bytes"])
+            footer = reader.fetch(manifest["footer_offset"], manifest["footer_length"])
+            self.footers[key] = pq.read_metadata(pa.BufferReader(b"PAR1" + footer))
+        return self.footers[key]
+
+    def read_plan(self, plan: dict, columns: list = None) -> pa.Table:
+        """Read only the planned row groups of one archive file with ranged GETs."""
+        manifest = self.manifests[plan["key"]]
+        reader = RangeReader(self.s3_client, self.bucket, plan["key"], manifest["bytes"])
+        parquet_file = pq.ParquetFile(reader, metadata=self.footer(plan["key"]))
+        return parquet_file.read_row_groups(plan["row_groups"], columns=columns)
+
+    def read_table(self, plant_ids=None, start=None, end=None, columns: list = None,
+                   read_full=None) -> pa.Table:
+        """
+        Readings of the given plants between `start` and `end` as an Arrow table, or
+        None if no archive file holds any. Files where most of the bytes are needed
+        anyway are read whole through `read_full(key)` when given, such as a local
+        cache, instead of with ranged reads.
+        """
+        read_columns = None if columns is None else list(
+            dict.fromkeys([*columns, "plant_id", "recording_at"]))
+        tables = []
+        for plan in self.plan(plant_ids, start, end):
+            if read_full and plan["bytes"] >= plan["file_bytes"] * MAX_FULL_READ_RATIO:
+                table = read_full(plan["key"])
+                if read_columns is not None:
+                    table = table.select(read_columns)
+            else:
+                table = self.read_plan(plan, read_columns)
+            tables.append(filter_table(table, plant_ids, start, end))
+        if not tables:
+            return None
+        table = pa.concat_tables(tables, promote_options="default")
+        return table if columns is None else table.select(columns)
+
+    def read(self, plant_ids=None, start=None, end=None, columns: list = None,
+             read_full=None) -> pd.DataFrame:
+        """Readings of the given plants between `start` and `end`, as `read_table`."""
+        table = self.read_table(plant_ids, start, end, columns, read_full)
+        if table is None:
+            return pd.DataFrame(columns=columns)
+        return table.to_pandas()
+
+
+def filter_table(table: pa.Table, plant_ids=None, start=None, end=None) -> pa.Table:
+    """Rows of the given plants between `start` and `end`."""
+    conditions = []
+    if plant_ids is not None:
+        conditions.append(pc.is_in(table["plant_id"],
+                                   value_set=pa.array(list(plant_ids), table["plant_id"].type)))
+    if start is not None:
+        conditions.append(pc.greater_equal(
+            table["recording_at"], pa.scalar(pd.Timestamp(start), table["recording_at"].type)))
+    if end is not None:
+        conditions.append(pc.less_equal(
+            table["recording_at"], pa.scalar(pd.Timestamp(end), table["recording_at"].type)))
+    if not conditions:
+        return table
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    return table.filter(mask)
+
+
+def backfill_manifests(s3_client, bucket: str, prefix: str) -> int:
+    """Write manifests for archive files that were uploaded without one."""
+    keys = set(list_keys(s3_client, bucket, prefix))
+    written = 0
+    for key in sorted(keys):
+        if not key.endswith(".parquet") or manifest_key(key) in keys:
+            continue
+        data = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        manifest = build_manifest(io.BytesIO(data), key)
+        s3_client.put_object(Bucket=bucket, Key=manifest_key(key),
+                             Body=json.dumps(manifest).encode("utf-8"))
+        logging.info("Wrote manifest for %s", key)
+        written += 1
+    return written
+
+
+def main() -> None:
+    """Write manifests for archive files that do not have one yet."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET"))
+    parser.add_argument("--prefix", default=os.getenv("S3_KEY", "plant_data/"))
+    args = parser.parse_args()
+    written = backfill_manifests(boto3.client("s3"), args.bucket, args.prefix)
+    logging.info("Wrote %d manifests.", written)
+
+
+if __name__ == "__main__":
+    main()
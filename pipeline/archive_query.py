@@ -0,0 +1,151 @@
+"""
+In-process analytical queries over the whole Parquet archive, built on pyarrow datasets.
+
+Questions across plants and months, such as which plants were most often too dry last
+month, are answered by scanning the archive in place instead of downloading every file
+into pandas. The catalog's manifests choose the files a query can need, and the query's
+columns and filter are pushed down to the scan, so only those columns are decoded and row
+groups whose statistics rule them out, such as other plants' row groups, are skipped.
+Files and row groups are read and decoded on several threads at once.
+"""
+import os
+import logging
+import argparse
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+from archive_catalog import ArchiveCatalog
+
+logging.basicConfig(level=logging.INFO)
+
+AWS_REGION = os.getenv("AWS_REGION", "eu-west-2")
+FRAGMENT_READAHEAD = int(os.getenv("ARCHIVE_QUERY_FILE_READAHEAD", "8"))
+AGGREGATIONS = ("count", "sum", "mean", "min", "max", "stddev")
+
+
+def reading_filter(plant_ids=None, start=None, end=None, where: ds.Expression = None):
+    """Filter expression for plants, a [start, end) time range and any extra condition."""
+    conditions = [] if where is None else [where]
+    if plant_ids is not None:
+        conditions.append(ds.field("plant_id").isin(list(plant_ids)))
+    if start is not None:
+        conditions.append(ds.field("recording_at") >= pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        conditions.append(ds.field("recording_at") < pd.Timestamp(end).to_pydatetime())
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+class ArchiveQuery:
+    """
+    Query layer over the archive files a catalog lists. `filesystem` is a pyarrow
+    filesystem holding the catalog's bucket, S3 by default.
+    """
+
+    def __init__(self, catalog: ArchiveCatalog, filesystem: fs.FileSystem = None):
+        self.catalog = catalog
+        self.filesystem = filesystem or fs.S3FileSystem(region=AWS_REGION)
+        self.files_scanned = 0
+
+    def dataset(self, plant_ids=None, start=None, end=None) -> ds.Dataset:
+        """
+        Dataset of the archive files that can hold the given plants and time range, or
+        None if there are none.
+        """
+        keys = [plan["key"] for plan in self.catalog.plan(plant_ids, start, end)]
+        if not keys:
+            return None
+        self.files_scanned += len(keys)
+        return ds.dataset([f"{self.catalog.bucket}/{key}" for key in keys],
+                          format="parquet", filesystem=self.filesystem)
+
+    def scan(self, columns: list = None, plant_ids=None, start=None, end=None,
+             where: ds.Expression = None) -> pa.Table:
+        """
+        Readings of the given plants in [start, end) that also match `where`, such as
+        `ds.field("soil_moisture") < 20`, with only the requested columns.
+        """
+        dataset = self.dataset(plant_ids, start, end)
+        if dataset is None:
+            return pa.table({column: [] for column in columns or []})
+        scanner = dataset.scanner(
+            columns=columns, filter=reading_filter(plant_ids, start, end, where),
+            use_threads=True, fragment_readahead=FRAGMENT_READAHEAD)
+        return scanner.to_table()
+
+    def aggregate(self, group_by: list, aggregations: list, plant_ids=None, start=None,
+                  end=None, where: ds.Expression = None) -> pd.DataFrame:
+        """
+        Grouped aggregates of the matching readings. `aggregations` are (column, function)
+        pairs, with functions from AGGREGATIONS, and each result column is named
+        `<column>_<function>`.
+        """
+        for _, function in aggregations:
+            if function not in AGGREGATIONS:
+                raise ValueError(
+                    f"Unknown aggregation {function}, expected one of {AGGREGATIONS}")
+        columns = list(dict.fromkeys([*group_by, *(column for column, _ in aggregations)]))
+        table = self.scan(columns, plant_ids, start, end, where)
+        if table.num_rows == 0:
+            return pd.DataFrame(columns=[*group_by, *(f"{column}_{function}"
+                                                      for column, function in aggregations)])
+        result = table.group_by(group_by).aggregate(list(aggregations)).to_pandas()
+        return result[[*group_by, *(f"{column}_{function}"
+                                    for column, function in aggregations)]]
+
+    def plant_summary(self, start=None, end=None, dry_below: float = 20.0) -> pd.DataFrame:
+        """
+        Readings, mean, minimum and maximum temperature and soil moisture of every plant,
+        and how often its soil moisture was below `dry_below`, driest plants first.
+        """
+        columns = ["plant_id", "plant_name", "temperature", "soil_moisture"]
+        table = self.scan(columns, start=start, end=end)
+        if table.num_rows == 0:
+            return pd.DataFrame(columns=[
+                "plant_id", "plant_name", "readings", "dry_readings", "temperature_mean",
+                "temperature_min", "temperature_max", "soil_moisture_mean",
+                "soil_moisture_min", "soil_moisture_max", "dry_share"])
+        table = table.append_column("dry", pc.less(table["soil_moisture"], dry_below))
+        summary = table.group_by(["plant_id", "plant_name"]).aggregate([
+            ("plant_id", "count"), ("dry", "sum"),
+            ("temperature", "mean"), ("temperature", "min"), ("temperature", "max"),
+            ("soil_moisture", "mean"), ("soil_moisture", "min"), ("soil_moisture", "max"),
+        ]).to_pandas().rename(columns={"plant_id_count": "readings", "dry_sum": "dry_readings"})
+        summary["dry_readings"] = summary["dry_readings"].fillna(0).astype("int64")
+        summary["dry_share"] = summary["dry_readings"] / summary["readings"]
+        return summary.sort_values(["dry_readings", "plant_id"], ascending=[False, True],
+                                   ignore_index=True)
+
+
+def daily_means(table: pa.Table, column: str) -> pd.DataFrame:
+    """Mean of a column per plant and day, from a scan including plant_id and recording_at."""
+    days = pc.floor_temporal(table["recording_at"], unit="day")
+    daily = pa.table({"plant_id": table["plant_id"], "day": days, column: table[column]})
+    means = daily.group_by(["plant_id", "day"]).aggregate([(column, "mean")]).to_pandas()
+    return means.rename(columns={f"{column}_mean": column}).sort_values(
+        ["plant_id", "day"], ignore_index=True)
+
+
+def main() -> None:
+    """Print the plant summary for a time range."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET"))
+    parser.add_argument("--prefix", default=os.getenv("S3_KEY", "plant_data/"))
+    parser.add_argument("--start", help="First day, YYYY-MM-DD.")
+    parser.add_argument("--end", help="Day after the last day, YYYY-MM-DD.")
+    parser.add_argument("--dry-below", type=float, default=20.0)
+    args = parser.parse_args()
+    catalog = ArchiveCatalog(boto3.client("s3"), args.bucket, args.prefix).refresh()
+    summary = ArchiveQuery(catalog).plant_summary(args.start, args.end, args.dry_below)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Chart-ready, downsampled reading series per plant for the dashboard's standard windows.
+
+Each window keeps a fixed number of buckets per plant, so a chart costs the same however
+much history there is: the last hour in 1-minute buckets, the last 24 hours in 10-minute
+buckets and the last 7 days in hourly buckets. A bucket holds its reading count and the
+mean temperature and soil moisture, so new readings are merged into it without the
+readings it already holds.
+
+The minute pipeline merges each batch of cleaned readings into the payloads. The archive
+job recomputes every bucket that lies wholly within the readings it archives, which adds
+readings the minute pipeline never merged and removes any it merged twice. Payloads are
+kept as one zstd-compressed Arrow IPC file, or one per shard when the pipeline is sharded,
+sorted by window, plant and time so they can be charted as they are. Each file records
+when it was saved, so a plant found in several files after the shards were changed is
+charted from the newest.
+"""
+import os
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+PAYLOADS_LOCATION = os.getenv("CHART_PAYLOADS")
+# Window name: (span, bucket width)
+WINDOWS = {
+    "1h": (pd.Timedelta(hours=1), pd.Timedelta(minutes=1)),
+    "24h": (pd.Timedelta(days=1), pd.Timedelta(minutes=10)),
+    "7d": (pd.Timedelta(days=7), pd.Timedelta(hours=1)),
+}
+METRICS = ["temperature", "soil_moisture"]
+KEY_COLUMNS = ["window", "plant_id", "recording_at"]
+PAYLOAD_SCHEMA = pa.schema([
+    ("window", pa.string()),
+    ("plant_id", pa.int64()),
+    ("plant_name", pa.string()),
+    ("recording_at", pa.timestamp("ns")),
+    ("readings", pa.int64()),
+    ("temperature", pa.float64()),
+    ("soil_moisture", pa.float64()),
+])
+WRITE_OPTIONS = ipc.IpcWriteOptions(compression="zstd")
+
+
+def empty_payloads() -> pd.DataFrame:
+    """Payloads with no buckets."""
+    return PAYLOAD_SCHEMA.empty_table().to_pandas()
+
+
+def naive_utc(times: pd.Series) -> pd.Series:
+    """Times as naive UTC datetimes in nanoseconds, the payload schema's unit."""
+    times = pd.to_datetime(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    return times.dt.as_unit("ns")
+
+
+def bucket(readings: pd.DataFrame) -> pd.DataFrame:
+    """Cleaned readings aggregated into the buckets of every window."""
+    if readings.empty:
+        return empty_payloads()
+    readings = readings[["plant_id", "plant_name", "recording_at", *METRICS]].assign(
+        recording_at=naive_utc(readings["recording_at"]))
+    windows = []
+    for window, (_, width) in WINDOWS.items():
+        grouped = readings.assign(recording_at=readings["recording_at"].dt.floor(width)) \
+            .groupby(["plant_id", "recording_at"], sort=False)
+        buckets = grouped[METRICS].mean()
+        buckets["plant_name"] = grouped["plant_name"].last()
+        buckets["readings"] = grouped.size()
+        windows.append(buckets.reset_index().assign(window=window))
+    return pd.concat(windows, ignore_index=True)[PAYLOAD_SCHEMA.names]
+
+
+def prune(payloads: pd.DataFrame, now: pd.Timestamp) -> pd.DataFrame:
+    """Drop the buckets that have left their window, and sort the rest for charting."""
+    starts = payloads["window"].map(
+        {window: now - span for window, (span, _) in WINDOWS.items()})
+    return payloads[payloads["recording_at"] >= starts].sort_values(
+        KEY_COLUMNS, ignore_index=True)
+
+
+def merge(payloads: pd.DataFrame, buckets: pd.DataFrame, now: pd.Timestamp) -> pd.DataFrame:
+    """Payloads with new buckets merged in, weighting each bucket's means by its readings."""
+    combined = pd.concat([frame for frame in (payloads, buckets) if not frame.empty],
+                         ignore_index=True)
+    if combined.empty:
+        return empty_payloads()
+    weighted = combined[METRICS].mul(combined["readings"], axis=0)
+    weighted[KEY_COLUMNS + ["readings"]] = combined[KEY_COLUMNS + ["readings"]]
+    grouped = weighted.groupby(KEY_COLUMNS)
+    merged = grouped[METRICS].sum().div(grouped["readings"].sum(), axis=0)
+    merged["readings"] = grouped["readings"].sum()
+    merged["plant_name"] = combined.groupby(KEY_COLUMNS)["plant_name"].last()
+    return prune(merged.reset_index()[PAYLOAD_SCHEMA.names], now)
+
+
+def replace_span(payloads: pd.DataFrame, readings: pd.DataFrame,
+                 now: pd.Timestamp) -> pd.DataFrame:
+    """
+    Payloads with every bucket that lies wholly between the first and last of the given
+    readings recomputed from them. Buckets only partly covered are left as they are.
+    """
+    if readings.empty:
+        return prune(payloads, now)
+    times = naive_utc(readings["recording_at"])
+    first, last = times.min(), times.max()
+    widths = {window: width for window, (_, width) in WINDOWS.items()}
+
+    def within(frame: pd.DataFrame) -> pd.Series:
+        ends = frame["recording_at"] + frame["window"].map(widths)
+        return (frame["recording_at"] >= first) & (ends <= last) & \
+            frame["plant_id"].isin(readings["plant_id"].unique())
+
+    buckets = bucket(readings)
+    kept = payloads[~within(payloads)]
+    return merge(kept, buckets[within(buckets)], now)
+
+
+def load_payloads(location: str) -> pd.DataFrame:
+    """Payloads from a local file or S3 location, empty if there are none."""
+    data = storage.read_bytes(location)
+    if data is None:
+        return empty_payloads()
+    return ipc.open_file(pa.BufferReader(data)).read_all().to_pandas()
+
+
+def save_payloads(payloads: pd.DataFrame, location: str) -> None:
+    """Write payloads to a local file or S3 location."""
+    table = pa.Table.from_pandas(payloads, schema=PAYLOAD_SCHEMA, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {"saved_at": datetime.now(timezone.utc).isoformat(timespec="microseconds")})
+    sink = pa.BufferOutputStream()
+    with ipc.new_file(sink, table.schema, options=WRITE_OPTIONS) as writer:
+        writer.write_table(table)
+    storage.write_bytes(location, sink.getvalue().to_pybytes())
+    logging.info("Chart payloads for %d plants saved to %s.",
+                 payloads["plant_id"].nunique(), location)
+
+
+def payload_locations(location: str) -> list:
+    """The payload file at `location` and those of every shard."""
+    extension = os.path.splitext(location)[1]
+    return [found for found in storage.list_locations(os.path.splitext(location)[0])
+            if found.endswith(extension)]
+
+
+def load_all(location: str) -> pd.DataFrame:
+    """
+    Payloads of every shard as one frame. A bucket found in several files, as happens
+    after resharding moves a plant, is taken from the file saved last.
+    """
+    saved = []
+    for found in payload_locations(location):
+        data = storage.read_bytes(found)
+        if data is not None:
+            table = ipc.open_file(pa.BufferReader(data)).read_all()
+            saved.append(((table.schema.metadata or {}).get(b"saved_at", b""),
+                          table.to_pandas()))
+    frames = [frame for _, frame in sorted(saved, key=lambda item: item[0])
+              if not frame.empty]
+    if not frames:
+        return empty_payloads()
+    payloads = pd.concat(frames, ignore_index=True).drop_duplicates(KEY_COLUMNS, keep="last")
+    return payloads.sort_values(KEY_COLUMNS, kind="stable").reset_index(drop=True)
+
+
+def update(cleaned_df: pd.DataFrame, location: str, now: pd.Timestamp = None) -> None:
+    """Merge a batch of cleaned readings into the payloads at `location`."""
+    now = pd.Timestamp.now("UTC").tz_localize(None) if now is None else now
+    save_payloads(merge(load_payloads(location), bucket(cleaned_df), now), location)
+
+
+def recompute(readings: pd.DataFrame, location: str, now: pd.Timestamp = None) -> None:
+    """
+    Recompute the buckets covered by archived readings in every payload file, each for
+    the plants it already holds. Without any payload file, one is seeded at `location`.
+    """
+    now = pd.Timestamp.now("UTC").tz_localize(None) if now is None else now
+    locations = payload_locations(location)
+    if not locations:
+        save_payloads(replace_span(empty_payloads(), readings, now), location)
+        return
+    for found in locations:
+        payloads = load_payloads(found)
+        held = readings[readings["plant_id"].isin(payloads["plant_id"].unique())]
+        save_payloads(replace_span(payloads, held, now), found)
@@ -0,0 +1,92 @@
+"""
+Typed checkpoints of the pipeline's stage outputs, stored as Arrow IPC files.
+
+Each stage has a fixed schema, so a checkpoint reads back with the same types it was
+written with instead of having them re-inferred from text. The standalone scripts hand
+data to each other through checkpoints, and the pipeline keeps the cleaned readings in
+one until they are loaded, so a failed load can be retried without polling the API again.
+"""
+import os
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+CHECKPOINT_LOCATION = os.getenv("CHECKPOINT_LOCATION", "")
+STRING_COLUMNS = ["plant_name", "botanist_first_name", "botanist_last_name",
+                  "botanist_email", "botanist_phone"]
+NUMERIC_COLUMNS = ["plant_id", "soil_moisture", "temperature"]
+
+RAW_SCHEMA = pa.schema([
+    ("plant_id", pa.int64()),
+    ("plant_name", pa.string()),
+    ("soil_moisture", pa.float64()),
+    ("temperature", pa.float64()),
+    ("last_watered", pa.string()),
+    ("recording_at", pa.string()),
+    ("botanist_first_name", pa.string()),
+    ("botanist_last_name", pa.string()),
+    ("botanist_email", pa.string()),
+    ("botanist_phone", pa.string()),
+])
+CLEANED_SCHEMA = pa.schema([
+    RAW_SCHEMA.field("plant_id"),
+    RAW_SCHEMA.field("plant_name"),
+    RAW_SCHEMA.field("soil_moisture"),
+    RAW_SCHEMA.field("temperature"),
+    ("last_watered", pa.timestamp("ns", tz="UTC")),
+    ("recording_at", pa.timestamp("ns", tz="UTC")),
+    *(RAW_SCHEMA.field(column) for column in STRING_COLUMNS[1:]),
+])
+SCHEMAS = {"raw": RAW_SCHEMA, "cleaned": CLEANED_SCHEMA}
+
+
+def checkpoint_location(directory: str, stage: str) -> str:
+    """Location of a stage's checkpoint in a local directory or s3:// prefix."""
+    if not directory:
+        return directory
+    return f"{directory.rstrip('/')}/{stage}.arrow"
+
+
+def to_table(dataframe: pd.DataFrame, stage: str) -> pa.Table:
+    """
+    Convert a stage's output to its schema. Raw API values that are not numbers
+    become nulls, as they would when cleaned, and other values become strings.
+    """
+    schema = SCHEMAS[stage]
+    dataframe = dataframe.copy()
+    for column in NUMERIC_COLUMNS:
+        dataframe[column] = pd.to_numeric(dataframe[column], errors="coerce")
+    for column in (field.name for field in schema if pa.types.is_string(field.type)):
+        values = dataframe[column]
+        dataframe[column] = values.where(values.isna(), values.astype(str))
+    return pa.Table.from_pandas(dataframe[schema.names], preserve_index=False).cast(schema)
+
+
+def write_checkpoint(dataframe: pd.DataFrame, location: str, stage: str) -> None:
+    """Write a stage's output to a local path or S3 location as an Arrow IPC file."""
+    table = to_table(dataframe, stage)
+    sink = pa.BufferOutputStream()
+    with ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    storage.write_bytes(location, sink.getvalue().to_pybytes())
+    logging.info("Checkpointed %d %s rows to %s.", table.num_rows, stage, location)
+
+
+def read_checkpoint(location: str, stage: str) -> pd.DataFrame:
+    """Read a stage's checkpoint, or return None if there is none."""
+    data = storage.read_bytes(location)
+    if data is None:
+        return None
+    table = ipc.open_file(pa.BufferReader(data)).read_all()
+    if not table.schema.equals(SCHEMAS[stage]):
+        raise ValueError(f"Checkpoint {location} does not have the {stage} schema")
+    return table.to_pandas()
+
+
+def clear_checkpoint(location: str) -> None:
+    """Remove a checkpoint once its data has been consumed."""
+    storage.delete(location)
@@ -0,0 +1,194 @@
+"""
+Long-running micro-batch mode for the minute pipeline.
+
+Instead of paying start-up and connection costs on every Lambda invocation, the daemon
+stays alive and polls the API every PIPELINE_POLL_INTERVAL seconds. Extraction,
+transformation and loading run in their own threads connected by bounded queues, so
+batch N+1 is extracted while batch N is still being loaded. The HTTP session and the
+database connection are kept open between batches.
+"""
+import os
+import time
+import queue
+import signal
+import logging
+import threading
+import requests
+import pymssql
+import load
+import metrics
+import scheduler
+import spool
+import stages
+
+logging.basicConfig(level=logging.INFO)
+
+POLL_INTERVAL = float(os.getenv("PIPELINE_POLL_INTERVAL", "60"))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+
+STOP = object()
+
+
+class PipelineDaemon:
+    """Runs the extract, transform and load stages as a pipelined loop."""
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL,
+                 queue_size: int = QUEUE_SIZE, max_batches: int = None):
+        self.poll_interval = poll_interval
+        self.max_batches = max_batches
+        self.stop_event = threading.Event()
+        self.raw_queue = queue.Queue(maxsize=queue_size)
+        self.cleaned_queue = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+        self.connection = None
+        self.batches_loaded = 0
+
+    def stop(self, *_) -> None:
+        """Ask the daemon to finish the batches in flight and shut down."""
+        logging.info("Shutdown requested, finishing batches in flight...")
+        self.stop_event.set()
+
+    def extract_loop(self) -> None:
+        """
+        Poll the API on the configured interval and queue each raw batch. The next stage
+        is always told to stop, even if this one fails, so the daemon cannot hang.
+        """
+        batches = 0
+        next_run = time.monotonic()
+        try:
+            poll_scheduler = stages.get_scheduler() if scheduler.ADAPTIVE_POLLING else None
+            while not self.stop_event.is_set():
+                try:
+                    raw_df = stages.run_extraction(
+                        self.session, poll_scheduler=poll_scheduler)
+                    if poll_scheduler is not None:
+                        stages.save_scheduler()
+                    if not raw_df.empty:
+                        self.raw_queue.put(raw_df)
+                except ValueError as e:
+                    logging.warning("Skipping batch: %s", e)
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Extraction failed, skipping batch: %s", e)
+                    metrics.active().count("PipelineFailures")
+                batches += 1
+
+                if self.max_batches is not None and batches >= self.max_batches:
+                    break
+                next_run = max(next_run + self.poll_interval, time.monotonic())
+                self.stop_event.wait(next_run - time.monotonic())
+        finally:
+            self.raw_queue.put(STOP)
+
+    def transform_loop(self) -> None:
+        """Clean each raw batch and pass it on to the loader."""
+        try:
+            while (raw_df := self.raw_queue.get()) is not STOP:
+                try:
+                    self.cleaned_queue.put(stages.run_transformation(raw_df))
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Transformation failed, dropping batch: %s", e)
+        finally:
+            self.cleaned_queue.put(STOP)
+
+    def load_loop(self) -> None:
+        """
+        Load each cleaned batch over a connection that is kept open between batches.
+        With SPOOL_LOCATION set, batches that could not be loaded because the database
+        was unreachable are spooled, as in `stages.load_or_spool`, and the spool is
+        replayed whenever a new connection is opened. Batches failing for any other
+        reason are dropped, so they cannot block the spool behind them.
+        """
+        try:
+            while (cleaned_df := self.cleaned_queue.get()) is not STOP:
+                try:
+                    if self.connection is None:
+                        self.connection = load.get_db_connection()
+                        self.replay_spool()
+                    stages.run_loading(cleaned_df, self.connection)
+                except (pymssql.OperationalError, pymssql.InterfaceError) as e:
+                    logging.error("Database connection lost, spooling the batch: %s", e)
+                    metrics.active().count("PipelineFailures")
+                    self.close_connection()
+                    self.spool_batch(cleaned_df)
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Loading failed, dropping %d rows: %s", len(cleaned_df), e)
+                    metrics.active().count("PipelineFailures")
+                    self.close_connection()
+                else:
+                    self.batches_loaded += 1
+                    self.after_load(cleaned_df)
+                metrics.active().flush()
+        finally:
+            self.close_connection()
+
+    def replay_spool(self) -> None:
+        """
+        Replay the spool over a new connection. A spooled batch the database rejects is
+        left in the spool and logged rather than holding up the batches behind it.
+        """
+        if not spool.SPOOL_LOCATION:
+            return
+        try:
+            spool.replay(self.connection)
+        except (pymssql.OperationalError, pymssql.InterfaceError):
+            raise
+        except pymssql.Error as e:
+            logging.error("Spool replay failed, continuing without it: %s", e)
+            metrics.active().count("PipelineFailures")
+            self.connection.rollback()
+
+    @staticmethod
+    def after_load(cleaned_df) -> None:
+        """Update the statistics and chart payloads of a batch that has been committed."""
+        try:
+            stages.update_plant_stats(cleaned_df)
+            stages.update_chart_payloads(cleaned_df)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Batch loaded, but updating its statistics failed: %s", e)
+            metrics.active().count("PipelineFailures")
+
+    @staticmethod
+    def spool_batch(cleaned_df) -> None:
+        """Spool a batch that failed to load, if spooling is configured."""
+        if not spool.SPOOL_LOCATION:
+            return
+        try:
+            spool.append(cleaned_df)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Could not spool %d rows, they are lost: %s", len(cleaned_df), e)
+
+    def close_connection(self) -> None:
+        """Close the database connection if one is open."""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except pymssql.Error:
+                pass
+            self.connection = None
+            logging.info("Database connection closed.")
+
+    def run(self) -> None:
+        """Start the three stages and wait until they have all finished."""
+        threads = [threading.Thread(target=target, name=target.__name__)
+                   for target in (self.extract_loop, self.transform_loop, self.load_loop)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.session.close()
+        logging.info("Daemon stopped after loading %d batches.",
+                     self.batches_loaded)
+
+
+def main() -> None:
+    """Run the daemon until it receives SIGINT or SIGTERM."""
+    daemon = PipelineDaemon()
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    logging.info("Starting pipeline daemon, polling every %s seconds.",
+                 daemon.poll_interval)
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,39 @@
-"""Script to extract raw data from the API and save to a CSV file."""
+"""Script to extract raw data from the API and save it to a checkpoint file."""
 import os
+import time
 import logging
 import requests
 import pandas as pd
+import checkpoints
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 
 BASE_URL = "https://data-eng-plants-api.herokuapp.com/plants/"
-PLANT_IDS = range(1, 51)
-OUTPUT_FILE = os.path.join("../data", "plant_data.csv")
+PLANT_IDS = range(1, int(os.getenv("PLANT_COUNT", "50")) + 1)
+OUTPUT_FILE = os.path.join("../data", "plant_data.arrow")
 
 
-def get_plant_data(plant_id: int) -> dict:
-    """Get data for a plant from a specific plant ID from the API endpoint."""
+def get_plant_data(plant_id: int, session: requests.Session = None) -> dict:
+    """
+    Get data for a plant from a specific plant ID from the API endpoint.
+    A session can be passed in to reuse its connections between calls.
+    """
     try:
         logging.info("Retrieving data for plant ID %s", plant_id)
-        response = requests.get(f"{BASE_URL}{plant_id}", timeout=10)
+        start = time.perf_counter()
+        response = (session or requests).get(f"{BASE_URL}{plant_id}", timeout=10)
+        metrics.active().observe(
+            "ApiLatency", (time.perf_counter() - start) * 1000)
         if response.status_code != 200:
+            metrics.active().count("ApiErrors")
             logging.error("Error retrieving data for plant ID %s: %s",
                           plant_id, response.json())
             return None
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
+        metrics.active().count("ApiErrors")
         logging.error("Error retrieving data for plant ID %s: %s", plant_id, e)
         return None
 
@@ -61,7 +72,7 @@ def parse_plant_data(raw_data: dict) -> dict:
 
 
 def process_data() -> None:
-    """Main function to get, parse, and save plant data from the API to a CSV file."""
+    """Main function to get, parse, and save plant data from the API to a checkpoint file."""
     all_data = []
 
     for plant_id in PLANT_IDS:
@@ -72,7 +83,7 @@ def process_data() -> None:
 
     if all_data:
         df = pd.DataFrame(all_data)
-        df.to_csv(OUTPUT_FILE, index=False)
+        checkpoints.write_checkpoint(df, OUTPUT_FILE, "raw")
         logging.info("Data successfully saved as %s.", OUTPUT_FILE)
     else:
         logging.warning("No valid data was extracted.")
@@ -5,6 +5,9 @@ import os
 from dotenv import load_dotenv
 import pandas as pd
 import pymssql
+import checkpoints
+import metrics
+import timestamps
 
 logging.basicConfig(level=logging.INFO)
 
@@ -18,19 +21,28 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT")
 }
 
-CLEANED_FILE = os.path.join("../data", "cleaned_plant_data.csv")
+CLEANED_FILE = os.path.join("../data", "cleaned_plant_data.arrow")
 SCHEMA_NAME = os.getenv("SCHEMA_NAME")
+DB_LOGIN_TIMEOUT = int(os.getenv("DB_LOGIN_TIMEOUT", "5"))
+BULK_INSERT_ROWS = int(os.getenv("BULK_INSERT_ROWS", "1000"))
+MAX_PARAMETERS = 2000  # SQL Server allows 2100 parameters per statement
+BOTANIST_COLUMNS = ["botanist_first_name", "botanist_last_name",
+                    "botanist_email", "botanist_phone"]
 
 
 def get_db_connection() -> pymssql.Connection:
-    """Establish a connection to the SQL Server database using pymssql."""
+    """
+    Establish a connection to the SQL Server database using pymssql, giving up after
+    DB_LOGIN_TIMEOUT seconds so an unreachable database fails fast.
+    """
     try:
         db_connection = pymssql.connect(
             server=DB_CONFIG["host"],
             user=DB_CONFIG["username"],
             password=DB_CONFIG["password"],
             database=DB_CONFIG["database"],
-            port=DB_CONFIG["port"]
+            port=DB_CONFIG["port"],
+            login_timeout=DB_LOGIN_TIMEOUT
         )
         logging.info("Database connection established.")
         return db_connection
@@ -40,13 +52,16 @@ def get_db_connection() -> pymssql.Connection:
 
 
 def insert_botanists(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> None:
-    """Insert botanists into the database."""
+    """
+    Insert botanists into the database. The existence check holds a key-range lock
+    so concurrent shards loading plants with the same botanist cannot both insert it.
+    """
     logging.info("Inserting botanists into the database...")
     for _, row in transformed_df.iterrows():
         cursor.execute(
             f"""
             IF NOT EXISTS (
-                SELECT 1 FROM {SCHEMA_NAME}.botanist
+                SELECT 1 FROM {SCHEMA_NAME}.botanist WITH (UPDLOCK, HOLDLOCK)
                 WHERE first_name = %s AND last_name = %s AND email = %s AND phone = %s
             )
             BEGIN
@@ -65,6 +80,7 @@ def insert_botanists(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> No
                 row["botanist_phone"],
             ),
         )
+    metrics.active().count("DbRoundTrips", len(transformed_df))
     logging.info("Botanists inserted successfully.")
 
 
@@ -95,12 +111,15 @@ def insert_plants(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> None:
                 row["plant_name"],
             ),
         )
+    metrics.active().count("DbRoundTrips", len(transformed_df))
     logging.info("Plants inserted successfully.")
 
 
 def insert_recordings(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> None:
     """Insert recordings into the database."""
     logging.info("Inserting recordings into the database...")
+    transformed_df = timestamps.to_database_datetimes(
+        transformed_df, ["last_watered", "recording_at"])
     for _, row in transformed_df.iterrows():
         cursor.execute(
             f"""
@@ -116,6 +135,7 @@ def insert_recordings(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> N
                 row["recording_at"],
             ),
         )
+    metrics.active().count("DbRoundTrips", len(transformed_df))
     logging.info("Recordings inserted successfully.")
 
 
@@ -134,14 +154,109 @@ def load_data_to_database(connection: pymssql.Connection, transformed_df: pd.Dat
         raise
 
 
-if __name__ == "__main__":
+def parameter_rows(dataframe: pd.DataFrame) -> list:
+    """Rows as tuples of plain Python values, with missing values as None."""
+    values = dataframe.astype(object).where(dataframe.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+
+def execute_values(cursor: pymssql.Cursor, statement: str, rows: list,
+                   batch_rows: int = BULK_INSERT_ROWS) -> int:
+    """
+    Execute a statement once per batch of rows, with `{values}` in the statement
+    replaced by a multi-row VALUES list. Returns the number of round trips.
+    """
+    if not rows:
+        return 0
+    width = len(rows[0])
+    batch_rows = max(1, min(batch_rows, MAX_PARAMETERS // width, 1000))
+    placeholder = f"({', '.join(['%s'] * width)})"
+    round_trips = 0
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        cursor.execute(statement.format(values=", ".join([placeholder] * len(batch))),
+                       tuple(value for row in batch for value in row))
+        round_trips += 1
+    return round_trips
+
+
+def bulk_insert_botanists(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> int:
+    """Insert the distinct botanists of a batch that are not in the database yet."""
+    rows = parameter_rows(transformed_df[BOTANIST_COLUMNS].drop_duplicates())
+    return execute_values(cursor, f"""
+        MERGE {SCHEMA_NAME}.botanist WITH (HOLDLOCK) AS target
+        USING (VALUES {{values}}) AS source (first_name, last_name, email, phone)
+        ON target.first_name = source.first_name AND target.last_name = source.last_name
+           AND target.email = source.email AND target.phone = source.phone
+        WHEN NOT MATCHED THEN
+            INSERT (first_name, last_name, email, phone)
+            VALUES (source.first_name, source.last_name, source.email, source.phone);
+        """, rows)
+
+
+def bulk_insert_plants(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> int:
+    """Insert the distinct plants of a batch that are not in the database yet."""
+    rows = parameter_rows(transformed_df.drop_duplicates("plant_id")[
+        ["plant_id", *BOTANIST_COLUMNS, "plant_name"]])
+    return execute_values(cursor, f"""
+        MERGE {SCHEMA_NAME}.plant WITH (HOLDLOCK) AS target
+        USING (
+            SELECT source.plant_id, b.botanist_id, source.plant_name
+            FROM (VALUES {{values}})
+                AS source (plant_id, first_name, last_name, email, phone, plant_name)
+            JOIN {SCHEMA_NAME}.botanist b
+            ON b.first_name = source.first_name AND b.last_name = source.last_name
+               AND b.email = source.email AND b.phone = source.phone
+        ) AS source
+        ON target.plant_id = source.plant_id
+        WHEN NOT MATCHED THEN
+            INSERT (plant_id, botanist_id, plant_name)
+            VALUES (source.plant_id, source.botanist_id, source.plant_name);
+        """, rows)
+
+
+def bulk_insert_recordings(cursor: pymssql.Cursor, transformed_df: pd.DataFrame) -> int:
+    """Insert recordings with multi-row INSERT statements."""
+    transformed_df = timestamps.to_database_datetimes(
+        transformed_df, ["last_watered", "recording_at"])
+    rows = parameter_rows(transformed_df[
+        ["plant_id", "soil_moisture", "temperature", "last_watered", "recording_at"]])
+    return execute_values(cursor, f"""
+        INSERT INTO {SCHEMA_NAME}.recording
+        (plant_id, soil_moisture, temperature, last_watered, recording_at)
+        VALUES {{values}}
+        """, rows)
+
+
+def bulk_load_data(connection: pymssql.Connection, transformed_df: pd.DataFrame,
+                   commit: bool = True) -> None:
+    """
+    Load transformed data like load_data_to_database, but with a statement per batch
+    of up to BULK_INSERT_ROWS rows instead of one per row. Used for large loads such as
+    backfills. With `commit=False` the caller owns the transaction.
+    """
     try:
-        logging.info("Loading cleaned data from %s", CLEANED_FILE)
-        cleaned_df = pd.read_csv(CLEANED_FILE)
-        conn = get_db_connection()
+        cursor = connection.cursor()
+        round_trips = (bulk_insert_botanists(cursor, transformed_df)
+                       + bulk_insert_plants(cursor, transformed_df)
+                       + bulk_insert_recordings(cursor, transformed_df))
+        if commit:
+            connection.commit()
+        metrics.active().count("DbRoundTrips", round_trips)
+        logging.info("Bulk loaded %d rows in %d statements.", len(transformed_df), round_trips)
+    except pymssql.DatabaseError as e:
+        logging.error("Error occurred: %s", e)
+        connection.rollback()
+        raise
 
+
+if __name__ == "__main__":
+    logging.info("Loading cleaned data from %s", CLEANED_FILE)
+    cleaned_df = checkpoints.read_checkpoint(CLEANED_FILE, "cleaned")
+    if cleaned_df is None:
+        logging.error("Cleaned data file not found: %s", CLEANED_FILE)
+    else:
+        conn = get_db_connection()
         load_data_to_database(conn, cleaned_df)
         conn.close()
         logging.info("Data loading process completed successfully.")
-    except FileNotFoundError:
-        logging.error("Cleaned data file not found: %s", CLEANED_FILE)
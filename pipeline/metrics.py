@@ -0,0 +1,152 @@
+"""
+Per-stage metrics for the pipelines.
+
+When PIPELINE_METRICS=emf, stage durations, request latencies and counters are written
+to stdout as one JSON line per run in CloudWatch embedded metric format (EMF), which
+CloudWatch Logs turns into metrics without any extra API calls. Otherwise a no-op
+recorder is used, so instrumented code costs next to nothing.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+
+METRICS_BACKEND = os.getenv("PIPELINE_METRICS", "none").lower()
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "PlantPipeline")
+MAX_EMF_VALUES = 100
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class NullRecorder:
+    """Recorder used when metrics are disabled; every method does nothing."""
+    enabled = False
+
+    def stage(self, name: str):  # pylint: disable=unused-argument
+        """Context manager timing a stage."""
+        return nullcontext()
+
+    def count(self, name: str, value: float = 1, unit: str = "Count") -> None:
+        """Add to a counter."""
+
+    def observe(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        """Record one sample of a distribution, such as a request latency."""
+
+    def flush(self) -> None:
+        """Emit and reset everything recorded so far."""
+
+
+class EmfRecorder(NullRecorder):
+    """Collects metrics for a run and writes them as a CloudWatch EMF JSON line."""
+    enabled = True
+
+    def __init__(self, pipeline_name: str, stream=None):
+        self.pipeline_name = pipeline_name
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.samples = {}
+        self.units = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage and record it as <name>Duration in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(f"{name}Duration",
+                       (time.perf_counter() - start) * 1000, "Milliseconds")
+
+    def count(self, name: str, value: float = 1, unit: str = "Count") -> None:
+        """Add to a counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.units[name] = unit
+
+    def observe(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        """Record one sample of a distribution."""
+        with self.lock:
+            self.samples.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def to_emf(self) -> dict:
+        """Build the EMF document for everything recorded so far."""
+        document = {"Pipeline": self.pipeline_name}
+        definitions = []
+
+        for name, value in self.counters.items():
+            document[name] = round(value, 3)
+            definitions.append({"Name": name, "Unit": self.units[name]})
+
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            step = max(1, len(ordered) / MAX_EMF_VALUES)
+            document[name] = [round(ordered[int(index * step)], 3)
+                              for index in range(min(len(ordered), MAX_EMF_VALUES))]
+            definitions.append({"Name": name, "Unit": self.units[name]})
+            for percentile in (50, 90, 99):
+                index = min(len(ordered) - 1,
+                            len(ordered) * percentile // 100)
+                document[f"{name}P{percentile}"] = round(ordered[index], 3)
+                definitions.append({"Name": f"{name}P{percentile}",
+                                    "Unit": self.units[name]})
+            document[f"{name}Histogram"] = histogram(ordered)
+
+        document["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Pipeline"]],
+                "Metrics": definitions,
+            }],
+        }
+        return document
+
+    def flush(self) -> None:
+        """Write the EMF line and reset the recorder for the next run."""
+        with self.lock:
+            if not self.counters and not self.samples:
+                return
+            line = json.dumps(self.to_emf(), separators=(",", ":"))
+            self.counters, self.samples, self.units = {}, {}, {}
+        self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+def histogram(values: list) -> dict:
+    """Count sorted samples into fixed millisecond buckets, keyed by upper bound."""
+    counts = {}
+    for value in values:
+        bucket = next((f"le_{bound}" for bound in HISTOGRAM_BUCKETS_MS if value <= bound),
+                      "gt_10000")
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+_active = NullRecorder()
+
+
+def configure(pipeline_name: str, backend: str = METRICS_BACKEND) -> NullRecorder:
+    """Create the recorder for this process and make it the active one."""
+    global _active  # pylint: disable=global-statement
+    _active = EmfRecorder(pipeline_name) if backend == "emf" else NullRecorder()
+    return _active
+
+
+def active() -> NullRecorder:
+    """Return the recorder instrumented code should report to."""
+    return _active
+
+
+def timed(stage_name: str):
+    """Decorator recording a function's duration as a stage on the active recorder."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with _active.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+"""
+Opt-in profiling of pipeline runs and dashboard renders.
+
+Set PROFILE to a comma-separated list of modes to enable it:
+- cprofile: deterministic cProfile stats (.prof, plus a .txt summary by cumulative time)
+- sampling: a low-overhead sampling profiler writing collapsed stacks (.folded), which
+  flame graph tools such as speedscope or flamegraph.pl can read
+- memory: tracemalloc's top allocation sites at the end of the call (.memory.txt)
+
+Artifacts are written to PROFILE_DIR and, if PROFILE_UPLOAD is set to a local path or
+s3://bucket/prefix, copied there as well. With PROFILE unset the decorator returns the
+function unchanged, so profiling costs nothing by default.
+"""
+import io
+import os
+import sys
+import time
+import marshal
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from functools import wraps
+from datetime import datetime
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+PROFILE_MODES = tuple(mode.strip() for mode in os.getenv("PROFILE", "").lower().split(",")
+                      if mode.strip())
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_UPLOAD = os.getenv("PROFILE_UPLOAD")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 40
+
+_running = threading.local()
+
+
+class SamplingProfiler:
+    """Samples one thread's call stack on a background thread and counts each stack."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        """Take samples until stopped."""
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self) -> None:
+        """Start sampling."""
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampler thread."""
+        self.stop_event.set()
+        self.thread.join()
+
+    def folded(self) -> str:
+        """Samples in collapsed-stack format, one 'frame;frame;frame count' per line."""
+        return "\n".join(f"{stack} {count}" for stack, count in
+                         sorted(self.stacks.items(), key=lambda item: -item[1])) + "\n"
+
+
+def write_artifact(name: str, content: bytes, directory: str) -> str:
+    """Write an artifact locally, copy it to PROFILE_UPLOAD if set, and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(content)
+    if PROFILE_UPLOAD:
+        try:
+            storage.write_bytes(f"{PROFILE_UPLOAD.rstrip('/')}/{name}", content)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Could not upload profile %s: %s", name, e)
+    logging.info("Profile written to %s", path)
+    return path
+
+
+def cprofile_summary(profiler: cProfile.Profile) -> bytes:
+    """Text summary of the busiest functions by cumulative time."""
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(
+        "cumulative").print_stats(TOP_FUNCTIONS)
+    return output.getvalue().encode("utf-8")
+
+
+def memory_summary(snapshot: tracemalloc.Snapshot) -> bytes:
+    """Text summary of the largest allocation sites."""
+    lines = [f"Top {TOP_ALLOCATIONS} allocation sites"]
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        lines.append(str(stat))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def run_profiled(name: str, modes: tuple, directory: str, function, *args, **kwargs):
+    """Call `function` under the requested profilers and write their artifacts."""
+    prefix = f"{name}-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    profiler = cProfile.Profile() if "cprofile" in modes else None
+    sampler = SamplingProfiler(threading.get_ident()) if "sampling" in modes else None
+    tracing_memory = "memory" in modes and not tracemalloc.is_tracing()
+
+    _running.active = True
+    if tracing_memory:
+        tracemalloc.start()
+    if sampler:
+        sampler.start()
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+        _running.active = False
+
+        if profiler:
+            profiler.create_stats()
+            write_artifact(f"{prefix}.prof", marshal.dumps(profiler.stats), directory)
+            write_artifact(f"{prefix}.txt", cprofile_summary(profiler), directory)
+        if sampler:
+            write_artifact(f"{prefix}.folded", sampler.folded().encode("utf-8"), directory)
+        if tracing_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            write_artifact(f"{prefix}.memory.txt", memory_summary(snapshot), directory)
+        logging.info("Profiled %s in %.2f seconds.", name, elapsed)
+
+
+def profiled(name: str, modes: tuple = PROFILE_MODES, directory: str = PROFILE_DIR):
+    """
+    Decorator profiling every call of a function when profiling modes are enabled.
+    Returns the function unchanged when no mode is set. Calls nested inside an
+    already profiled call are not profiled again.
+    """
+    def decorator(function):
+        if not modes:
+            return function
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_running, "active", False):
+                return function(*args, **kwargs)
+            return run_profiled(name, modes, directory, function, *args, **kwargs)
+        return wrapper
+    return decorator
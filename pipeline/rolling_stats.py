@@ -0,0 +1,269 @@
+"""
+Streaming per-plant statistics for temperature and soil moisture.
+
+Each plant keeps a fixed-size ring buffer of its most recent readings per metric.
+The mean and variance over that window are maintained with Welford's method and
+the min and max with monotonic queues, so every new reading is an O(1) update and
+nothing has to rescan the recording table.
+
+Readings far outside a plant's window are rejected as outliers and not added to it. When
+STATS_MAX_REJECTIONS readings in a row are rejected, the plant has really changed, such
+as after watering, so the window is restarted from the new readings instead.
+"""
+import os
+import json
+import math
+import logging
+import threading
+from collections import deque
+import pandas as pd
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+METRICS = ("temperature", "soil_moisture")
+WINDOW_SIZE = int(os.getenv("STATS_WINDOW_SIZE", "60"))
+SNAPSHOT_LOCATION = os.getenv("STATS_SNAPSHOT")
+OUTLIER_Z_SCORE = float(os.getenv("OUTLIER_Z_SCORE", "4"))
+MIN_SAMPLES = int(os.getenv("STATS_MIN_SAMPLES", "10"))
+MIN_STD = float(os.getenv("STATS_MIN_STD", "0.5"))
+MAX_REJECTIONS = int(os.getenv("STATS_MAX_REJECTIONS", "5"))
+
+
+class RollingStats:
+    """Mean, variance, min and max over the last `window_size` values of one metric."""
+
+    def __init__(self, window_size: int = WINDOW_SIZE):
+        self.window_size = window_size
+        self.buffer = [0.0] * window_size
+        self.head = 0
+        self.count = 0
+        self.seen = 0
+        self.rejections = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min_queue = deque()
+        self.max_queue = deque()
+
+    def update(self, value: float) -> None:
+        """Add a reading, evicting the oldest one once the window is full."""
+        self.rejections = 0
+        if self.count < self.window_size:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            oldest = self.buffer[self.head]
+            old_mean = self.mean
+            self.mean += (value - oldest) / self.count
+            self.m2 += (value - oldest) * (value - self.mean + oldest - old_mean)
+            self.m2 = max(self.m2, 0.0)
+
+        self.buffer[self.head] = value
+        self.head = (self.head + 1) % self.window_size
+
+        oldest_kept = self.seen - self.count + 1
+        for queue, keep in ((self.min_queue, lambda last: last < value),
+                            (self.max_queue, lambda last: last > value)):
+            while queue and not keep(queue[-1][1]):
+                queue.pop()
+            queue.append((self.seen, value))
+            while queue[0][0] < oldest_kept:
+                queue.popleft()
+        self.seen += 1
+
+    @property
+    def variance(self) -> float:
+        """Sample variance of the readings in the window."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation of the readings in the window."""
+        return math.sqrt(self.variance)
+
+    @property
+    def minimum(self) -> float:
+        """Smallest reading in the window."""
+        return self.min_queue[0][1] if self.min_queue else None
+
+    @property
+    def maximum(self) -> float:
+        """Largest reading in the window."""
+        return self.max_queue[0][1] if self.max_queue else None
+
+    def values(self) -> list:
+        """Readings in the window, oldest first."""
+        if self.count < self.window_size:
+            return self.buffer[:self.count]
+        return self.buffer[self.head:] + self.buffer[:self.head]
+
+    def z_score(self, value: float) -> float:
+        """
+        How many standard deviations a value is from the window mean.
+
+        The deviation is floored at MIN_STD so a plant whose readings have been
+        perfectly flat does not reject the first small change.
+        """
+        return abs(value - self.mean) / max(self.std, MIN_STD)
+
+    def to_dict(self) -> dict:
+        """Summary and window contents for the snapshot."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 4),
+            "std": round(self.std, 4),
+            "min": self.minimum,
+            "max": self.maximum,
+            "rejections": self.rejections,
+            "values": self.values(),
+        }
+
+    @classmethod
+    def from_values(cls, values: list, window_size: int = WINDOW_SIZE) -> "RollingStats":
+        """Rebuild the statistics by replaying a window of readings."""
+        stats = cls(window_size)
+        for value in values[-window_size:]:
+            stats.update(value)
+        return stats
+
+
+class PlantStatistics:
+    """
+    Rolling statistics for every plant and metric seen by the pipeline. The daemon
+    judges and adds readings from different threads, so every method holds a lock.
+    """
+
+    def __init__(self, window_size: int = WINDOW_SIZE):
+        self.window_size = window_size
+        self.plants = {}
+        self.lock = threading.RLock()
+
+    def get(self, plant_id: int, metric: str) -> RollingStats:
+        """Return the statistics for a plant's metric, creating them if needed."""
+        with self.lock:
+            plant = self.plants.setdefault(int(plant_id), {})
+            if metric not in plant:
+                plant[metric] = RollingStats(self.window_size)
+            return plant[metric]
+
+    def update(self, plant_df: pd.DataFrame) -> None:
+        """Add every reading in a cleaned batch."""
+        with self.lock:
+            for row in plant_df[["plant_id", *METRICS]].itertuples(index=False):
+                for metric in METRICS:
+                    self.get(row.plant_id, metric).update(
+                        float(getattr(row, metric)))
+
+    def is_outlier(self, plant_id: int, values: dict, threshold: float = OUTLIER_Z_SCORE,
+                   min_samples: int = MIN_SAMPLES,
+                   max_rejections: int = MAX_REJECTIONS) -> bool:
+        """
+        Whether any metric of a reading is more than `threshold` deviations from its
+        window. Each rejection is counted, and once a window has rejected
+        `max_rejections` readings in a row it is restarted and the reading is kept.
+        """
+        with self.lock:
+            plant = self.plants.get(int(plant_id), {})
+            deviating = [metric for metric in METRICS
+                         if metric in plant and plant[metric].count >= min_samples
+                         and plant[metric].z_score(values[metric]) > threshold]
+            for metric in deviating:
+                plant[metric].rejections += 1
+            if deviating and all(plant[metric].rejections >= max_rejections
+                                 for metric in deviating):
+                logging.info("Plant %s readings moved to a new level, restarting the %s "
+                             "window.", plant_id, " and ".join(deviating))
+                for metric in deviating:
+                    plant[metric] = RollingStats(self.window_size)
+                return False
+            return bool(deviating)
+
+    def outlier_mask(self, plant_df: pd.DataFrame,
+                     threshold: float = OUTLIER_Z_SCORE,
+                     min_samples: int = MIN_SAMPLES,
+                     max_rejections: int = MAX_REJECTIONS) -> pd.Series:
+        """Flag rows where any metric is more than `threshold` deviations from its window."""
+        with self.lock:
+            mask = [self.is_outlier(
+                row.plant_id, {metric: float(getattr(row, metric)) for metric in METRICS},
+                threshold, min_samples, max_rejections)
+                for row in plant_df[["plant_id", *METRICS]].itertuples(index=False)]
+        return pd.Series(mask, index=plant_df.index, dtype=bool)
+
+    def replay(self, plant_df: pd.DataFrame, threshold: float = OUTLIER_Z_SCORE,
+               min_samples: int = MIN_SAMPLES,
+               max_rejections: int = MAX_REJECTIONS) -> pd.Series:
+        """
+        Judge and add readings one at a time in row order, the way the minute pipeline
+        sees them, so historical readings can be re-checked in a single pass. Readings
+        flagged as outliers are not added. Rows must be in time order for each plant.
+        """
+        mask = []
+        with self.lock:
+            for row in plant_df[["plant_id", *METRICS]].itertuples(index=False):
+                values = {metric: float(getattr(row, metric)) for metric in METRICS}
+                outlier = self.is_outlier(row.plant_id, values, threshold, min_samples,
+                                          max_rejections)
+                if not outlier:
+                    for metric, value in values.items():
+                        self.get(row.plant_id, metric).update(value)
+                mask.append(outlier)
+        return pd.Series(mask, index=plant_df.index, dtype=bool)
+
+    def to_dict(self) -> dict:
+        """Compact, JSON-serialisable snapshot of all plants."""
+        with self.lock:
+            return {
+                "window_size": self.window_size,
+                "plants": {
+                    str(plant_id): {metric: stats.to_dict()
+                                    for metric, stats in metrics.items()}
+                    for plant_id, metrics in self.plants.items()
+                },
+            }
+
+    @classmethod
+    def from_dict(cls, snapshot: dict) -> "PlantStatistics":
+        """Restore statistics from a snapshot produced by `to_dict`."""
+        statistics = cls(snapshot.get("window_size", WINDOW_SIZE))
+        for plant_id, metrics in snapshot.get("plants", {}).items():
+            statistics.plants[int(plant_id)] = {}
+            for metric, summary in metrics.items():
+                stats = RollingStats.from_values(summary["values"], statistics.window_size)
+                stats.rejections = summary.get("rejections", 0)
+                statistics.plants[int(plant_id)][metric] = stats
+        return statistics
+
+
+def load_snapshot(location: str) -> PlantStatistics:
+    """Load statistics from a local file or S3 location, starting empty if there is none."""
+    data = storage.read_bytes(location)
+    if data is None:
+        logging.info("No statistics snapshot found at %s.", location)
+        return PlantStatistics()
+    return PlantStatistics.from_dict(json.loads(data))
+
+
+def save_snapshot(statistics: PlantStatistics, location: str) -> None:
+    """Write statistics to a local file or S3 location."""
+    data = json.dumps(statistics.to_dict(), separators=(",", ":"))
+    storage.write_bytes(location, data.encode("utf-8"))
+    logging.info("Statistics snapshot saved to %s.", location)
+
+
+def read_plant_summaries(location: str = SNAPSHOT_LOCATION) -> dict:
+    """
+    The per-plant summaries of the snapshot at `location` and of its per-shard
+    snapshots, as written by sharded runs, by plant_id string. Empty if unset.
+    """
+    if not location:
+        return {}
+    root, extension = os.path.splitext(location)
+    plants = {}
+    for snapshot in storage.list_locations(root):
+        if snapshot == location or (snapshot.startswith(f"{root}-shard-")
+                                    and snapshot.endswith(extension)):
+            plants.update(json.loads(storage.read_bytes(snapshot)).get("plants", {}))
+    return plants
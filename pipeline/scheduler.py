@@ -0,0 +1,124 @@
+"""
+Adaptive per-plant polling schedule for the extraction stage.
+
+Each plant's recent rate of change is tracked for temperature and soil moisture.
+Plants whose readings are stable back off exponentially, down to one poll every
+POLL_MAX_INTERVAL seconds, while volatile plants and plants close to a health
+threshold are polled at the full rate.
+"""
+import os
+import json
+import time
+import logging
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+ADAPTIVE_POLLING = os.getenv("ADAPTIVE_POLLING", "false").lower() == "true"
+STATE_LOCATION = os.getenv("SCHEDULER_STATE")
+MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "60"))
+MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "900"))
+
+STABLE_RATES = {"temperature": 0.05, "soil_moisture": 0.1}
+THRESHOLDS = {"temperature": (5.0, 30.0), "soil_moisture": (20.0, 95.0)}
+THRESHOLD_MARGIN = 0.1
+RATE_SMOOTHING = 0.5
+
+
+def near_threshold(metric: str, value: float) -> bool:
+    """Whether a reading is within the margin of, or beyond, its healthy range."""
+    low, high = THRESHOLDS[metric]
+    margin = (high - low) * THRESHOLD_MARGIN
+    return value <= low + margin or value >= high - margin
+
+
+class PollScheduler:
+    """Decides which plants are due to be polled and learns from their readings."""
+
+    def __init__(self, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.plants = {}
+        self.last_cycle = {}
+
+    def due_plants(self, plant_ids, now: float = None) -> list:
+        """Return the plants due this cycle and record the cycle's hit rate."""
+        now = time.time() if now is None else now
+        plant_ids = list(plant_ids)
+        tolerance = self.min_interval / 2
+        due = [plant_id for plant_id in plant_ids
+               if plant_id not in self.plants
+               or now + tolerance >= self.plants[plant_id]["next_poll"]]
+
+        skipped = len(plant_ids) - len(due)
+        self.last_cycle = {
+            "plants": len(plant_ids),
+            "polled": len(due),
+            "skipped": skipped,
+            "hit_rate": skipped / len(plant_ids) if plant_ids else 0.0,
+        }
+        logging.info("Scheduler polling %d of %d plants (hit rate %.0f%%).",
+                     len(due), len(plant_ids), self.last_cycle["hit_rate"] * 100)
+        return due
+
+    def observe(self, records: list, now: float = None) -> None:
+        """Update each polled plant's rate of change and next poll time from its readings."""
+        now = time.time() if now is None else now
+        for record in records:
+            try:
+                values = {metric: float(record[metric]) for metric in THRESHOLDS}
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.plants[record["plant_id"]] = self.next_state(
+                self.plants.get(record["plant_id"]), values, now)
+
+    def next_state(self, state: dict, values: dict, now: float) -> dict:
+        """Work out a plant's new rates and interval after a reading."""
+        if state is None:
+            return {"values": values, "rates": {}, "last_poll": now,
+                    "interval": self.min_interval, "next_poll": now + self.min_interval}
+
+        minutes = max((now - state["last_poll"]) / 60, 1 / 60)
+        rates = {}
+        for metric, value in values.items():
+            rate = abs(value - state["values"][metric]) / minutes
+            previous = state["rates"].get(metric, rate)
+            rates[metric] = RATE_SMOOTHING * rate + \
+                (1 - RATE_SMOOTHING) * previous
+
+        volatile = any(rates[metric] > STABLE_RATES[metric] for metric in rates)
+        at_risk = any(near_threshold(metric, value)
+                      for metric, value in values.items())
+        if volatile or at_risk:
+            interval = self.min_interval
+        else:
+            interval = min(state["interval"] * 2, self.max_interval)
+
+        return {"values": values, "rates": rates, "last_poll": now,
+                "interval": interval, "next_poll": now + interval}
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable state of every plant."""
+        return {str(plant_id): state for plant_id, state in self.plants.items()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "PollScheduler":
+        """Restore a scheduler from `to_dict` output."""
+        scheduler = cls()
+        scheduler.plants = {int(plant_id): plant_state
+                            for plant_id, plant_state in state.items()}
+        return scheduler
+
+
+def load_state(location: str) -> PollScheduler:
+    """Load scheduler state from a local file or S3 location, starting fresh if there is none."""
+    data = storage.read_bytes(location)
+    if data is None:
+        return PollScheduler()
+    return PollScheduler.from_dict(json.loads(data))
+
+
+def save_state(scheduler: PollScheduler, location: str) -> None:
+    """Write scheduler state to a local file or S3 location."""
+    data = json.dumps(scheduler.to_dict(), separators=(",", ":"))
+    storage.write_bytes(location, data.encode("utf-8"))
@@ -0,0 +1,178 @@
+"""
+Splits the minute pipeline across several workers for large numbers of plants.
+
+Plant IDs are assigned to shards with a consistent hash ring, so each plant always
+belongs to the same shard and changing the number of shards only moves a small share
+of plants. Every shard runs its own extract -> transform -> load slice, either as a
+local process or as a separate Lambda invocation with shard parameters. Each shard
+costs a process or an invocation to start, so runs are capped at one shard per
+MIN_PLANTS_PER_SHARD plants and small fleets run as a single shard.
+"""
+import os
+import json
+import bisect
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import boto3
+import chart_payloads
+import checkpoints
+import extract
+import metrics
+import rolling_stats
+import scheduler
+import spool
+import stages
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+# bench_sharding.py: 0.9-1.2x at 6-12 plants per shard, 1.3-1.8x from 25 with 2 to 8 shards
+MIN_PLANTS_PER_SHARD = int(os.getenv("MIN_PLANTS_PER_SHARD", "25"))
+VIRTUAL_NODES = 64
+LAMBDA_FUNCTION_NAME = os.getenv("LAMBDA_FUNCTION_NAME")
+
+
+def hash_key(key: str) -> int:
+    """Stable 64-bit hash of a key, the same in every process."""
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping plant IDs to shards."""
+
+    def __init__(self, shard_count: int, virtual_nodes: int = VIRTUAL_NODES):
+        if shard_count < 1:
+            raise ValueError("Shard count must be at least 1.")
+        self.shard_count = shard_count
+        ring = sorted((hash_key(f"shard-{shard}-{node}"), shard)
+                      for shard in range(shard_count)
+                      for node in range(virtual_nodes))
+        self.points = [point for point, _ in ring]
+        self.shards = [shard for _, shard in ring]
+
+    def shard_for(self, plant_id: int) -> int:
+        """Return the shard that owns a plant."""
+        position = bisect.bisect(self.points, hash_key(f"plant-{plant_id}"))
+        return self.shards[position % len(self.points)]
+
+
+def effective_shard_count(shard_count: int, plant_count: int,
+                          min_plants_per_shard: int = MIN_PLANTS_PER_SHARD) -> int:
+    """Return the shards worth running for a number of plants, at least one."""
+    return max(1, min(shard_count, plant_count // max(1, min_plants_per_shard)))
+
+
+def plants_for_shard(shard_index: int, shard_count: int, plant_ids=None) -> list:
+    """Return the plant IDs owned by one shard."""
+    ring = HashRing(shard_count)
+    return [plant_id for plant_id in (extract.PLANT_IDS if plant_ids is None else plant_ids)
+            if ring.shard_for(plant_id) == shard_index]
+
+
+def run_shard(shard_index: int, shard_count: int, plant_ids=None) -> int:
+    """Run the extract, transform and load slice for one shard and return the rows loaded."""
+    try:
+        return run_shard_stages(shard_index, shard_count,
+                                plants_for_shard(shard_index, shard_count, plant_ids))
+    finally:
+        metrics.active().flush()
+
+
+def run_shard_stages(shard_index: int, shard_count: int, shard_plant_ids: list) -> int:
+    """Extract, transform and load one shard's plants."""
+    logging.info("Shard %d/%d processing %d plants.",
+                 shard_index, shard_count, len(shard_plant_ids))
+    if not shard_plant_ids:
+        return 0
+
+    stats_location = storage.shard_location(
+        rolling_stats.SNAPSHOT_LOCATION, shard_index, shard_count)
+    checkpoint = storage.shard_location(checkpoints.checkpoint_location(
+        checkpoints.CHECKPOINT_LOCATION, "cleaned"), shard_index, shard_count)
+    spool_location = storage.shard_location(
+        spool.SPOOL_LOCATION.rstrip("/"), shard_index, shard_count)
+    charts_location = storage.shard_location(
+        chart_payloads.PAYLOADS_LOCATION, shard_index, shard_count)
+    stages.retry_checkpoint(checkpoint, stats_location, spool_location, charts_location)
+    poll_scheduler = None
+    scheduler_location = storage.shard_location(
+        scheduler.STATE_LOCATION, shard_index, shard_count)
+    if scheduler.ADAPTIVE_POLLING:
+        poll_scheduler = stages.get_scheduler(scheduler_location)
+
+    raw_df = stages.run_extraction(plant_ids=shard_plant_ids,
+                                     poll_scheduler=poll_scheduler)
+    if poll_scheduler is not None:
+        stages.save_scheduler(scheduler_location)
+    if raw_df.empty:
+        return 0
+    cleaned_df = stages.run_transformation(raw_df, stats_location)
+    stages.load_with_checkpoint(cleaned_df, checkpoint, spool_location)
+    stages.update_plant_stats(cleaned_df, stats_location)
+    stages.update_chart_payloads(cleaned_df, charts_location)
+    return len(cleaned_df)
+
+
+def run_sharded(shard_count: int = SHARD_COUNT, workers: int = None, plant_ids=None,
+                min_plants_per_shard: int = MIN_PLANTS_PER_SHARD) -> int:
+    """
+    Run every shard in a local process pool and return the total rows loaded.
+    A run with a single shard, as below `min_plants_per_shard` plants per shard,
+    stays in this process.
+    """
+    plant_ids = extract.PLANT_IDS if plant_ids is None else plant_ids
+    shard_count = effective_shard_count(shard_count, len(plant_ids), min_plants_per_shard)
+    rows_loaded = 0
+    if shard_count == 1:
+        try:
+            rows_loaded = run_shard(0, 1, plant_ids)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Shard 0 failed: %s", e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers or shard_count) as executor:
+            futures = [executor.submit(run_shard, shard_index, shard_count, plant_ids)
+                       for shard_index in range(shard_count)]
+            for shard_index, future in enumerate(futures):
+                try:
+                    rows_loaded += future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Shard %d failed: %s", shard_index, e)
+    logging.info("Sharded run loaded %d rows across %d shards.",
+                 rows_loaded, shard_count)
+    return rows_loaded
+
+
+def invoke_lambda_shards(shard_count: int = SHARD_COUNT,
+                         function_name: str = LAMBDA_FUNCTION_NAME,
+                         min_plants_per_shard: int = MIN_PLANTS_PER_SHARD) -> None:
+    """Fan out one asynchronous Lambda invocation per shard worth running."""
+    shard_count = effective_shard_count(
+        shard_count, len(extract.PLANT_IDS), min_plants_per_shard)
+    lambda_client = boto3.client("lambda")
+    for shard_index in range(shard_count):
+        lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"shard_index": shard_index,
+                                "shard_count": shard_count}).encode("utf-8"),
+        )
+        logging.info("Invoked %s for shard %d/%d.",
+                     function_name, shard_index, shard_count)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the minute pipeline split across shards.")
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--lambda", dest="use_lambda", action="store_true",
+                        help="Invoke one Lambda per shard instead of local processes.")
+    args = parser.parse_args()
+
+    if args.use_lambda:
+        invoke_lambda_shards(args.shards)
+    else:
+        run_sharded(args.shards, args.workers)
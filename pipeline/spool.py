@@ -0,0 +1,128 @@
+"""
+Spool for cleaned readings that could not be loaded because the database was unreachable.
+
+Each batch is appended as a new zstd-compressed Arrow IPC segment, named so that segments
+sort in the order they were written, and segments are never modified once written. When
+the database can be reached again, the backlog is replayed oldest first through
+`load.bulk_load_data` in batches of SPOOL_REPLAY_ROWS rows, and each batch's segments
+are deleted once it has been committed.
+
+After a failed connection the spool records when the database may next be tried, so runs
+during an outage spool their readings straight away instead of waiting on the login
+timeout again.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pymssql
+import checkpoints
+import load
+import metrics
+import storage
+
+logging.basicConfig(level=logging.INFO)
+
+SPOOL_LOCATION = os.getenv("SPOOL_LOCATION", "")
+SPOOL_REPLAY_ROWS = int(os.getenv("SPOOL_REPLAY_ROWS", "50000"))
+SPOOL_RETRY_SECONDS = float(os.getenv("SPOOL_RETRY_SECONDS", "300"))
+SEGMENT_SUFFIX = ".arrow"
+UNAVAILABLE_FILE = "_unavailable.json"
+WRITE_OPTIONS = ipc.IpcWriteOptions(compression="zstd")
+
+
+def spool_directory(location: str) -> str:
+    """The spool location with a trailing slash."""
+    return location if location.endswith("/") else f"{location}/"
+
+
+def append(cleaned_df: pd.DataFrame, location: str = SPOOL_LOCATION) -> str:
+    """Append cleaned readings to the spool as a new segment and return its location."""
+    table = checkpoints.to_table(cleaned_df, "cleaned")
+    sink = pa.BufferOutputStream()
+    with ipc.new_file(sink, table.schema, options=WRITE_OPTIONS) as writer:
+        writer.write_table(table)
+    segment = (f"{spool_directory(location)}{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}"
+               f"-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}")
+    storage.write_bytes(segment, sink.getvalue().to_pybytes())
+    metrics.active().count("RowsSpooled", table.num_rows)
+    logging.warning("Spooled %d rows to %s.", table.num_rows, segment)
+    return segment
+
+
+def segments(location: str = SPOOL_LOCATION) -> list:
+    """Spooled segments, oldest first."""
+    return [segment for segment in storage.list_locations(spool_directory(location))
+            if segment.endswith(SEGMENT_SUFFIX)]
+
+
+def read_segment(segment: str) -> pa.Table:
+    """Read one spooled segment."""
+    return ipc.open_file(pa.BufferReader(storage.read_bytes(segment))).read_all()
+
+
+def mark_unavailable(location: str = SPOOL_LOCATION,
+                     retry_seconds: float = SPOOL_RETRY_SECONDS) -> None:
+    """Record that the database could not be reached, and when to try it again."""
+    storage.write_bytes(f"{spool_directory(location)}{UNAVAILABLE_FILE}", json.dumps(
+        {"retry_at": time.time() + retry_seconds}).encode("utf-8"))
+
+
+def database_available(location: str = SPOOL_LOCATION) -> bool:
+    """False while a recent failed connection says the database is still down."""
+    data = storage.read_bytes(f"{spool_directory(location)}{UNAVAILABLE_FILE}")
+    return data is None or json.loads(data)["retry_at"] <= time.time()
+
+
+def mark_available(location: str = SPOOL_LOCATION) -> None:
+    """Forget an earlier failed connection."""
+    storage.delete(f"{spool_directory(location)}{UNAVAILABLE_FILE}")
+
+
+def replay(connection: pymssql.Connection, location: str = SPOOL_LOCATION,
+           batch_rows: int = SPOOL_REPLAY_ROWS) -> int:
+    """
+    Load every spooled segment, oldest first, with one bulk load and commit per batch
+    of about `batch_rows` rows, deleting each batch's segments once it is committed.
+    Returns the number of rows replayed.
+    """
+    pending = segments(location)
+    if not pending:
+        return 0
+    logging.info("Replaying %d spooled segments.", len(pending))
+    replayed = batch_size = 0
+    tables, batch_segments = [], []
+    for position, segment in enumerate(pending, start=1):
+        tables.append(read_segment(segment))
+        batch_segments.append(segment)
+        batch_size += tables[-1].num_rows
+        if batch_size < batch_rows and position < len(pending):
+            continue
+        load.bulk_load_data(connection, pa.concat_tables(tables).to_pandas())
+        for done in batch_segments:
+            storage.delete(done)
+        replayed += batch_size
+        tables, batch_segments, batch_size = [], [], 0
+    metrics.active().count("RowsReplayed", replayed)
+    logging.info("Replayed %d spooled rows.", replayed)
+    return replayed
+
+
+def main() -> None:
+    """Replay the spool now instead of waiting for the next pipeline run."""
+    connection = load.get_db_connection()
+    try:
+        replay(connection)
+        mark_available()
+    finally:
+        connection.close()
+        metrics.active().flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Extract, transform and load stages of the minute pipeline, shared by the scheduled
+run in `pipeline.py`, its shards in `sharding.py` and the long-running daemon.
+"""
+import logging
+from functools import lru_cache
+import pandas as pd
+import pymssql
+import requests
+from dotenv import load_dotenv
+from botocore.exceptions import BotoCoreError, ClientError
+import chart_payloads
+import checkpoints
+import extract
+import transform
+import load
+import metrics
+import rolling_stats
+import scheduler
+import spool
+
+logging.basicConfig(level=logging.INFO)
+
+load_dotenv(override=True)
+metrics.configure("MinutePipeline")
+
+
+@lru_cache(maxsize=None)
+def get_plant_stats(
+        location: str = rolling_stats.SNAPSHOT_LOCATION) -> rolling_stats.PlantStatistics:
+    """Return the rolling plant statistics, loading the snapshot once per process."""
+    if not location:
+        return rolling_stats.PlantStatistics()
+    try:
+        return rolling_stats.load_snapshot(location)
+    except (OSError, ValueError, BotoCoreError, ClientError) as e:
+        logging.error("Could not load statistics snapshot: %s", e)
+        return rolling_stats.PlantStatistics()
+
+
+def update_plant_stats(cleaned_df: pd.DataFrame,
+                       location: str = rolling_stats.SNAPSHOT_LOCATION) -> None:
+    """Add the loaded readings to the rolling statistics and save a snapshot."""
+    stats = get_plant_stats(location)
+    stats.update(cleaned_df)
+    if not location:
+        return
+    try:
+        rolling_stats.save_snapshot(stats, location)
+    except (OSError, BotoCoreError, ClientError) as e:
+        logging.error("Could not save statistics snapshot: %s", e)
+
+
+def update_chart_payloads(cleaned_df: pd.DataFrame,
+                          location: str = chart_payloads.PAYLOADS_LOCATION) -> None:
+    """Merge the loaded readings into the dashboard's chart payloads."""
+    if not location:
+        return
+    try:
+        chart_payloads.update(cleaned_df, location)
+    except (OSError, ValueError, BotoCoreError, ClientError) as e:
+        logging.error("Could not update chart payloads: %s", e)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler(location: str = scheduler.STATE_LOCATION) -> scheduler.PollScheduler:
+    """Return the adaptive poll scheduler, loading its state once per process."""
+    if not location:
+        return scheduler.PollScheduler()
+    try:
+        return scheduler.load_state(location)
+    except (OSError, ValueError, BotoCoreError, ClientError) as e:
+        logging.error("Could not load scheduler state: %s", e)
+        return scheduler.PollScheduler()
+
+
+def save_scheduler(location: str = scheduler.STATE_LOCATION) -> None:
+    """Save the adaptive poll scheduler's state if a location is configured."""
+    if not location:
+        return
+    try:
+        scheduler.save_state(get_scheduler(location), location)
+    except (OSError, BotoCoreError, ClientError) as e:
+        logging.error("Could not save scheduler state: %s", e)
+
+
+@metrics.timed("Extract")
+def run_extraction(session: requests.Session = None, plant_ids: list = None,
+                   poll_scheduler: scheduler.PollScheduler = None) -> pd.DataFrame:
+    """
+    Run the extraction process to retrieve raw plant data from the API.
+    Only the given plant IDs are polled if `plant_ids` is set, and only the ones
+    that are due if a scheduler is given. Returns an empty DataFrame when the
+    scheduler has no plants due.
+    """
+    logging.info("Starting the extraction process...")
+    all_data = []
+
+    plant_ids = extract.PLANT_IDS if plant_ids is None else plant_ids
+    if poll_scheduler is not None:
+        plant_ids = poll_scheduler.due_plants(plant_ids)
+        if not plant_ids:
+            logging.info("No plants are due to be polled.")
+            return pd.DataFrame()
+
+    for plant_id in plant_ids:
+        raw_data = extract.get_plant_data(plant_id, session)
+        if raw_data:
+            parsed_data = extract.parse_plant_data(raw_data)
+            if parsed_data:
+                all_data.append(parsed_data)
+
+    if poll_scheduler is not None:
+        poll_scheduler.observe(all_data)
+
+    if not all_data:
+        logging.warning("No data was extracted from the API.")
+        raise ValueError("Extraction process resulted in an empty dataset.")
+
+    raw_df = pd.DataFrame(all_data)
+    metrics.active().count("RowsExtracted", len(raw_df))
+    logging.info(
+        "Extraction completed. Retrieved data for %d plants.", len(raw_df))
+    return raw_df
+
+
+@metrics.timed("Transform")
+def run_transformation(raw_df: pd.DataFrame,
+                       stats_location: str = rolling_stats.SNAPSHOT_LOCATION) -> pd.DataFrame:
+    """Run the transformation process to clean the extracted data."""
+    logging.info("Starting the transformation process...")
+    cleaned_df = transform.clean_plant_data(
+        raw_df, get_plant_stats(stats_location))
+    metrics.active().count("RowsCleaned", len(cleaned_df))
+    metrics.active().count("RowsRejected", len(raw_df) - len(cleaned_df))
+    logging.info(
+        "Transformation completed. Cleaned data contains %d rows.", len(cleaned_df))
+    return cleaned_df
+
+
+@metrics.timed("Load")
+def run_loading(cleaned_df: pd.DataFrame, conn: pymssql.Connection = None) -> None:
+    """
+    Run the loading process to insert cleaned data into the SQL Server database.
+    An open connection can be passed in to keep it warm between runs; otherwise
+    a new connection is opened and closed.
+    """
+    logging.info("Starting the loading process...")
+    if conn is not None:
+        load.load_data_to_database(conn, cleaned_df)
+    else:
+        conn = load.get_db_connection()
+        load.load_data_to_database(conn, cleaned_df)
+        conn.close()
+    metrics.active().count("RowsLoaded", len(cleaned_df))
+    logging.info(
+        "Loading completed. Data successfully loaded into the database.")
+
+
+def load_or_spool(cleaned_df: pd.DataFrame,
+                  spool_location: str = spool.SPOOL_LOCATION) -> None:
+    """
+    Load cleaned data after replaying any spooled backlog. With a spool location set,
+    readings are spooled instead when the database cannot be reached, is still
+    considered down after a recent failed connection, or drops the connection during
+    the replay or the load. Other database errors are raised.
+    """
+    if not spool_location:
+        run_loading(cleaned_df)
+        return
+    if not spool.database_available(spool_location):
+        logging.warning("Database marked as unavailable, spooling without connecting.")
+        spool.append(cleaned_df, spool_location)
+        return
+    try:
+        conn = load.get_db_connection()
+    except pymssql.Error:
+        spool.mark_unavailable(spool_location)
+        spool.append(cleaned_df, spool_location)
+        return
+    try:
+        spool.mark_available(spool_location)
+        spool.replay(conn, spool_location)
+        run_loading(cleaned_df, conn)
+    except (pymssql.OperationalError, pymssql.InterfaceError) as e:
+        logging.error("Database connection lost while loading, spooling: %s", e)
+        spool.mark_unavailable(spool_location)
+        spool.append(cleaned_df, spool_location)
+    finally:
+        conn.close()
+
+
+def load_with_checkpoint(cleaned_df: pd.DataFrame, location: str = None,
+                         spool_location: str = spool.SPOOL_LOCATION) -> None:
+    """
+    Load or spool cleaned data, keeping it in a checkpoint at `location` until that
+    has succeeded, so a failed load can be retried from it by the next run.
+    """
+    if location:
+        checkpoints.write_checkpoint(cleaned_df, location, "cleaned")
+    load_or_spool(cleaned_df, spool_location)
+    if location:
+        checkpoints.clear_checkpoint(location)
+
+
+def retry_checkpoint(location: str = None,
+                     stats_location: str = rolling_stats.SNAPSHOT_LOCATION,
+                     spool_location: str = spool.SPOOL_LOCATION,
+                     charts_location: str = chart_payloads.PAYLOADS_LOCATION) -> None:
+    """Load or spool the readings left in a checkpoint by a run whose load failed."""
+    if not location:
+        return
+    cleaned_df = checkpoints.read_checkpoint(location, "cleaned")
+    if cleaned_df is None:
+        return
+    logging.info("Retrying the load of %d rows from %s.", len(cleaned_df), location)
+    load_or_spool(cleaned_df, spool_location)
+    checkpoints.clear_checkpoint(location)
+    update_plant_stats(cleaned_df, stats_location)
+    update_chart_payloads(cleaned_df, charts_location)
@@ -0,0 +1,98 @@
+"""Reads and writes small pipeline state files, either on local disk or in S3."""
+import os
+import logging
+import boto3
+from botocore.exceptions import ClientError
+
+logging.basicConfig(level=logging.INFO)
+
+S3_PREFIX = "s3://"
+
+
+def split_s3_uri(location: str) -> tuple:
+    """Split an s3://bucket/key location into its bucket and key."""
+    bucket, _, key = location[len(S3_PREFIX):].partition("/")
+    return bucket, key
+
+
+def read_bytes(location: str) -> bytes:
+    """Return the contents of a local file or S3 object, or None if it does not exist."""
+    if location.startswith(S3_PREFIX):
+        bucket, key = split_s3_uri(location)
+        try:
+            response = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+            return response["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            logging.error("Error reading %s: %s", location, e)
+            raise
+
+    if not os.path.exists(location):
+        return None
+    with open(location, "rb") as file:
+        return file.read()
+
+
+def write_bytes(location: str, data: bytes) -> None:
+    """Write to a local file or S3 object, replacing local files atomically."""
+    if location.startswith(S3_PREFIX):
+        bucket, key = split_s3_uri(location)
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=data)
+        return
+
+    directory = os.path.dirname(location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_location = f"{location}.tmp"
+    with open(temp_location, "wb") as file:
+        file.write(data)
+    os.replace(temp_location, location)
+
+
+def list_locations(prefix: str) -> list:
+    """Every local file or S3 object whose location starts with `prefix`, sorted."""
+    if prefix.startswith(S3_PREFIX):
+        bucket, key_prefix = split_s3_uri(prefix)
+        locations = []
+        for page in boto3.client("s3").get_paginator("list_objects_v2").paginate(
+                Bucket=bucket, Prefix=key_prefix):
+            locations.extend(f"{S3_PREFIX}{bucket}/{item['Key']}"
+                             for item in page.get("Contents", []))
+        return sorted(locations)
+
+    directory = prefix if prefix.endswith(os.sep) else os.path.dirname(prefix)
+    locations = []
+    for root, _, files in os.walk(directory or "."):
+        locations.extend(os.path.join(root, name) for name in files)
+    return sorted(location for location in locations if location.startswith(prefix))
+
+
+def local_copy(location: str, directory: str) -> str:
+    """
+    Path of a local file holding the location's contents: the location itself if it
+    is local, otherwise a streamed download into `directory`.
+    """
+    if not location.startswith(S3_PREFIX):
+        return location
+    bucket, key = split_s3_uri(location)
+    path = os.path.join(directory, os.path.basename(key))
+    boto3.client("s3").download_file(bucket, key, path)
+    return path
+
+
+def delete(location: str) -> None:
+    """Remove a local file or S3 object if it exists."""
+    if location.startswith(S3_PREFIX):
+        bucket, key = split_s3_uri(location)
+        boto3.client("s3").delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(location):
+        os.remove(location)
+
+
+def shard_location(location: str, shard_index: int, shard_count: int) -> str:
+    """State location for one shard, so concurrent shards never overwrite each other."""
+    if not location:
+        return location
+    root, extension = os.path.splitext(location)
+    return f"{root}-shard-{shard_index}-of-{shard_count}{extension}"
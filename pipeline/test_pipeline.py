@@ -1,11 +1,34 @@
 """Tests for extracting raw data from API, transforming and loading into database."""
+import io
+import os
+import json
+import tempfile
+import threading
 import unittest
 from unittest.mock import MagicMock, patch
 import requests
 import pandas as pd
+import pymssql
 from extract import get_plant_data, parse_plant_data, extract_botanist_name
 from transform import clean_plant_data
+from timestamps import parse_recording_at, parse_last_watered, to_database_datetimes
+from rolling_stats import (RollingStats, PlantStatistics, load_snapshot, read_plant_summaries,
+                           save_snapshot)
+from daemon import PipelineDaemon
+from sharding import HashRing, effective_shard_count, plants_for_shard, run_sharded
+from scheduler import PollScheduler
+import metrics
+import profiler
+import archive_catalog
+import archive_query
+import chart_payloads
+import checkpoints
+import load
+import spool
+import stages
+import storage
 from load import get_db_connection, insert_botanists, insert_plants, insert_recordings
+import pipeline
 
 
 COLUMNS = [
@@ -168,6 +191,160 @@ class TestTransformScript(unittest.TestCase):
         self.assertTrue(cleaned_df.empty)
 
 
+class TestTimestamps(unittest.TestCase):
+    """Tests for the shared timestamp parsing."""
+
+    def test_parse_last_watered_keeps_timezone(self):
+        """The GMT suffix is parsed as UTC rather than stripped."""
+        parsed = parse_last_watered(pd.Series(
+            ["Tue, 26 Nov 2024 14:10:54 GMT", "Tue, 26 Nov 2024 14:10:54 GMT"]))
+
+        self.assertEqual(str(parsed.dt.tz), "UTC")
+        self.assertEqual(parsed.iloc[0], pd.Timestamp(
+            "2024-11-26 14:10:54", tz="UTC"))
+
+    def test_parse_recording_at_fallback(self):
+        """Values in other formats are still parsed, invalid ones become NaT."""
+        parsed = parse_recording_at(pd.Series(
+            ["2024-11-26 15:01:07", "2024-11-26T16:01:07+01:00", "invalid_date", None]))
+
+        self.assertEqual(parsed.iloc[0], pd.Timestamp(
+            "2024-11-26 15:01:07", tz="UTC"))
+        self.assertEqual(parsed.iloc[1], pd.Timestamp(
+            "2024-11-26 15:01:07", tz="UTC"))
+        self.assertTrue(pd.isna(parsed.iloc[2]))
+        self.assertTrue(pd.isna(parsed.iloc[3]))
+
+    def test_to_database_datetimes(self):
+        """Timezone-aware columns become naive UTC, other columns are untouched."""
+        dataframe = pd.DataFrame({
+            "recording_at": pd.to_datetime(["2024-11-26 15:01:07+01:00"], utc=True),
+            "last_watered": ["2024-11-26"],
+        })
+
+        converted = to_database_datetimes(
+            dataframe, ["recording_at", "last_watered"])
+
+        self.assertIsNone(converted["recording_at"].dt.tz)
+        self.assertEqual(converted["recording_at"].iloc[0],
+                         pd.Timestamp("2024-11-26 14:01:07"))
+        self.assertEqual(converted["last_watered"].iloc[0], "2024-11-26")
+
+
+class TestRollingStats(unittest.TestCase):
+    """Tests for the streaming per-plant statistics."""
+
+    def test_rolling_window_matches_pandas(self):
+        """Window statistics match a full rescan of the last readings."""
+        values = [20.0, 21.5, 19.0, 25.0, 22.0, 18.5, 30.0, 21.0]
+        stats = RollingStats(window_size=3)
+        for value in values:
+            stats.update(value)
+
+        window = pd.Series(values[-3:])
+        self.assertEqual(stats.values(), values[-3:])
+        self.assertAlmostEqual(stats.mean, window.mean())
+        self.assertAlmostEqual(stats.variance, window.var())
+        self.assertEqual(stats.minimum, window.min())
+        self.assertEqual(stats.maximum, window.max())
+
+    def test_outliers_rejected_by_clean_plant_data(self):
+        """A reading far outside a plant's recent window is removed."""
+        stats = PlantStatistics(window_size=20)
+        history = pd.DataFrame({
+            "plant_id": [1] * 20,
+            "temperature": [20.0 + (i % 3) * 0.5 for i in range(20)],
+            "soil_moisture": [50.0 + (i % 2) for i in range(20)],
+        })
+        stats.update(history)
+
+        data = {
+            "plant_id": [1, 1],
+            "plant_name": ["Rose", "Rose"],
+            "soil_moisture": [50, 51],
+            "temperature": [20.5, 95],
+            "last_watered": ["Tue, 26 Nov 2024 14:10:54 GMT"] * 2,
+            "recording_at": ["2024-11-27 16:02:48", "2024-11-27 16:03:48"],
+            "botanist_first_name": ["Alice"] * 2,
+            "botanist_last_name": ["Smith"] * 2,
+            "botanist_email": ["alice@example.com"] * 2,
+            "botanist_phone": ["1234567890"] * 2,
+        }
+        cleaned_df = clean_plant_data(
+            pd.DataFrame(data, columns=COLUMNS), stats)
+
+        self.assertEqual(cleaned_df["temperature"].tolist(), [20.5])
+
+    def test_replay_judges_readings_in_order(self):
+        """Replayed readings are judged against the window before them, like live runs."""
+        stats = PlantStatistics(window_size=20)
+        readings = pd.DataFrame({
+            "plant_id": [1] * 15,
+            "temperature": [20.0 + (i % 3) * 0.5 for i in range(14)] + [95.0],
+            "soil_moisture": [50.0] * 15,
+        })
+
+        mask = stats.replay(readings)
+
+        self.assertEqual(mask.tolist(), [False] * 14 + [True])
+        self.assertEqual(stats.get(1, "temperature").count, 14)
+
+    def test_step_change_restarts_the_window(self):
+        """After a lasting step change, readings are kept again once the window restarts."""
+        before = [50.0 + (i % 2) for i in range(30)]
+        after = [90.0 + (i % 2) for i in range(500)]
+        readings = pd.DataFrame({"plant_id": [1] * 530, "temperature": 20.0,
+                                 "soil_moisture": before + after})
+
+        replayed = PlantStatistics(window_size=20).replay(readings, max_rejections=5)
+        live = PlantStatistics(window_size=20)
+        kept = []
+        for _, row in readings.iterrows():
+            batch = row.to_frame().T.astype(float)
+            batch = batch[~live.outlier_mask(batch, max_rejections=5)]
+            live.update(batch)
+            kept.append(len(batch))
+
+        self.assertEqual(replayed.tolist(), [False] * 30 + [True] * 4 + [False] * 496)
+        self.assertEqual(sum(kept[30:]), 496)
+        self.assertAlmostEqual(live.get(1, "soil_moisture").mean, 90.5)
+
+    def test_snapshot_round_trip(self):
+        """Statistics restored from a snapshot match the originals."""
+        stats = PlantStatistics(window_size=5)
+        stats.update(pd.DataFrame({
+            "plant_id": [1, 2, 1],
+            "temperature": [20.0, 15.0, 22.0],
+            "soil_moisture": [40.0, 60.0, 42.0],
+        }))
+
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, "stats.json")
+            save_snapshot(stats, location)
+            restored = load_snapshot(location)
+
+        self.assertEqual(restored.to_dict(), stats.to_dict())
+        self.assertAlmostEqual(restored.get(1, "temperature").mean, 21.0)
+
+    def test_plant_summaries_merge_shard_snapshots(self):
+        """The dashboard reads every shard's snapshot written under the one setting."""
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, "plant_stats", "snapshot.json")
+            os.makedirs(os.path.dirname(location))
+            for shard_index, plant_id in enumerate((1, 2)):
+                stats = PlantStatistics(window_size=5)
+                stats.update(pd.DataFrame({"plant_id": [plant_id], "temperature": [20.0],
+                                           "soil_moisture": [40.0]}))
+                save_snapshot(stats, storage.shard_location(location, shard_index, 2))
+            with open(f"{location}.tmp", "w", encoding="utf-8") as file:
+                file.write("partial")
+
+            plants = read_plant_summaries(location)
+
+        self.assertEqual(sorted(plants), ["1", "2"])
+        self.assertEqual(read_plant_summaries(None), {})
+
+
 class TestLoadScript(unittest.TestCase):
     """Tests for the load portion of the pipeline."""
 
@@ -204,7 +381,7 @@ class TestLoadScript(unittest.TestCase):
         mock_cursor.execute.assert_any_call(
             """
             IF NOT EXISTS (
-                SELECT 1 FROM gamma.botanist
+                SELECT 1 FROM gamma.botanist WITH (UPDLOCK, HOLDLOCK)
                 WHERE first_name = %s AND last_name = %s AND email = %s AND phone = %s
             )
             BEGIN
@@ -274,6 +451,694 @@ class TestLoadScript(unittest.TestCase):
             (2, 60, 25, '2023-11-02', '2023-11-26')
         )
 
+    def test_bulk_load_data(self):
+        """The bulk loader sends distinct botanists and plants and batches recordings."""
+        mock_connection = MagicMock()
+        mock_cursor = mock_connection.cursor.return_value
+        count = 450
+        transformed_df = pd.DataFrame({
+            "plant_id": [i % 3 for i in range(count)],
+            "plant_name": [f"Plant {i % 3}" for i in range(count)],
+            "soil_moisture": [50.0] * count,
+            "temperature": [20.0] * count,
+            "last_watered": pd.to_datetime(["2024-11-26 14:10:54"] * count, utc=True),
+            "recording_at": pd.to_datetime(["2024-11-27 16:02:48"] * count, utc=True),
+            "botanist_first_name": ["Alice"] * count,
+            "botanist_last_name": ["Smith"] * count,
+            "botanist_email": ["alice@example.com"] * count,
+            "botanist_phone": ["1234567890"] * count,
+        })
+
+        load.bulk_load_data(mock_connection, transformed_df)
+
+        statements = [call.args for call in mock_cursor.execute.call_args_list]
+        self.assertEqual(len(statements), 4)
+        self.assertIn("MERGE gamma.botanist", statements[0][0])
+        self.assertEqual(len(statements[0][1]), 4)
+        self.assertEqual(len(statements[1][1]), 3 * 6)
+        self.assertEqual([len(params) // 5 for _, params in statements[2:]], [400, 50])
+        self.assertIsNone(statements[2][1][3].tzinfo)
+        mock_connection.commit.assert_called_once()
+
+
+class TestDaemon(unittest.TestCase):
+    """Tests for the long-running pipeline daemon."""
+
+    @patch("daemon.stages.update_plant_stats")
+    @patch("daemon.stages.run_loading")
+    @patch("daemon.stages.run_transformation")
+    @patch("daemon.stages.run_extraction")
+    @patch("daemon.load.get_db_connection")
+    def test_daemon_reuses_connection(self, mock_connect, mock_extract,
+                                      mock_transform, mock_load, mock_stats):
+        """Every batch flows through all stages over a single warm connection."""
+        mock_extract.side_effect = [pd.DataFrame({"plant_id": [i]}) for i in range(3)]
+        mock_transform.side_effect = lambda raw_df: raw_df
+
+        daemon = PipelineDaemon(poll_interval=0, max_batches=3)
+        daemon.run()
+
+        self.assertEqual(daemon.batches_loaded, 3)
+        mock_connect.assert_called_once()
+        self.assertEqual(mock_load.call_count, 3)
+        self.assertEqual(mock_stats.call_count, 3)
+        mock_connect.return_value.close.assert_called_once()
+
+    @patch("daemon.stages.update_plant_stats")
+    @patch("daemon.stages.run_loading")
+    @patch("daemon.stages.run_transformation")
+    @patch("daemon.stages.run_extraction")
+    @patch("daemon.load.get_db_connection")
+    def test_daemon_reconnects_after_load_failure(self, mock_connect, mock_extract,
+                                                  mock_transform, mock_load, _):
+        """A failed load drops the connection and the next batch reconnects."""
+        mock_extract.side_effect = [pd.DataFrame({"plant_id": [i]}) for i in range(2)]
+        mock_transform.side_effect = lambda raw_df: raw_df
+        mock_load.side_effect = [Exception("Connection lost"), None]
+
+        daemon = PipelineDaemon(poll_interval=0, max_batches=2)
+        daemon.run()
+
+        self.assertEqual(daemon.batches_loaded, 1)
+        self.assertEqual(mock_connect.call_count, 2)
+
+    @patch("daemon.spool.append", side_effect=OSError("Disk full"))
+    @patch("daemon.spool.replay")
+    @patch("daemon.spool.SPOOL_LOCATION", "/spool")
+    @patch("daemon.stages.update_plant_stats")
+    @patch("daemon.stages.run_loading")
+    @patch("daemon.stages.run_transformation")
+    @patch("daemon.stages.run_extraction")
+    @patch("daemon.load.get_db_connection")
+    def test_daemon_finishes_after_unexpected_errors(self, mock_connect, mock_extract,
+                                                     mock_transform, mock_load, *_):
+        """Unexpected errors in a stage, or while spooling, skip a batch instead of hanging."""
+        mock_extract.side_effect = [KeyError("name"), pd.DataFrame({"plant_id": [1]}),
+                                    pd.DataFrame({"plant_id": [2]})]
+        mock_transform.side_effect = lambda raw_df: raw_df
+        mock_load.side_effect = [pymssql.OperationalError("Connection lost"), None]
+
+        daemon = PipelineDaemon(poll_interval=0, max_batches=3)
+        thread = threading.Thread(target=daemon.run, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(daemon.batches_loaded, 1)
+
+    @patch("daemon.spool.append")
+    @patch("daemon.spool.replay")
+    @patch("daemon.spool.SPOOL_LOCATION", "/spool")
+    @patch("daemon.stages.update_chart_payloads")
+    @patch("daemon.stages.update_plant_stats")
+    @patch("daemon.stages.run_loading")
+    @patch("daemon.stages.run_transformation")
+    @patch("daemon.stages.run_extraction")
+    @patch("daemon.load.get_db_connection")
+    def test_daemon_spools_only_unreachable_database(self, mock_connect, mock_extract,
+                                                     mock_transform, mock_load, mock_stats,
+                                                     _, mock_replay, mock_append):
+        """Rejected or already committed batches are never spooled."""
+        mock_extract.side_effect = [pd.DataFrame({"plant_id": [i]}) for i in range(4)]
+        mock_transform.side_effect = lambda raw_df: raw_df
+        mock_load.side_effect = [pymssql.IntegrityError("Violation of PRIMARY KEY"), None,
+                                 pymssql.OperationalError("Connection lost"), None]
+        mock_stats.side_effect = [ValueError("Bad snapshot"), None]
+
+        daemon = PipelineDaemon(poll_interval=0, max_batches=4)
+        daemon.run()
+
+        self.assertEqual(daemon.batches_loaded, 2)
+        self.assertEqual([call.args[0]["plant_id"].tolist()
+                          for call in mock_append.call_args_list], [[2]])
+        self.assertEqual(mock_connect.call_count, 3)
+        self.assertEqual(mock_replay.call_count, 3)
+
+
+class TestSharding(unittest.TestCase):
+    """Tests for splitting plants across shards."""
+
+    def test_shards_partition_plants(self):
+        """Every plant belongs to exactly one shard."""
+        plant_ids = range(1, 1001)
+        shards = [plants_for_shard(index, 4, plant_ids) for index in range(4)]
+
+        self.assertEqual(sorted(sum(shards, [])), list(plant_ids))
+        self.assertTrue(all(len(shard) > 100 for shard in shards))
+
+    def test_adding_a_shard_moves_few_plants(self):
+        """Growing from 4 to 5 shards only reassigns a minority of plants."""
+        before, after = HashRing(4), HashRing(5)
+        moved = sum(before.shard_for(plant_id) != after.shard_for(plant_id)
+                    for plant_id in range(1, 1001))
+
+        self.assertLess(moved, 400)
+
+    def test_small_fleets_run_fewer_shards(self):
+        """Shards are capped at one per minimum share of plants, and never drop below one."""
+        self.assertEqual(effective_shard_count(8, 100, 25), 4)
+        self.assertEqual(effective_shard_count(8, 49, 25), 1)
+        self.assertEqual(effective_shard_count(4, 5000, 25), 4)
+
+    @patch("sharding.ProcessPoolExecutor")
+    @patch("sharding.run_shard", return_value=30)
+    def test_single_shard_runs_in_process(self, mock_run_shard, mock_executor):
+        """A run capped to one shard does not start a process pool."""
+        self.assertEqual(run_sharded(8, plant_ids=range(1, 31), min_plants_per_shard=25), 30)
+
+        mock_run_shard.assert_called_once_with(0, 1, range(1, 31))
+        mock_executor.assert_not_called()
+
+    @patch("pipeline.sharding.run_shard")
+    @patch("pipeline.run_pipeline")
+    def test_lambda_handler_shard_event(self, mock_run_pipeline, mock_run_shard):
+        """A shard event only runs that shard."""
+        pipeline.lambda_handler({"shard_index": 2, "shard_count": 8}, None)
+
+        mock_run_shard.assert_called_once_with(2, 8)
+        mock_run_pipeline.assert_not_called()
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests for the adaptive polling schedule."""
+
+    @staticmethod
+    def reading(plant_id, temperature, soil_moisture):
+        """A parsed API reading with just the fields the scheduler needs."""
+        return {"plant_id": plant_id, "temperature": temperature,
+                "soil_moisture": soil_moisture}
+
+    def poll(self, poll_scheduler, now, readings):
+        """Run one cycle and feed back the readings of the plants that were due."""
+        due = poll_scheduler.due_plants(readings.keys(), now)
+        poll_scheduler.observe([readings[plant_id] for plant_id in due], now)
+        return due
+
+    def test_stable_plants_back_off(self):
+        """A stable plant is skipped more often while a volatile one is always polled."""
+        poll_scheduler = PollScheduler(min_interval=60, max_interval=600)
+        polled = {1: 0, 2: 0}
+        for minute in range(30):
+            readings = {1: self.reading(1, 18.0, 50.0),
+                        2: self.reading(2, 18.0 + minute % 2 * 3, 50.0)}
+            for plant_id in self.poll(poll_scheduler, minute * 60, readings):
+                polled[plant_id] += 1
+
+        self.assertEqual(polled[2], 30)
+        self.assertLess(polled[1], 10)
+        self.assertGreater(poll_scheduler.last_cycle["hit_rate"], 0)
+
+    def test_plants_near_threshold_polled_at_full_rate(self):
+        """A stable plant with dry soil is still polled every cycle."""
+        poll_scheduler = PollScheduler(min_interval=60, max_interval=600)
+        due_counts = [len(self.poll(poll_scheduler, minute * 60,
+                                    {1: self.reading(1, 18.0, 21.0)}))
+                      for minute in range(10)]
+
+        self.assertEqual(due_counts, [1] * 10)
+
+    def test_failed_poll_stays_due(self):
+        """A plant with no reading is retried on the next cycle."""
+        poll_scheduler = PollScheduler(min_interval=60, max_interval=600)
+        poll_scheduler.due_plants([1], 0)
+        poll_scheduler.observe([], 0)
+
+        self.assertEqual(poll_scheduler.due_plants([1], 60), [1])
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for the per-stage metrics."""
+
+    def tearDown(self):
+        metrics.configure("MinutePipeline", "none")
+
+    def test_emf_document(self):
+        """Stages, counters and latencies are written as one EMF line and then reset."""
+        stream = io.StringIO()
+        recorder = metrics.EmfRecorder("MinutePipeline", stream)
+        with recorder.stage("Extract"):
+            pass
+        recorder.count("RowsLoaded", 5)
+        for latency in (12, 30, 700):
+            recorder.observe("ApiLatency", latency)
+        recorder.flush()
+        recorder.flush()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        document = json.loads(lines[0])
+        names = {metric["Name"]
+                 for metric in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+        self.assertTrue({"ExtractDuration", "RowsLoaded", "ApiLatency",
+                         "ApiLatencyP99"} <= names)
+        self.assertEqual(document["RowsLoaded"], 5)
+        self.assertEqual(document["ApiLatency"], [12, 30, 700])
+        self.assertEqual(document["ApiLatencyHistogram"],
+                         {"le_25": 1, "le_50": 1, "le_1000": 1})
+
+    def test_disabled_recorder_is_silent(self):
+        """The default recorder records nothing."""
+        recorder = metrics.configure("MinutePipeline", "none")
+        with recorder.stage("Extract"):
+            recorder.count("RowsLoaded", 5)
+        recorder.flush()
+
+        self.assertFalse(recorder.enabled)
+
+    def test_transformation_reports_rows(self):
+        """The transform stage records its duration and rows in, out and rejected."""
+        recorder = metrics.configure("MinutePipeline", "emf")
+        data = {
+            "plant_id": [1, 2],
+            "plant_name": ["Rose", "Tulip"],
+            "soil_moisture": [50, 120],
+            "temperature": [20, 25],
+            "last_watered": ["Tue, 26 Nov 2024 14:10:54 GMT"] * 2,
+            "recording_at": ["2024-11-27 16:02:48"] * 2,
+            "botanist_first_name": ["Alice", "Bob"],
+            "botanist_last_name": ["Smith", "Johnson"],
+            "botanist_email": ["alice@example.com", "bob@example.com"],
+            "botanist_phone": ["1234567890", "0987654321"],
+        }
+        stages.run_transformation(pd.DataFrame(data, columns=COLUMNS), None)
+
+        self.assertEqual(recorder.counters["RowsCleaned"], 1)
+        self.assertEqual(recorder.counters["RowsRejected"], 1)
+        self.assertIn("TransformDuration", recorder.counters)
+
+
+class TestProfiling(unittest.TestCase):
+    """Tests for the opt-in profiling hooks."""
+
+    def test_disabled_profiling_returns_function(self):
+        """With no modes set the function is not wrapped at all."""
+        def work():
+            return 42
+
+        self.assertIs(profiler.profiled("work", modes=())(work), work)
+
+    def test_profiling_writes_artifacts(self):
+        """Each enabled mode writes its artifact and the result is passed through."""
+        with tempfile.TemporaryDirectory() as directory:
+            @profiler.profiled("work", modes=("cprofile", "sampling", "memory"),
+                                directory=directory)
+            def work():
+                return sum(range(200_000))
+
+            self.assertEqual(work(), sum(range(200_000)))
+            suffixes = sorted(name.split(".", 1)[1] for name in os.listdir(directory))
+
+        self.assertEqual(suffixes, ["folded", "memory.txt", "prof", "txt"])
+
+
+class BucketStub:
+    """In-memory S3 client answering plain and ranged GETs."""
+
+    def __init__(self):
+        self.objects = {}
+        self.bytes_read = 0
+
+    def put_object(self, Bucket, Key, Body):  # pylint: disable=invalid-name,unused-argument
+        """Store an object."""
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key, Range=None):  # pylint: disable=invalid-name,unused-argument
+        """Return an object or a byte range of it."""
+        data = self.objects[Key]
+        if Range:
+            start, end = (int(part) for part in Range.split("=")[1].split("-"))
+            data = data[start:end + 1]
+        self.bytes_read += len(data)
+        return {"Body": io.BytesIO(data)}
+
+    def list_objects_v2(self, Bucket, Prefix):  # pylint: disable=invalid-name,unused-argument
+        """List the stored keys under a prefix."""
+        return {"Contents": [{"Key": key} for key in sorted(self.objects)
+                             if key.startswith(Prefix)]}
+
+
+class TestArchiveCatalog(unittest.TestCase):
+    """Tests for archive manifests and the catalog reader."""
+
+    def setUp(self):
+        times = pd.date_range("2024-12-01", periods=240, freq="6min")
+        self.dataframe = pd.DataFrame({
+            "plant_id": [plant_id for _ in times for plant_id in (3, 1, 2)],
+            "plant_name": [name for _ in times for name in ("Cactus", "Lily", "Fern")],
+            "temperature": [float(i) for i in range(len(times) * 3)],
+            "recording_at": [time for time in times for _ in range(3)],
+        })
+        self.s3_client = BucketStub()
+        buffer = io.BytesIO()
+        archive_catalog.write_archive(self.dataframe, buffer, min_row_group_rows=100)
+        key = "plant_data/2024-12-01.parquet"
+        self.s3_client.put_object("bucket", key, buffer.getvalue())
+        manifest = archive_catalog.build_manifest(io.BytesIO(buffer.getvalue()), key)
+        self.s3_client.put_object("bucket", archive_catalog.manifest_key(key),
+                                  json.dumps(manifest).encode("utf-8"))
+        self.manifest = manifest
+
+    def test_manifest_describes_each_plant(self):
+        """Each plant gets its own row group, row count and time span."""
+        self.assertEqual(self.manifest["rows"], 720)
+        self.assertEqual(self.manifest["plants"]["1"]["rows"], 240)
+        self.assertEqual(self.manifest["plants"]["1"]["row_groups"][0]["index"], 0)
+        self.assertEqual(self.manifest["plants"]["3"]["max_recording_at"],
+                         "2024-12-01T23:54:00")
+
+    def test_catalog_answers_from_manifests(self):
+        """Plant names and dates come from the manifests alone."""
+        catalog = archive_catalog.ArchiveCatalog(self.s3_client, "bucket").refresh()
+
+        self.assertEqual(catalog.plants(), {1: "Lily", 2: "Fern", 3: "Cactus"})
+        self.assertEqual(catalog.time_range()[1], pd.Timestamp("2024-12-01 23:54"))
+        self.assertEqual(self.s3_client.bytes_read, len(
+            self.s3_client.objects["plant_data/2024-12-01.manifest.json"]))
+
+    def test_read_fetches_only_planned_row_groups(self):
+        """Reading one plant fetches the footer and its row group, not the whole file."""
+        catalog = archive_catalog.ArchiveCatalog(self.s3_client, "bucket").refresh()
+        self.s3_client.bytes_read = 0
+        start, end = pd.Timestamp("2024-12-01 06:00"), pd.Timestamp("2024-12-01 12:00")
+
+        result = catalog.read([2], start, end, columns=["recording_at", "temperature"])
+        expected = self.dataframe[(self.dataframe["plant_id"] == 2)
+                                  & self.dataframe["recording_at"].between(start, end)]
+
+        self.assertEqual(catalog.plan([2], start, end)[0]["row_groups"], [1])
+        self.assertEqual(list(result.columns), ["recording_at", "temperature"])
+        self.assertEqual(result["temperature"].tolist(), expected["temperature"].tolist())
+        self.assertLess(self.s3_client.bytes_read,
+                        len(self.s3_client.objects["plant_data/2024-12-01.parquet"]))
+
+    def test_compacted_files_replace_their_sources(self):
+        """Readers use a compacted file instead of the daily files it merged."""
+        manifests = {key: {"key": key} for key in (
+            "plant_data/2024-11-01.parquet", "plant_data/2024-11-02.parquet",
+            "plant_data/2024-12-01.parquet", "plant_data/monthly/2024-11-a.parquet",
+            "plant_data/monthly/2024-11-b.parquet")}
+        pointer = {"compacted": {"2024-11": {
+            "key": "plant_data/monthly/2024-11-a.parquet",
+            "sources": ["plant_data/2024-11-01.parquet", "plant_data/2024-11-02.parquet"]}}}
+
+        active = archive_catalog.active_manifests(manifests, pointer, "plant_data/")
+
+        self.assertEqual(sorted(active), ["plant_data/2024-12-01.parquet",
+                                          "plant_data/monthly/2024-11-a.parquet"])
+
+
+class TestCheckpoints(unittest.TestCase):
+    """Tests for the typed stage checkpoints."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.raw_df = pd.DataFrame({
+            "plant_id": [1, 2, "3"],
+            "plant_name": ["Rose", "Tulip", "Lily"],
+            "soil_moisture": [50.5, "invalid", 30],
+            "temperature": [20, 25.5, 13.25],
+            "last_watered": ["Tue, 26 Nov 2024 14:10:54 GMT"] * 3,
+            "recording_at": ["2024-11-27 16:02:48", None, "2024-11-27 16:03:01"],
+            "botanist_first_name": ["Alice", "Bob", "Carl"],
+            "botanist_last_name": ["Smith", "Johnson", "Brown"],
+            "botanist_email": ["alice@example.com", None, "carl@example.com"],
+            "botanist_phone": [1234567890, "0987654321", "001-481-273-3691x127"],
+        }, columns=COLUMNS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_checkpoints_keep_their_types(self):
+        """Checkpoints read back with the stage schema and clean like the original data."""
+        raw_location = checkpoints.checkpoint_location(self.directory.name, "raw")
+        cleaned_location = checkpoints.checkpoint_location(self.directory.name, "cleaned")
+        checkpoints.write_checkpoint(self.raw_df, raw_location, "raw")
+        raw_df = checkpoints.read_checkpoint(raw_location, "raw")
+        checkpoints.write_checkpoint(clean_plant_data(raw_df), cleaned_location, "cleaned")
+        cleaned_df = checkpoints.read_checkpoint(cleaned_location, "cleaned")
+
+        self.assertEqual(raw_df["plant_id"].tolist(), [1, 2, 3])
+        self.assertTrue(pd.isna(raw_df["soil_moisture"][1]))
+        self.assertEqual(raw_df["botanist_phone"][0], "1234567890")
+        self.assertEqual(cleaned_df["plant_id"].tolist(), [1, 3])
+        self.assertEqual(str(cleaned_df["recording_at"].dtype), "datetime64[ns, UTC]")
+        pd.testing.assert_frame_equal(
+            cleaned_df[["plant_id", "soil_moisture", "temperature"]],
+            clean_plant_data(self.raw_df.copy())[
+                ["plant_id", "soil_moisture", "temperature"]].reset_index(drop=True),
+            check_dtype=False)
+
+    def test_missing_and_mismatched_checkpoints(self):
+        """A missing checkpoint reads as None and one of another stage is rejected."""
+        location = checkpoints.checkpoint_location(self.directory.name, "raw")
+        self.assertIsNone(checkpoints.read_checkpoint(location, "raw"))
+
+        checkpoints.write_checkpoint(self.raw_df, location, "raw")
+        with self.assertRaises(ValueError):
+            checkpoints.read_checkpoint(location, "cleaned")
+
+    @patch("stages.update_plant_stats")
+    @patch("stages.run_loading")
+    @patch("stages.run_extraction")
+    def test_failed_load_is_retried_from_checkpoint(self, mock_extract, mock_load, _):
+        """The next run loads the readings of a failed load before polling again."""
+        mock_extract.return_value = self.raw_df.copy()
+        mock_load.side_effect = [pymssql.OperationalError("RDS is down"), None, None]
+        with self.assertRaises(pymssql.OperationalError):
+            pipeline.run_pipeline(self.directory.name)
+        self.assertEqual(os.listdir(self.directory.name), ["cleaned.arrow"])
+
+        mock_extract.return_value = self.raw_df.iloc[:1].copy()
+        pipeline.run_pipeline(self.directory.name)
+
+        self.assertEqual([len(call.args[0]) for call in mock_load.call_args_list], [2, 2, 1])
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class TestSpool(unittest.TestCase):
+    """Tests for the spool used while the database is unreachable."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.directory.name, "spool")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def cleaned(plant_ids: list) -> pd.DataFrame:
+        """Cleaned readings for the given plants."""
+        count = len(plant_ids)
+        return pd.DataFrame({
+            "plant_id": plant_ids,
+            "plant_name": [f"Plant {plant_id}" for plant_id in plant_ids],
+            "soil_moisture": [50.0] * count,
+            "temperature": [20.0] * count,
+            "last_watered": pd.to_datetime(["2024-11-26 14:10:54"] * count, utc=True),
+            "recording_at": pd.to_datetime(["2024-11-27 16:02:48"] * count, utc=True),
+            "botanist_first_name": ["Alice"] * count,
+            "botanist_last_name": ["Smith"] * count,
+            "botanist_email": ["alice@example.com"] * count,
+            "botanist_phone": ["1234567890"] * count,
+        })
+
+    @patch("spool.load.bulk_load_data")
+    def test_replay_loads_segments_in_batches(self, mock_bulk_load):
+        """Segments are replayed oldest first, in batches, and deleted once loaded."""
+        for plant_ids in ([1, 2], [3], [4, 5, 6]):
+            spool.append(self.cleaned(plant_ids), self.location)
+
+        replayed = spool.replay(MagicMock(), self.location, batch_rows=3)
+
+        self.assertEqual(replayed, 6)
+        self.assertEqual([call.args[1]["plant_id"].tolist()
+                          for call in mock_bulk_load.call_args_list], [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(spool.segments(self.location), [])
+
+    @patch("stages.run_loading")
+    @patch("stages.load.get_db_connection")
+    def test_unreachable_database_spools_then_replays(self, mock_connect, mock_load):
+        """Readings are spooled during an outage and replayed before the next load."""
+        mock_connect.side_effect = pymssql.OperationalError("Login timeout expired")
+        stages.load_or_spool(self.cleaned([1, 2]), self.location)
+        stages.load_or_spool(self.cleaned([3]), self.location)
+
+        mock_connect.assert_called_once()
+        self.assertEqual(len(spool.segments(self.location)), 2)
+        self.assertFalse(spool.database_available(self.location))
+
+        connection = MagicMock()
+        mock_connect.side_effect = None
+        mock_connect.return_value = connection
+        with patch("spool.load.bulk_load_data") as mock_bulk_load:
+            spool.mark_unavailable(self.location, retry_seconds=0)
+            stages.load_or_spool(self.cleaned([4]), self.location)
+
+        mock_bulk_load.assert_called_once()
+        self.assertEqual(mock_bulk_load.call_args.args[1]["plant_id"].tolist(), [1, 2, 3])
+        mock_load.assert_called_once()
+        self.assertIs(mock_load.call_args.args[1], connection)
+        self.assertEqual(spool.segments(self.location), [])
+        self.assertTrue(spool.database_available(self.location))
+
+    @patch("stages.run_loading")
+    @patch("stages.load.get_db_connection")
+    def test_connection_lost_during_replay_spools(self, mock_connect, mock_load):
+        """Readings are spooled, not lost, when the connection drops after connecting."""
+        spool.append(self.cleaned([1, 2]), self.location)
+        with patch("spool.load.bulk_load_data") as mock_bulk_load:
+            mock_bulk_load.side_effect = pymssql.OperationalError("Connection reset")
+            stages.load_or_spool(self.cleaned([3]), self.location)
+
+        mock_load.assert_not_called()
+        mock_connect.return_value.close.assert_called_once()
+        self.assertEqual([spool.read_segment(segment).column("plant_id").to_pylist()
+                          for segment in spool.segments(self.location)], [[1, 2], [3]])
+        self.assertFalse(spool.database_available(self.location))
+
+    @patch("stages.run_loading")
+    @patch("stages.load.get_db_connection")
+    def test_data_errors_are_not_spooled(self, mock_connect, mock_load):
+        """Errors in the data itself are raised, so the load is retried from its checkpoint."""
+        mock_load.side_effect = pymssql.IntegrityError("Violation of PRIMARY KEY")
+        with self.assertRaises(pymssql.IntegrityError):
+            stages.load_or_spool(self.cleaned([1]), self.location)
+
+        mock_connect.return_value.close.assert_called_once()
+        self.assertEqual(spool.segments(self.location), [])
+
+
+class TestArchiveQuery(unittest.TestCase):
+    """Tests for the analytical queries over the archive."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.s3_client = BucketStub()
+        frames = []
+        for day in ("2024-12-01", "2024-12-02"):
+            times = pd.date_range(day, periods=48, freq="30min")
+            frame = pd.DataFrame({
+                "plant_id": [plant_id for _ in times for plant_id in (1, 2, 3)],
+                "plant_name": [name for _ in times for name in ("Lily", "Fern", "Cactus")],
+                "soil_moisture": [float((i * 7) % 60) for i in range(len(times) * 3)],
+                "temperature": [float(i % 30) for i in range(len(times) * 3)],
+                "recording_at": [time for time in times for _ in range(3)],
+            })
+            key = f"plant_data/{day}.parquet"
+            path = os.path.join(self.directory.name, "bucket", key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            archive_catalog.write_archive(frame, path, min_row_group_rows=10)
+            self.s3_client.put_object("bucket", archive_catalog.manifest_key(key), json.dumps(
+                archive_catalog.build_manifest(path, key)).encode("utf-8"))
+            frames.append(frame)
+        self.dataframe = pd.concat(frames, ignore_index=True)
+        catalog = archive_catalog.ArchiveCatalog(self.s3_client, "bucket").refresh()
+        self.query = archive_query.ArchiveQuery(catalog, archive_query.fs.SubTreeFileSystem(
+            self.directory.name, archive_query.fs.LocalFileSystem()))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scan_pushes_down_columns_and_filters(self):
+        """Only the requested columns of matching readings in the needed files are read."""
+        start, end = pd.Timestamp("2024-12-02 06:00"), pd.Timestamp("2024-12-02 12:00")
+        table = self.query.scan(["recording_at", "soil_moisture"], plant_ids=[2],
+                                start=start, end=end,
+                                where=archive_query.ds.field("soil_moisture") < 30)
+        expected = self.dataframe[(self.dataframe["plant_id"] == 2)
+                                  & (self.dataframe["recording_at"] >= start)
+                                  & (self.dataframe["recording_at"] < end)
+                                  & (self.dataframe["soil_moisture"] < 30)]
+
+        self.assertEqual(table.column_names, ["recording_at", "soil_moisture"])
+        self.assertEqual(sorted(table["soil_moisture"].to_pylist()),
+                         sorted(expected["soil_moisture"]))
+        self.assertEqual(self.query.files_scanned, 1)
+
+    def test_plant_summary_matches_pandas(self):
+        """Dry readings and means per plant agree with a pandas group-by."""
+        summary = self.query.plant_summary(dry_below=20).set_index("plant_id")
+        grouped = self.dataframe.groupby("plant_id")
+
+        self.assertEqual(summary["readings"].to_dict(), grouped.size().to_dict())
+        self.assertEqual(summary["dry_readings"].to_dict(),
+                         grouped["soil_moisture"].apply(lambda values: (values < 20).sum())
+                         .to_dict())
+        self.assertEqual(summary["temperature_mean"].round(6).to_dict(),
+                         grouped["temperature"].mean().round(6).to_dict())
+        self.assertTrue(summary["dry_readings"].is_monotonic_decreasing)
+
+
+class TestChartPayloads(unittest.TestCase):
+    """Tests for the downsampled chart payloads kept for the dashboard."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.directory.name, "charts.arrow")
+        self.now = pd.Timestamp("2024-11-27 12:00")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def readings(self, minutes: range, temperature: float = 20.0) -> pd.DataFrame:
+        """One reading per minute for plant 1, ending at `self.now`."""
+        times = [self.now - pd.Timedelta(minutes=minute) for minute in minutes]
+        return pd.DataFrame({
+            "plant_id": [1] * len(times), "plant_name": ["Plant 1"] * len(times),
+            "temperature": [temperature + minute for minute in minutes],
+            "soil_moisture": [50.0] * len(times),
+            "recording_at": pd.to_datetime(times).tz_localize("UTC"),
+        })
+
+    def test_batches_merge_into_the_same_buckets_as_one_pass(self):
+        """Merging batches one at a time gives the buckets of all the readings at once."""
+        batches = [self.readings(range(start, start + 30)) for start in range(0, 180, 30)]
+        for batch in reversed(batches):
+            chart_payloads.update(batch, self.location, self.now)
+
+        payloads = chart_payloads.load_payloads(self.location)
+        expected = chart_payloads.merge(chart_payloads.empty_payloads(), chart_payloads.bucket(
+            pd.concat(batches, ignore_index=True)), self.now)
+        pd.testing.assert_frame_equal(payloads, expected)
+        self.assertEqual(payloads.groupby("window").size().to_dict(),
+                         {"1h": 61, "24h": 19, "7d": 4})
+        self.assertTrue(payloads.groupby("window")["recording_at"].is_monotonic_increasing.all())
+
+    def test_expired_buckets_are_pruned(self):
+        """Buckets that have left their window are dropped when payloads are merged."""
+        chart_payloads.update(self.readings(range(0, 120)), self.location, self.now)
+        later = self.now + pd.Timedelta(hours=1)
+        chart_payloads.update(self.readings(range(0, 1)), self.location, later)
+
+        payloads = chart_payloads.load_payloads(self.location)
+        hour = payloads[payloads["window"] == "1h"]
+        self.assertGreaterEqual(hour["recording_at"].min(), later - pd.Timedelta(hours=1))
+
+    def test_recompute_replaces_wholly_covered_buckets(self):
+        """Archived readings replace the buckets they cover, undoing double counts."""
+        readings = self.readings(range(0, 120))
+        chart_payloads.update(readings, self.location, self.now)
+        chart_payloads.update(readings.iloc[30:90], self.location, self.now)
+
+        chart_payloads.recompute(readings, self.location, self.now)
+
+        payloads = chart_payloads.load_payloads(self.location)
+        # 10:00-11:00 starts before the first archived reading at 10:01, so it is kept
+        hourly = payloads[payloads["window"] == "7d"]
+        self.assertEqual(hourly["readings"].tolist(), [59 + 29, 60, 1])
+        self.assertTrue((payloads[payloads["window"] == "1h"]["readings"] == 1).all())
+
+    def test_resharded_plant_is_charted_once_from_the_newest_file(self):
+        """A plant left in an old shard file is not doubled by the shard it moved to."""
+        old = storage.shard_location(self.location, 1, 2)
+        new = storage.shard_location(self.location, 0, 4)
+        chart_payloads.update(self.readings(range(0, 120)), old, self.now)
+        chart_payloads.update(self.readings(range(0, 120), temperature=30.0), new, self.now)
+
+        payloads = chart_payloads.load_all(self.location)
+        expected = chart_payloads.load_payloads(new)
+        pd.testing.assert_frame_equal(payloads, expected)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,66 @@
+"""Normalises the timestamp strings returned by the plants API into typed UTC columns."""
+from functools import lru_cache
+import pandas as pd
+
+RECORDING_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+LAST_WATERED_FORMAT = "%a, %d %b %Y %H:%M:%S %Z"
+
+
+@lru_cache(maxsize=1024)
+def parse_odd_timestamp(value: str) -> pd.Timestamp:
+    """Parse a single timestamp that did not match the expected format."""
+    parsed = pd.to_datetime(value, errors="coerce", utc=True)
+    return pd.NaT if pd.isna(parsed) else parsed
+
+
+def parse_timestamps(values: pd.Series, fmt: str) -> pd.Series:
+    """
+    Parse a column of timestamp strings into timezone-aware UTC datetimes.
+
+    Each distinct value is parsed once using the fixed format. Values that do
+    not match the format fall back to per-value inference, which is cached
+    because the same odd values tend to repeat between runs.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return to_utc(values)
+
+    codes, uniques = pd.factorize(values)
+    unique_values = pd.Series(uniques, dtype=object)
+    parsed = pd.to_datetime(unique_values, format=fmt,
+                            errors="coerce", utc=True)
+
+    odd = parsed.isna() & unique_values.notna()
+    if odd.any():
+        parsed[odd] = [parse_odd_timestamp(str(value))
+                       for value in unique_values[odd]]
+
+    parsed = pd.Series(parsed.array.take(codes, allow_fill=True),
+                       index=values.index, name=values.name)
+    return parsed.astype("datetime64[ns, UTC]")
+
+
+def parse_recording_at(values: pd.Series) -> pd.Series:
+    """Parse the API's recording_taken column."""
+    return parse_timestamps(values, RECORDING_AT_FORMAT)
+
+
+def parse_last_watered(values: pd.Series) -> pd.Series:
+    """Parse the API's last_watered column, e.g. 'Tue, 26 Nov 2024 14:10:54 GMT'."""
+    return parse_timestamps(values, LAST_WATERED_FORMAT)
+
+
+def to_utc(values: pd.Series) -> pd.Series:
+    """Return a datetime column as UTC, treating naive values as already UTC."""
+    if values.dt.tz is None:
+        return values.dt.tz_localize("UTC")
+    return values.dt.tz_convert("UTC")
+
+
+def to_database_datetimes(dataframe: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Convert timezone-aware columns to naive UTC for the DATETIME columns in RDS."""
+    converted = dataframe.copy()
+    for column in columns:
+        if column in converted and isinstance(converted[column].dtype, pd.DatetimeTZDtype):
+            converted[column] = converted[column].dt.tz_convert(
+                "UTC").dt.tz_localize(None)
+    return converted
@@ -2,20 +2,26 @@
 import os
 import logging
 import pandas as pd
+import checkpoints
+import timestamps
 
 logging.basicConfig(level=logging.INFO)
 
-INPUT_FILE = os.path.join("../data", "plant_data.csv")
-OUTPUT_FILE = os.path.join("../data", "cleaned_plant_data.csv")
+INPUT_FILE = os.path.join("../data", "plant_data.arrow")
+OUTPUT_FILE = os.path.join("../data", "cleaned_plant_data.arrow")
 
 
-def clean_plant_data(plant_df: pd.DataFrame) -> pd.DataFrame:
-    """Setting the types for dataframe columns and removing NaN values"""
+def clean_plant_data(plant_df: pd.DataFrame, stats=None) -> pd.DataFrame:
+    """
+    Setting the types for dataframe columns and removing NaN values.
+    If rolling statistics are given, readings that are statistical outliers
+    for their plant are removed as well.
+    """
 
-    plant_df['recording_at'] = pd.to_datetime(
-        plant_df['recording_at'], errors='coerce')
-    plant_df['last_watered'] = pd.to_datetime(
-        plant_df['last_watered'].str.replace("GMT", ""), errors='coerce')
+    plant_df['recording_at'] = timestamps.parse_recording_at(
+        plant_df['recording_at'])
+    plant_df['last_watered'] = timestamps.parse_last_watered(
+        plant_df['last_watered'])
     plant_df['soil_moisture'] = pd.to_numeric(
         plant_df['soil_moisture'], errors='coerce')
     plant_df['temperature'] = pd.to_numeric(
@@ -28,16 +34,22 @@ def clean_plant_data(plant_df: pd.DataFrame) -> pd.DataFrame:
                         (plant_df['soil_moisture'] <= 100)]
 
     plant_df = plant_df.dropna()
+
+    if stats is not None and not plant_df.empty:
+        outliers = stats.outlier_mask(plant_df)
+        if outliers.any():
+            logging.warning("Rejected %d outlier readings for plant IDs %s.",
+                            outliers.sum(), plant_df.loc[outliers, 'plant_id'].tolist())
+        plant_df = plant_df[~outliers]
     return plant_df
 
 
 if __name__ == "__main__":
-    try:
-        logging.info("Loading raw data from %s", INPUT_FILE)
-        raw_df = pd.read_csv(INPUT_FILE)
+    logging.info("Loading raw data from %s", INPUT_FILE)
+    raw_df = checkpoints.read_checkpoint(INPUT_FILE, "raw")
+    if raw_df is None:
+        logging.error("Input file not found: %s", INPUT_FILE)
+    else:
         cleaned_df = clean_plant_data(raw_df)
-        cleaned_df.to_csv(OUTPUT_FILE, index=False)
+        checkpoints.write_checkpoint(cleaned_df, OUTPUT_FILE, "cleaned")
         logging.info("Data transformation process completed successfully.")
-
-    except FileNotFoundError:
-        logging.error("Input file not found: %s", INPUT_FILE)
@@ -0,0 +1,308 @@
+"""
+Replays archived days through the cleaning rules after a fix, or reloads them into RDS.
+
+Every day in a date range is read from the archive, from its daily file or from the
+compacted file of its month, and passed through `transform.clean_plant_data`. A day is
+the contents of its daily file, which runs past midnight into the next day; read from a
+compacted file, it is the recording_at range the catalog pointer records for that file.
+Optionally, readings are also re-checked against the rolling-statistics outlier rule in
+time order. The cleaned day is then written back to the archive with a fresh manifest,
+or loaded into the database with the bulk loader in one transaction per day.
+
+Days run in parallel on a process pool. Each worker streams its day in row-group batches
+of at most BACKFILL_BATCH_ROWS rows, and its address space can be capped with
+--max-worker-memory-mb. Rewritten archive files hold the cleaned day as Arrow until it
+is written sorted, with a row group per plant, like the files of the nightly archive.
+Finished days are recorded in a state file as they complete, so an interrupted backfill
+resumes where it stopped when run again.
+"""
+# pylint: disable=wrong-import-position
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+# Shared modules live in ../pipeline locally and are copied alongside this script in the image
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+import archive_catalog
+import load
+import rolling_stats
+import storage
+import timestamps
+import transform
+import compaction
+
+logging.basicConfig(level=logging.INFO)
+load_dotenv()
+
+BATCH_ROWS = int(os.getenv("BACKFILL_BATCH_ROWS", "50000"))
+STATE_LOCATION = os.getenv("BACKFILL_STATE", "backfill_state.json")
+TARGETS = ("archive", "database")
+
+
+def parse_day(value: str) -> date:
+    """Parse a YYYY-MM-DD argument."""
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def days_between(start: date, end: date) -> list:
+    """Every day from start to end inclusive, as YYYY-MM-DD."""
+    return [(start + timedelta(days)).isoformat() for days in range((end - start).days + 1)]
+
+
+def source_for_day(archive: str, day: str) -> tuple:
+    """
+    The archive location holding a day, and the inclusive recording_at range of the
+    day's rows if it is a compacted monthly file, None if the whole file is the day.
+    Months compacted before source ranges were recorded fall back to the calendar day.
+    """
+    daily = f"{archive}{day}.parquet"
+    if storage.list_locations(daily):
+        return daily, None
+    compacted = compaction.read_pointer(archive)["compacted"].get(day[:7])
+    key = f"{compaction.archive_prefix(archive)}{day}.parquet"
+    if not compacted or key not in compacted["sources"]:
+        return None, None
+    if key not in compacted.get("source_ranges", {}):
+        start = pd.Timestamp(day)
+        rows = (start, start + timedelta(days=1) - pd.Timedelta(1, "ns"))
+    elif compacted["source_ranges"][key] is None:
+        return None, None
+    else:
+        rows = tuple(pd.Timestamp(bound) for bound in compacted["source_ranges"][key])
+    return compaction.key_location(archive, compacted["key"]), rows
+
+
+def read_batches(path: str, rows: tuple = None, batch_rows: int = BATCH_ROWS):
+    """Yield a day's readings, those in the `rows` range if given, in batches."""
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_rows):
+        table = pa.Table.from_batches([batch])
+        if rows:
+            table = archive_catalog.filter_table(table, start=rows[0], end=rows[1])
+        if table.num_rows:
+            yield table.to_pandas()
+
+
+def clean_batch(batch: pd.DataFrame, stats: rolling_stats.PlantStatistics = None) -> pd.DataFrame:
+    """Apply the cleaning rules, and the outlier rule in time order if `stats` is given."""
+    cleaned = transform.clean_plant_data(batch)
+    if stats is not None and not cleaned.empty:
+        cleaned = cleaned.sort_values(["plant_id", "recording_at"], kind="stable")
+        cleaned = cleaned[~stats.replay(cleaned)]
+    return timestamps.to_database_datetimes(cleaned, ["last_watered", "recording_at"])
+
+
+def covered_range(path: str, rows: tuple = None) -> tuple:
+    """
+    The first and last recording_at, as naive UTC, of the readings a day's replay reads
+    from `path`, or None if there are none. A daily file can hold readings from either
+    side of midnight, all of which are loaded again.
+    """
+    table = pq.read_table(path, columns=["recording_at"])
+    if rows:
+        table = archive_catalog.filter_table(table, start=rows[0], end=rows[1])
+    if not table.num_rows:
+        return None
+    times = timestamps.to_utc(table.column("recording_at").to_pandas()).dt.tz_localize(None)
+    return times.min().to_pydatetime(), times.max().to_pydatetime()
+
+
+def replay_to_archive(batches, output: str, day: str, stats) -> dict:
+    """Write a day's cleaned readings back to the archive with a fresh manifest."""
+    rows_in = rows_out = 0
+    tables = []
+    for batch in batches:
+        rows_in += len(batch)
+        cleaned = clean_batch(batch, stats)
+        rows_out += len(cleaned)
+        table = pa.Table.from_pandas(cleaned, preserve_index=False)
+        tables.append(table.cast(tables[0].schema) if tables else table)
+    if not tables:
+        return {"rows_in": 0, "rows_out": 0}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"{day}.parquet")
+        archive_catalog.write_archive(pa.concat_tables(tables), path)
+        key = f"{compaction.archive_prefix(output)}{day}.parquet"
+        manifest = archive_catalog.build_manifest(path, key)
+        with open(path, "rb") as file:
+            storage.write_bytes(f"{output}{day}.parquet", file.read())
+    storage.write_bytes(f"{output}{day}{archive_catalog.MANIFEST_SUFFIX}",
+                        json.dumps(manifest).encode("utf-8"))
+    return {"rows_in": rows_in, "rows_out": rows_out}
+
+
+def replay_to_database(batches, stats, replace_range: tuple = None) -> dict:
+    """
+    Load a day's cleaned readings into the database in a single transaction, first
+    deleting the recordings in `replace_range` if given.
+    """
+    rows_in = rows_out = 0
+    connection = load.get_db_connection()
+    try:
+        if replace_range:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {load.SCHEMA_NAME}.recording "
+                    "WHERE recording_at >= %s AND recording_at <= %s", replace_range)
+        for batch in batches:
+            rows_in += len(batch)
+            cleaned = clean_batch(batch, stats)
+            rows_out += len(cleaned)
+            if not cleaned.empty:
+                load.bulk_load_data(connection, cleaned, commit=False)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return {"rows_in": rows_in, "rows_out": rows_out}
+
+
+def replay_day(day: str, archive: str, target: str, output: str = None,
+               outliers: bool = False, replace: bool = False,
+               batch_rows: int = BATCH_ROWS) -> dict:
+    """Replay one archived day to the target and summarise what happened."""
+    started = time.perf_counter()
+    location, rows = source_for_day(archive, day)
+    if location is None:
+        return {"day": day, "status": "missing", "rows_in": 0, "rows_out": 0, "seconds": 0}
+
+    stats = rolling_stats.PlantStatistics() if outliers else None
+    with tempfile.TemporaryDirectory() as directory:
+        path = storage.local_copy(location, directory)
+        batches = read_batches(path, rows, batch_rows)
+        if target == "archive":
+            summary = replay_to_archive(batches, output or archive, day, stats)
+        else:
+            replace_range = covered_range(path, rows) if replace else None
+            summary = replay_to_database(batches, stats, replace_range)
+    return {"day": day, "status": "done", **summary,
+            "seconds": round(time.perf_counter() - started, 2)}
+
+
+def limit_worker_memory(max_megabytes: int) -> None:
+    """Pool initializer capping a worker's address space, so a runaway day fails alone."""
+    if max_megabytes:
+        limit = max_megabytes * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def read_state(location: str) -> dict:
+    """Days already replayed by earlier runs."""
+    data = storage.read_bytes(location)
+    return json.loads(data) if data else {"completed": {}}
+
+
+def run_backfill(days: list, archive: str, target: str, output: str = None,
+                 outliers: bool = False, replace: bool = False, workers: int = None,
+                 max_worker_memory_mb: int = 0, state_location: str = STATE_LOCATION,
+                 batch_rows: int = BATCH_ROWS) -> dict:
+    """
+    Replay days in parallel, skipping those the state file marks as done and recording
+    each day there as soon as it completes. Returns the summaries of this run.
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target {target}, expected one of {TARGETS}")
+    archive = archive if archive.endswith("/") else f"{archive}/"
+    output = output if not output or output.endswith("/") else f"{output}/"
+    state = read_state(state_location)
+    pending = [day for day in days if day not in state["completed"]]
+    if len(pending) < len(days):
+        logging.info("Skipping %d days completed by an earlier run.", len(days) - len(pending))
+
+    results = {}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_worker_memory,
+                             initargs=(max_worker_memory_mb,)) as executor:
+        futures = {executor.submit(replay_day, day, archive, target, output, outliers,
+                                   replace, batch_rows): day for day in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            day = futures[future]
+            try:
+                results[day] = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error("Replay of %s failed: %s", day, e)
+                results[day] = {"day": day, "status": "failed", "error": str(e)}
+            if results[day]["status"] == "done":
+                state["completed"][day] = {
+                    **results[day], "finished_at": datetime.now(timezone.utc).isoformat()}
+                storage.write_bytes(state_location, json.dumps(state, indent=2).encode("utf-8"))
+
+            elapsed = time.perf_counter() - started
+            remaining = elapsed / done * (len(pending) - done)
+            logging.info("[%d/%d] %s %s: %s rows in, %s rows out. %.0fs elapsed, ~%.0fs left.",
+                         done, len(pending), day, results[day]["status"],
+                         results[day].get("rows_in", "-"), results[day].get("rows_out", "-"),
+                         elapsed, remaining)
+
+    if target == "archive" and (output or archive) == archive:
+        recompact_replayed_months(archive, [day for day, result in results.items()
+                                            if result["status"] == "done"])
+    return results
+
+
+def recompact_replayed_months(archive: str, days: list) -> None:
+    """
+    Rebuild the compacted files of months whose replayed days they already hold, so
+    readers, who prefer compacted files, see the replayed data.
+    """
+    pointer = compaction.read_pointer(archive)["compacted"]
+    prefix = compaction.archive_prefix(archive)
+    replaced = {}
+    for day in days:
+        key = f"{prefix}{day}.parquet"
+        if key in pointer.get(day[:7], {}).get("sources", []):
+            replaced.setdefault(day[:7], []).append(key)
+    for month, keys in sorted(replaced.items()):
+        logging.info("Recompacting %s with %d replayed days.", month, len(keys))
+        compaction.compact_month(archive, month, keys, replaced_keys=keys)
+
+
+def main() -> int:
+    """Parse arguments, run the backfill and return a non-zero code if any day failed."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--start", type=parse_day, required=True, help="First day, YYYY-MM-DD.")
+    parser.add_argument("--end", type=parse_day, required=True, help="Last day, YYYY-MM-DD.")
+    parser.add_argument("--archive", default=compaction.ARCHIVE_LOCATION,
+                        help="s3://bucket/prefix/ or a local directory holding the archive.")
+    parser.add_argument("--target", choices=TARGETS, default="archive")
+    parser.add_argument("--output", help="Archive location to write to, default --archive.")
+    parser.add_argument("--outliers", action="store_true",
+                        help="Also apply the rolling-statistics outlier rule.")
+    parser.add_argument("--replace", action="store_true",
+                        help="Delete the recordings each day's file covers before loading.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--max-worker-memory-mb", type=int, default=0)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--state", default=STATE_LOCATION,
+                        help="Where finished days are recorded; delete it to start over.")
+    args = parser.parse_args()
+
+    if args.end < args.start:
+        parser.error("--end is before --start")
+    results = run_backfill(days_between(args.start, args.end), args.archive, args.target,
+                           args.output, args.outliers, args.replace, args.workers,
+                           args.max_worker_memory_mb, args.state, args.batch_rows)
+    failed = [day for day, result in results.items() if result["status"] == "failed"]
+    if failed:
+        logging.error("%d days failed: %s", len(failed), ", ".join(sorted(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
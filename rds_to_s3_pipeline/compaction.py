@@ -0,0 +1,262 @@
+"""
+Compaction of the daily archive files into monthly files.
+
+For each complete month, the daily Parquet files are merged into one file sorted by
+plant_id and recording_at, written with zstd and large per-plant row groups, and given a
+manifest. Row counts are checked against the daily files before the catalog pointer
+(`_catalog.json`) is replaced to reference the monthly file, which makes readers use it
+instead of the daily files. The pointer is a single object, so readers see either the
+old or the new catalog and never a half-finished compaction.
+
+Daily files do not follow calendar days: each holds what was in RDS when the nightly job
+ran, including the first minutes of the next day. The pointer therefore records the
+recording_at range of every source file, and rows of a source rewritten by a backfill
+are replaced by that range rather than by calendar day.
+
+The archive can be an s3://bucket/prefix/ location or a local directory, so the job can
+be run locally against a copy of the archive or a moto-backed bucket.
+"""
+# pylint: disable=wrong-import-position
+import io
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+# Shared modules live in ../pipeline locally and are copied alongside this script in the image
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+import archive_catalog
+import metrics
+import storage
+
+logging.basicConfig(level=logging.INFO)
+load_dotenv()
+metrics.configure("ArchiveCompaction")
+
+ARCHIVE_LOCATION = os.getenv(
+    "ARCHIVE_LOCATION", f"s3://{os.getenv('S3_BUCKET')}/{os.getenv('S3_KEY', 'plant_data/')}")
+COMPACTION_ROW_GROUP_ROWS = int(os.getenv("COMPACTION_ROW_GROUP_ROWS", "131072"))
+COMPACTION_MIN_ROW_GROUP_ROWS = int(os.getenv("COMPACTION_MIN_ROW_GROUP_ROWS", "16384"))
+COMPACTION_ZSTD_LEVEL = int(os.getenv("COMPACTION_ZSTD_LEVEL", "9"))
+DAILY_FILE = re.compile(r"(\d{4}-\d{2})-\d{2}\.parquet")
+
+
+def archive_key(archive: str, location: str) -> str:
+    """S3 key of a location, or its path relative to a local archive's parent."""
+    if location.startswith(storage.S3_PREFIX):
+        return storage.split_s3_uri(location)[1]
+    return os.path.relpath(location, os.path.dirname(archive.rstrip("/"))).replace(os.sep, "/")
+
+
+def archive_prefix(archive: str) -> str:
+    """Key prefix of the archive files, e.g. plant_data/."""
+    return f"{archive_key(archive, archive).rstrip('/')}/"
+
+
+def key_location(archive: str, key: str) -> str:
+    """Inverse of archive_key."""
+    if archive.startswith(storage.S3_PREFIX):
+        return f"{storage.S3_PREFIX}{storage.split_s3_uri(archive)[0]}/{key}"
+    return os.path.join(os.path.dirname(archive.rstrip("/")), key)
+
+
+def read_pointer(archive: str) -> dict:
+    """The catalog pointer, or an empty catalog if none has been written."""
+    data = storage.read_bytes(f"{archive}{archive_catalog.CATALOG_POINTER}")
+    return json.loads(data) if data else {"compacted": {}}
+
+
+def daily_files_by_month(archive: str) -> dict:
+    """Keys of the daily archive files, grouped by month."""
+    months = {}
+    for location in storage.list_locations(archive):
+        match = DAILY_FILE.fullmatch(location[len(archive):])
+        if match:
+            months.setdefault(match.group(1), []).append(archive_key(archive, location))
+    return months
+
+
+def months_to_compact(archive: str, pointer: dict, before: str) -> dict:
+    """Months before `before` with daily files that are not yet in a compacted file."""
+    pending = {}
+    for month, keys in daily_files_by_month(archive).items():
+        compacted = pointer["compacted"].get(month, {})
+        if month < before and set(keys) - set(compacted.get("sources", [])):
+            pending[month] = sorted(keys)
+    return pending
+
+
+def is_compacted(key: str) -> bool:
+    """Whether an archive key is a compacted monthly file."""
+    return f"/{archive_catalog.COMPACTED_FOLDER}" in f"/{key}"
+
+
+def recording_range(table: pa.Table) -> list:
+    """First and last recording_at of a table as ISO text, or None if it is empty."""
+    if not table.num_rows:
+        return None
+    bounds = pc.min_max(table["recording_at"])
+    return [archive_catalog.timestamp_text(bounds["min"].as_py()),
+            archive_catalog.timestamp_text(bounds["max"].as_py())]
+
+
+def in_ranges(table: pa.Table, ranges: list) -> pa.ChunkedArray:
+    """Mask of the rows recorded within any of the inclusive [first, last] ranges."""
+    column = table["recording_at"]
+    mask = None
+    for first, last in ranges:
+        within = pc.and_(
+            pc.greater_equal(column, pa.scalar(pd.Timestamp(first), column.type)),
+            pc.less_equal(column, pa.scalar(pd.Timestamp(last), column.type)))
+        mask = within if mask is None else pc.or_(mask, within)
+    return pc.fill_null(mask, False)
+
+
+@metrics.timed("CompactRead")
+def read_sources(archive: str, keys: list, replaced: dict = None) -> tuple:
+    """
+    Read archive files into one table, returning it with the rows the files hold and
+    the recording_at range of each daily file. `replaced` maps daily files rewritten
+    since they were compacted to the range they had then; their rows in that range are
+    dropped from compacted inputs. Without a recorded range, the range of the rewritten
+    file is used.
+    """
+    tables, compacted = [], []
+    ranges = {}
+    expected_rows = 0
+    for key in keys:
+        data = storage.read_bytes(key_location(archive, key))
+        table = pq.read_table(io.BytesIO(data))
+        expected_rows += pq.read_metadata(io.BytesIO(data)).num_rows
+        if is_compacted(key):
+            compacted.append(table)
+        else:
+            ranges[key] = recording_range(table)
+            tables.append(table)
+
+    dropped = [old or ranges[key] for key, old in (replaced or {}).items()]
+    dropped = [bounds for bounds in dropped if bounds]
+    for table in compacted:
+        if dropped:
+            kept = table.filter(pc.invert(in_ranges(table, dropped)))
+            expected_rows -= table.num_rows - kept.num_rows
+            table = kept
+        tables.append(table)
+    metrics.active().count("RowsCompacted", expected_rows)
+    return pa.concat_tables(tables, promote_options="permissive"), expected_rows, ranges
+
+
+@metrics.timed("CompactWrite")
+def write_compacted(table: pa.Table, path: str, key: str, expected_rows: int) -> dict:
+    """Write the monthly file and return its manifest, after checking its row count."""
+    archive_catalog.write_archive(
+        table, path, compression="zstd", compression_level=COMPACTION_ZSTD_LEVEL,
+        row_group_rows=COMPACTION_ROW_GROUP_ROWS,
+        min_row_group_rows=COMPACTION_MIN_ROW_GROUP_ROWS)
+    written_rows = pq.read_metadata(path).num_rows
+    if written_rows != expected_rows:
+        raise ValueError(
+            f"Compacted file has {written_rows} rows, expected {expected_rows}")
+    return archive_catalog.build_manifest(path, key)
+
+
+@metrics.timed("CompactSwap")
+def swap_pointer(archive: str, month: str, entry: dict) -> dict:
+    """Point the catalog at a month's compacted file."""
+    pointer = read_pointer(archive)
+    pointer["compacted"][month] = entry
+    pointer["updated_at"] = datetime.now(timezone.utc).isoformat()
+    storage.write_bytes(f"{archive}{archive_catalog.CATALOG_POINTER}",
+                        json.dumps(pointer, indent=2).encode("utf-8"))
+    return pointer
+
+
+def compact_month(archive: str, month: str, daily_keys: list,
+                  delete_sources: bool = False, replaced_keys: list = ()) -> dict:
+    """
+    Merge a month's daily files, together with the month's current compacted file if
+    any, into a new compacted file, and swap the catalog pointer over to it.
+    `replaced_keys` are daily files rewritten since the month was compacted, such as
+    by a backfill; their rows replace those the compacted file holds from them.
+    """
+    previous = read_pointer(archive)["compacted"].get(month)
+    source_ranges = dict(previous.get("source_ranges", {})) if previous else {}
+    inputs = sorted((set(daily_keys) - set(previous["sources"] if previous else []))
+                    | set(replaced_keys))
+    if previous:
+        inputs.insert(0, previous["key"])
+    table, expected_rows, ranges = read_sources(
+        archive, inputs, {key: source_ranges.get(key) for key in replaced_keys})
+    source_ranges.update(ranges)
+
+    created = datetime.now(timezone.utc)
+    key = (f"{archive_prefix(archive)}{archive_catalog.COMPACTED_FOLDER}"
+           f"{month}-{created:%Y%m%dT%H%M%S%f}.parquet")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "compacted.parquet")
+        manifest = write_compacted(table, path, key, expected_rows)
+        with open(path, "rb") as file:
+            storage.write_bytes(key_location(archive, key), file.read())
+    storage.write_bytes(key_location(archive, archive_catalog.manifest_key(key)),
+                        json.dumps(manifest).encode("utf-8"))
+
+    sources = sorted(set(daily_keys) | set(previous["sources"] if previous else []))
+    swap_pointer(archive, month, {"key": key, "sources": sources, "rows": expected_rows,
+                                  "bytes": manifest["bytes"],
+                                  "created_at": created.isoformat(),
+                                  "source_ranges": source_ranges})
+    logging.info("Compacted %d files of %s into %s (%d rows, %d bytes).",
+                 len(inputs), month, key, expected_rows, manifest["bytes"])
+
+    if delete_sources:
+        for old_key in (old_key for old_key in inputs if old_key != key):
+            storage.delete(key_location(archive, old_key))
+            storage.delete(key_location(archive, archive_catalog.manifest_key(old_key)))
+    return manifest
+
+
+def run_compaction(archive: str = ARCHIVE_LOCATION, months: list = None,
+                   delete_sources: bool = False) -> list:
+    """Compact every complete month with new daily files, or only the given months."""
+    archive = archive if archive.endswith("/") else f"{archive}/"
+    current_month = datetime.now().strftime("%Y-%m")
+    try:
+        if months:
+            pending = {month: keys for month, keys in daily_files_by_month(archive).items()
+                       if month in months}
+        else:
+            pending = months_to_compact(archive, read_pointer(archive), current_month)
+        return [compact_month(archive, month, keys, delete_sources)
+                for month, keys in sorted(pending.items())]
+    except Exception:
+        metrics.active().count("PipelineFailures")
+        raise
+    finally:
+        metrics.active().flush()
+
+
+def main() -> None:
+    """Parse arguments and run the compaction."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--archive", default=ARCHIVE_LOCATION,
+                        help="s3://bucket/prefix/ or a local directory holding the archive.")
+    parser.add_argument("--month", action="append", dest="months",
+                        help="Compact only this month (YYYY-MM), even if already compacted.")
+    parser.add_argument("--delete-sources", action="store_true",
+                        help="Delete the daily files once the pointer has been swapped.")
+    args = parser.parse_args()
+    run_compaction(args.archive, args.months, args.delete_sources)
+
+
+if __name__ == "__main__":
+    main()
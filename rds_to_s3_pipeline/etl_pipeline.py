@@ -4,22 +4,35 @@ ETL Pipeline: Extract, Transform, and Load Plant Data
 This script performs the following steps as part of an ETL pipeline:
 1. Extracts plant data from an RDS database using pymssql.
 2. Transforms the data into a Pandas DataFrame.
-3. Saves the DataFrame as a Parquet file with a timestamped filename.
-4. Uploads the Parquet file to an AWS S3 bucket.
+3. Saves the DataFrame as a Parquet file with a timestamped filename, sorted by plant.
+4. Uploads the Parquet file to an AWS S3 bucket, with a manifest describing it.
+5. Recomputes the dashboard's chart payloads over the archived readings.
 """
 
-# pylint: disable=no-member
+# pylint: disable=no-member,wrong-import-position
 import os
+import sys
+import json
 import logging
 from datetime import datetime, timedelta
 import boto3
 import pymssql
 import pandas as pd
 from dotenv import load_dotenv
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from botocore.exceptions import (BotoCoreError, ClientError, NoCredentialsError,
+                                 PartialCredentialsError)
+
+# Shared modules live in ../pipeline locally and are copied alongside this script in the image
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "pipeline"))
+import archive_catalog
+import chart_payloads
+import metrics
+import profiler
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv()
+metrics.configure("ArchivePipeline")
 
 DB_CONFIG = {
     "host": os.getenv("DB_HOST"),
@@ -70,6 +83,7 @@ def get_db_connection() -> pymssql.Connection:
         raise
 
 
+@metrics.timed("ArchiveRead")
 def load_data_to_dataframe(db_connection: pymssql.Connection) -> pd.DataFrame:
     """Extracts data from the RDS database into a pandas DataFrame."""
 
@@ -86,6 +100,8 @@ def load_data_to_dataframe(db_connection: pymssql.Connection) -> pd.DataFrame:
 
     try:
         dataframe = pd.read_sql(query, db_connection)
+        metrics.active().count("DbRoundTrips")
+        metrics.active().count("RowsArchived", len(dataframe))
         logging.info("Data successfully loaded into DataFrame.")
         return dataframe
     except pymssql.DatabaseError as e:
@@ -93,13 +109,16 @@ def load_data_to_dataframe(db_connection: pymssql.Connection) -> pd.DataFrame:
         raise
 
 
+@metrics.timed("ClearRds")
 def clear_rds(db_connection: pymssql.Connection) -> None:
+    """Empty the recording table once its rows have been archived."""
     query = "TRUNCATE TABLE gamma.recording;"
 
     try:
         with db_connection.cursor() as cursor:
             cursor.execute(query)
             db_connection.commit()
+        metrics.active().count("DbRoundTrips")
         logging.info(
             "The gamma.recording table successfully dropped from the database.")
     except pymssql.DatabaseError as e:
@@ -110,11 +129,12 @@ def clear_rds(db_connection: pymssql.Connection) -> None:
         logging.info("Database connection closed.")
 
 
+@metrics.timed("ArchiveWrite")
 def save_to_parquet(dataframe: pd.DataFrame, file_date: str) -> None:
-    """Save the DataFrame to a Parquet file."""
+    """Save the DataFrame to a Parquet file with a row group per plant."""
     local_file = f"{file_date}.parquet"
     try:
-        dataframe.to_parquet(local_file, engine="pyarrow", index=False)
+        archive_catalog.write_archive(dataframe, local_file)
         logging.info("Data successfully saved to Parquet file: %s", local_file)
         return local_file
     except ValueError as e:
@@ -122,11 +142,15 @@ def save_to_parquet(dataframe: pd.DataFrame, file_date: str) -> None:
         raise
 
 
+@metrics.timed("ArchiveUpload")
 def upload_to_s3(parquet_file: str, bucket: str, s3_key: str) -> None:
     """Uploads a local file to S3."""
     try:
         s3_client = get_aws_client("s3")
         s3_client.upload_file(parquet_file, bucket, s3_key)
+        if metrics.active().enabled:
+            metrics.active().count(
+                "S3BytesWritten", os.path.getsize(parquet_file), "Bytes")
         logging.info(
             "File successfully uploaded to S3 bucket '%s' with key '%s'.", bucket, s3_key
         )
@@ -141,11 +165,53 @@ def upload_to_s3(parquet_file: str, bucket: str, s3_key: str) -> None:
         raise
 
 
+@metrics.timed("ArchiveManifest")
+def upload_manifest(parquet_file: str, bucket: str, s3_key: str) -> dict:
+    """Upload the manifest describing an archive file next to it in S3."""
+    manifest = archive_catalog.build_manifest(parquet_file, s3_key)
+    try:
+        s3_client = get_aws_client("s3")
+        s3_client.put_object(Bucket=bucket, Key=archive_catalog.manifest_key(s3_key),
+                             Body=json.dumps(manifest).encode("utf-8"))
+        logging.info("Manifest for '%s' uploaded with %d plants.",
+                     s3_key, len(manifest["plants"]))
+        return manifest
+    except NoCredentialsError as e:
+        logging.error("AWS credentials not found: %s", e)
+        raise
+    except PartialCredentialsError as e:
+        logging.error("Incomplete AWS credentials: %s", e)
+        raise
+
+
+@metrics.timed("ChartPayloads")
+def refresh_chart_payloads(dataframe: pd.DataFrame) -> None:
+    """Recompute the dashboard's chart payload buckets covered by the archived readings."""
+    if not chart_payloads.PAYLOADS_LOCATION:
+        return
+    try:
+        chart_payloads.recompute(dataframe, chart_payloads.PAYLOADS_LOCATION)
+    except (OSError, ValueError, BotoCoreError, ClientError) as e:
+        logging.error("Could not refresh chart payloads: %s", e)
+
+
+@profiler.profiled("etl_pipeline")
 def run_pipeline():
     '''
     Function that runs the data pipeline from the short term storage (RDS) 
     to the long term storage (S3)
     '''
+    try:
+        archive_rds_to_s3()
+    except Exception:
+        metrics.active().count("PipelineFailures")
+        raise
+    finally:
+        metrics.active().flush()
+
+
+def archive_rds_to_s3():
+    """Archive yesterday's readings from RDS to S3 and clear the recording table."""
     connection = get_db_connection()
     complete_dataframe = load_data_to_dataframe(connection)
 
@@ -158,6 +224,8 @@ def run_pipeline():
                          type(parquet_file)}""")
 
     upload_to_s3(parquet_file, S3_BUCKET, s3_key)
+    upload_manifest(parquet_file, S3_BUCKET, s3_key)
+    refresh_chart_payloads(complete_dataframe)
 
     if os.path.exists(parquet_file):
         os.remove(parquet_file)
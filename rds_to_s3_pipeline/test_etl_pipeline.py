@@ -1,3 +1,6 @@
+import os
+import json
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 from datetime import datetime
@@ -6,8 +9,12 @@ from etl_pipeline import (
     get_db_connection,
     load_data_to_dataframe,
     save_to_parquet,
-    upload_to_s3
+    upload_to_s3,
+    upload_manifest
 )
+import archive_catalog
+import backfill
+import compaction
 
 
 class TestETLPipeline(unittest.TestCase):
@@ -43,14 +50,13 @@ class TestETLPipeline(unittest.TestCase):
 
     def test_save_to_parquet_success(self):
         """Test saving DataFrame to a Parquet file."""
-        dataframe = pd.DataFrame({"column1": [1, 2], "column2": ["a", "b"]})
+        dataframe = pd.DataFrame({"plant_id": [1, 2], "recording_at": [1, 2]})
         file_date = datetime.now().strftime("%Y-%m-%d")
         local_file = f"{file_date}.parquet"
 
-        with patch("etl_pipeline.pd.DataFrame.to_parquet") as mock_to_parquet:
+        with patch("etl_pipeline.archive_catalog.write_archive") as mock_write_archive:
             save_to_parquet(dataframe, file_date)
-            mock_to_parquet.assert_called_once_with(
-                local_file, engine="pyarrow", index=False)
+            mock_write_archive.assert_called_once_with(dataframe, local_file)
 
     @patch("etl_pipeline.boto3.client")
     def test_upload_to_s3_success(self, mock_boto_client):
@@ -66,6 +72,222 @@ class TestETLPipeline(unittest.TestCase):
         mock_s3.upload_file.assert_called_once_with(
             parquet_file, bucket, s3_key)
 
+    @patch("etl_pipeline.boto3.client")
+    def test_upload_manifest(self, mock_boto_client):
+        """Test the manifest is written next to the archive object."""
+        mock_s3 = MagicMock()
+        mock_boto_client.return_value = mock_s3
+        dataframe = pd.DataFrame({
+            "plant_id": [2, 1, 2], "plant_name": ["Cactus", "Lily", "Cactus"],
+            "temperature": [12.0, 13.0, 14.0],
+            "recording_at": pd.to_datetime(["2024-12-01 10:00", "2024-12-01 10:00",
+                                            "2024-12-01 09:00"])})
+
+        with tempfile.TemporaryDirectory() as directory:
+            parquet_file = save_to_parquet(dataframe, os.path.join(directory, "2024-12-01"))
+            manifest = upload_manifest(parquet_file, "bucket", "plant_data/2024-12-01.parquet")
+
+        self.assertEqual(mock_s3.put_object.call_args.kwargs["Key"],
+                         "plant_data/2024-12-01.manifest.json")
+        self.assertEqual(manifest["rows"], 3)
+        self.assertEqual(manifest["plants"]["2"]["rows"], 2)
+        self.assertEqual(manifest["plants"]["2"]["min_recording_at"], "2024-12-01T09:00:00")
+        self.assertEqual(manifest["plants"]["1"]["row_groups"][0]["index"], 0)
+
+
+class TestCompaction(unittest.TestCase):
+    """Tests for compacting daily archive files into monthly files."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.directory.name, "plant_data") + "/"
+        os.makedirs(self.archive)
+        for day in ("2024-11-01", "2024-11-02"):
+            times = pd.date_range(day, periods=24, freq="h")
+            dataframe = pd.DataFrame({
+                "plant_id": [plant_id for _ in times for plant_id in (2, 1)],
+                "plant_name": [name for _ in times for name in ("Fern", "Lily")],
+                "temperature": [12.0] * 48,
+                "recording_at": [time for time in times for _ in range(2)],
+            })
+            path = os.path.join(self.archive, f"{day}.parquet")
+            archive_catalog.write_archive(dataframe, path)
+            with open(archive_catalog.manifest_key(path), "w", encoding="utf-8") as file:
+                json.dump(archive_catalog.build_manifest(
+                    path, f"plant_data/{day}.parquet"), file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compaction_swaps_pointer(self):
+        """The month is merged, sorted and referenced by the catalog pointer."""
+        manifest = compaction.run_compaction(self.archive)[0]
+        pointer = compaction.read_pointer(self.archive)["compacted"]["2024-11"]
+        path = compaction.key_location(self.archive, pointer["key"])
+        table = pd.read_parquet(path)
+
+        self.assertEqual(pointer["rows"], 96)
+        self.assertEqual(pointer["sources"], ["plant_data/2024-11-01.parquet",
+                                              "plant_data/2024-11-02.parquet"])
+        self.assertEqual(table["plant_id"].tolist(), [1] * 48 + [2] * 48)
+        self.assertTrue(table[table["plant_id"] == 1]["recording_at"].is_monotonic_increasing)
+        self.assertEqual(manifest["plants"]["2"]["rows"], 48)
+        self.assertEqual(compaction.run_compaction(self.archive), [])
+
+    def test_late_file_is_merged_into_compacted_month(self):
+        """A daily file arriving after compaction is merged with the compacted file."""
+        compaction.run_compaction(self.archive, delete_sources=True)
+        late = pd.DataFrame({"plant_id": [1], "plant_name": ["Lily"], "temperature": [13.0],
+                             "recording_at": pd.to_datetime(["2024-11-03 10:00"])})
+        archive_catalog.write_archive(late, os.path.join(self.archive, "2024-11-03.parquet"))
+
+        compaction.run_compaction(self.archive, delete_sources=True)
+        pointer = compaction.read_pointer(self.archive)["compacted"]["2024-11"]
+
+        self.assertEqual(pointer["rows"], 97)
+        self.assertEqual(len(pointer["sources"]), 3)
+        self.assertEqual(sorted(os.listdir(self.archive + "monthly")), sorted(
+            os.path.basename(key) for key in
+            (pointer["key"], archive_catalog.manifest_key(pointer["key"]))))
+        self.assertFalse(os.path.exists(os.path.join(self.archive, "2024-11-01.parquet")))
+
+    @patch("compaction.pq.read_metadata")
+    def test_row_count_mismatch_keeps_pointer(self, mock_read_metadata):
+        """A compacted file with the wrong row count is never swapped in."""
+        mock_read_metadata.return_value.num_rows = 1
+        with self.assertRaises(ValueError):
+            compaction.run_compaction(self.archive)
+        self.assertEqual(compaction.read_pointer(self.archive), {"compacted": {}})
+
+
+class TestBackfill(unittest.TestCase):
+    """Tests for replaying archived days."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.directory.name, "plant_data") + "/"
+        self.state = os.path.join(self.directory.name, "state.json")
+        os.makedirs(self.archive)
+        times = pd.date_range("2024-11-01", periods=24, freq="h")
+        self.dataframe = pd.DataFrame({
+            "plant_id": [1] * 24,
+            "plant_name": ["Lily, "] * 24,
+            "soil_moisture": [50.0] * 23 + [150.0],
+            "temperature": [12.0] * 24,
+            "last_watered": times - pd.Timedelta(hours=1),
+            "recording_at": times,
+            "botanist_first_name": ["Carl"] * 24,
+            "botanist_last_name": ["Linnaeus"] * 24,
+            "botanist_email": ["carl@example.com"] * 24,
+            "botanist_phone": ["123"] * 24,
+        })
+        archive_catalog.write_archive(
+            self.dataframe, os.path.join(self.archive, "2024-11-01.parquet"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replay_rewrites_day_and_resumes(self):
+        """A replayed day is cleaned and written back, and is skipped on the next run."""
+        days = backfill.days_between(backfill.parse_day("2024-11-01"),
+                                     backfill.parse_day("2024-11-02"))
+        results = backfill.run_backfill(days, self.archive, "archive", workers=1,
+                                        state_location=self.state)
+        replayed = pd.read_parquet(os.path.join(self.archive, "2024-11-01.parquet"))
+
+        self.assertEqual(results["2024-11-01"]["rows_out"], 23)
+        self.assertEqual(results["2024-11-02"]["status"], "missing")
+        self.assertEqual(replayed["plant_name"].unique().tolist(), ["Lily"])
+        self.assertTrue(os.path.exists(os.path.join(self.archive, "2024-11-01.manifest.json")))
+        self.assertEqual(list(backfill.run_backfill(
+            days, self.archive, "archive", workers=1, state_location=self.state)),
+            ["2024-11-02"])
+
+    def test_replay_day_from_compacted_month(self):
+        """Days whose daily file was compacted away are read from the monthly file."""
+        compaction.run_compaction(self.archive, delete_sources=True)
+
+        with patch("backfill.load.get_db_connection") as mock_connect, \
+                patch("backfill.load.bulk_load_data") as mock_bulk_load:
+            result = backfill.replay_day("2024-11-01", self.archive, "database", replace=True)
+
+        self.assertEqual(result["rows_in"], 24)
+        self.assertEqual(len(mock_bulk_load.call_args.args[1]), 23)
+        mock_connect.return_value.commit.assert_called_once()
+
+    def write_crossing_midnight(self) -> list:
+        """Two daily files that each end with the first minutes of the next day."""
+        days = {"2024-10-01": ["2024-10-01 12:00", "2024-10-02 00:00", "2024-10-02 00:01"],
+                "2024-10-02": ["2024-10-02 00:02", "2024-10-02 12:00",
+                               "2024-10-03 00:00", "2024-10-03 00:01"]}
+        for day, times in days.items():
+            frame = self.dataframe.head(len(times)).assign(
+                soil_moisture=50.0, recording_at=pd.to_datetime(times))
+            archive_catalog.write_archive(frame, os.path.join(self.archive, f"{day}.parquet"))
+        return [time for times in days.values() for time in times]
+
+    def test_recompacted_day_crossing_midnight_keeps_every_reading_once(self):
+        """Replaying a day replaces exactly its file's rows in the compacted month."""
+        os.remove(os.path.join(self.archive, "2024-11-01.parquet"))
+        times = self.write_crossing_midnight()
+        compaction.run_compaction(self.archive)
+
+        backfill.run_backfill(["2024-10-02"], self.archive, "archive", workers=1,
+                              state_location=self.state)
+        pointer = compaction.read_pointer(self.archive)["compacted"]["2024-10"]
+        month = pd.read_parquet(compaction.key_location(self.archive, pointer["key"]))
+
+        self.assertEqual(sorted(month["recording_at"].dt.strftime("%Y-%m-%d %H:%M")), times)
+        replayed = month["recording_at"] >= pd.Timestamp("2024-10-02 00:02")
+        self.assertEqual(month[replayed]["plant_name"].unique().tolist(), ["Lily"])
+        self.assertEqual(month[~replayed]["plant_name"].unique().tolist(), ["Lily, "])
+        self.assertEqual(pointer["rows"], len(times))
+
+    def test_day_read_from_compacted_month_is_its_daily_file(self):
+        """A day read from the monthly file is the rows of its daily file, not its date."""
+        os.remove(os.path.join(self.archive, "2024-11-01.parquet"))
+        self.write_crossing_midnight()
+        compaction.run_compaction(self.archive, delete_sources=True)
+
+        with patch("backfill.load.get_db_connection") as mock_connect, \
+                patch("backfill.load.bulk_load_data") as mock_bulk_load:
+            backfill.replay_day("2024-10-02", self.archive, "database", replace=True)
+
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        self.assertEqual(mock_bulk_load.call_args.args[1]["recording_at"].dt.strftime(
+            "%d %H:%M").tolist(), ["02 00:02", "02 12:00", "03 00:00", "03 00:01"])
+        self.assertEqual(cursor.execute.call_args.args[1],
+                         (datetime(2024, 10, 2, 0, 2), datetime(2024, 10, 3, 0, 1)))
+
+    def test_replaced_day_deletes_every_reading_it_loads(self):
+        """Readings of a daily file past midnight are deleted before they are reloaded."""
+        late = self.dataframe.assign(recording_at=self.dataframe["recording_at"] +
+                                     pd.Timedelta(hours=12))
+        archive_catalog.write_archive(late, os.path.join(self.archive, "2024-11-01.parquet"))
+
+        with patch("backfill.load.get_db_connection") as mock_connect, \
+                patch("backfill.load.bulk_load_data") as mock_bulk_load:
+            backfill.replay_day("2024-11-01", self.archive, "database", replace=True)
+
+        cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        loaded = mock_bulk_load.call_args.args[1]["recording_at"]
+        self.assertEqual(cursor.execute.call_args.args[1],
+                         (datetime(2024, 11, 1, 12), datetime(2024, 11, 2, 11)))
+        self.assertEqual(loaded.max(), pd.Timestamp("2024-11-02 10:00"))
+
+    def test_replayed_day_is_sorted_by_plant(self):
+        """Rewritten files keep the archive's layout, sorted by plant and time."""
+        shuffled = pd.concat([self.dataframe.assign(plant_id=plant_id)
+                              for plant_id in (3, 1, 2)]).sample(frac=1, random_state=1)
+        archive_catalog.write_archive(shuffled, os.path.join(self.archive, "2024-11-01.parquet"))
+
+        backfill.replay_day("2024-11-01", self.archive, "archive", batch_rows=10)
+        replayed = pd.read_parquet(os.path.join(self.archive, "2024-11-01.parquet"))
+
+        self.assertEqual(len(replayed), 69)
+        pd.testing.assert_frame_equal(
+            replayed, replayed.sort_values(["plant_id", "recording_at"], kind="stable"))
+
 
 if __name__ == "__main__":
     unittest.main()
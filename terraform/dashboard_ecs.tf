@@ -37,6 +37,13 @@ resource "aws_iam_policy" "ecs_service_s3_policy" {
           "s3:GetObject"
         ],
         Resource : "arn:aws:s3:::c14-team-growth-storage/*"
+      },
+      {
+        Effect   : "Allow",
+        Action   : [
+          "s3:ListBucket"
+        ],
+        Resource : "arn:aws:s3:::c14-team-growth-storage"
       }
     ]
   })
@@ -59,7 +66,7 @@ resource "aws_ecs_task_definition" "c14_team_growth_dashboard" {
   family                   = "c14-team-growth-dashboard"
   requires_compatibilities = ["FARGATE"]
   network_mode             = "awsvpc"
-  cpu                      = "256"
+  cpu                      = "512"
   memory                   = "1024"
   task_role_arn            = aws_iam_role.ecs_service_role.arn
   execution_role_arn       = data.aws_iam_role.ecs_task_execution_role.arn
@@ -71,6 +78,9 @@ resource "aws_ecs_task_definition" "c14_team_growth_dashboard" {
       cpu         = 256
       memory      = 512
       essential   = true
+      dependsOn   = [
+        { containerName = "c14-team-growth-lmnh-read-api", condition = "START" }
+      ]
       portMappings = [
         {
           containerPort = 8501
@@ -78,12 +88,35 @@ resource "aws_ecs_task_definition" "c14_team_growth_dashboard" {
           protocol      = "tcp"
         }
       ]
+      environment = [
+        { name = "READ_API_URL", value = "http://127.0.0.1:8502" },
+        { name = "READ_API_PUBLIC_URL", value = var.READ_API_PUBLIC_URL }
+      ]
+
+      logConfiguration = {
+        logDriver = "awslogs"
+        options = {
+          awslogs-group         = "/ecs/c14-team-growth-dashboard"
+          awslogs-region        = "eu-west-2"
+          awslogs-stream-prefix = "ecs"
+        }
+      }
+    },
+    {
+      name        = "c14-team-growth-lmnh-read-api"
+      image       = "129033205317.dkr.ecr.eu-west-2.amazonaws.com/c14-team-growth-lmnh-dashboard:latest"
+      cpu         = 256
+      memory      = 448
+      essential   = true
+      entryPoint  = ["python3", "read_api.py"]
       environment = [
         { name = "DB_HOST", value = var.DB_HOST },
         { name = "DB_PORT", value = var.DB_PORT },
         { name = "DB_USER", value = var.DB_USER },
         { name = "SCHEMA_NAME", value = var.SCHEMA_NAME },
         { name = "S3_BUCKET", value = var.S3_BUCKET},
+        { name = "STATS_SNAPSHOT", value = local.stats_snapshot },
+        { name = "CHART_PAYLOADS", value = local.chart_payloads },
         { name = "DB_NAME", value = var.DB_NAME },
         { name = "DB_PASSWORD", value = var.DB_PASSWORD }
       ]
@@ -93,7 +126,7 @@ resource "aws_ecs_task_definition" "c14_team_growth_dashboard" {
         options = {
           awslogs-group         = "/ecs/c14-team-growth-dashboard"
           awslogs-region        = "eu-west-2"
-          awslogs-stream-prefix = "ecs"
+          awslogs-stream-prefix = "read-api"
         }
       }
     }
@@ -38,6 +38,20 @@ resource "aws_iam_policy" "ecs_task_s3_policy" {
           "s3:PutObjectAcl"
         ],
         Resource : "arn:aws:s3:::c14-team-growth-storage/*"
+      },
+      {
+        Effect   : "Allow",
+        Action   : [
+          "s3:GetObject"
+        ],
+        Resource : "arn:aws:s3:::c14-team-growth-storage/chart_payloads/*"
+      },
+      {
+        Effect   : "Allow",
+        Action   : [
+          "s3:ListBucket"
+        ],
+        Resource : "arn:aws:s3:::c14-team-growth-storage"
       }
     ]
   })
@@ -79,6 +93,7 @@ resource "aws_ecs_task_definition" "c14_team_growth_rds_to_s3_etl" {
         { name = "DB_USER", value = var.DB_USER },
         { name = "SCHEMA_NAME", value = var.SCHEMA_NAME },
         { name = "S3_BUCKET", value = var.S3_BUCKET},
+        { name = "CHART_PAYLOADS", value = local.chart_payloads },
         { name = "DB_NAME", value = var.DB_NAME },
         { name = "DB_PASSWORD", value = var.DB_PASSWORD }
       ]
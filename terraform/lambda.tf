@@ -44,6 +44,29 @@ resource "aws_iam_role_policy" "lambda_rds_access" {
   policy = data.aws_iam_policy_document.lambda_rds_access.json
 }
 
+data "aws_iam_policy_document" "lambda_s3_access" {
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject", "s3:PutObject"]
+    resources = [
+      "arn:aws:s3:::${var.S3_BUCKET}/plant_stats/*",
+      "arn:aws:s3:::${var.S3_BUCKET}/chart_payloads/*"
+    ]
+  }
+
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = ["arn:aws:s3:::${var.S3_BUCKET}"]
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_s3_access" {
+  name   = "c14-team-growth-lambda-s3-policy"
+  role   = aws_iam_role.c14_team_growth_lambda_role.id
+  policy = data.aws_iam_policy_document.lambda_s3_access.json
+}
+
 resource "aws_lambda_function" "c14_team_growth_lambda" {
   function_name = "c14-team-growth-lambda"
   role          = aws_iam_role.c14_team_growth_lambda_role.arn
@@ -52,7 +75,10 @@ resource "aws_lambda_function" "c14_team_growth_lambda" {
   memory_size   = 128
   timeout       = 180
   environment {
-    variables = var.environment_variables
+    variables = merge(var.environment_variables, {
+      STATS_SNAPSHOT = local.stats_snapshot
+      CHART_PAYLOADS = local.chart_payloads
+    })
   }
 }
 
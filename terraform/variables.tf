@@ -51,6 +51,19 @@ variable "S3_BUCKET" {
   sensitive = true
 }
 
+variable "READ_API_PUBLIC_URL" {
+  description = "URL of an authenticating load balancer that forwards /export to the read API; leave empty to serve exports through the dashboard"
+  type        = string
+  default     = ""
+}
+
+locals {
+  # Written by the minute pipeline and served by the read API, which must agree on it
+  stats_snapshot = "s3://${var.S3_BUCKET}/plant_stats/snapshot.json"
+  # Updated by the minute pipeline, recomputed by the nightly ETL and served by the read API
+  chart_payloads = "s3://${var.S3_BUCKET}/chart_payloads/payloads.arrow"
+}
+
 variable "environment_variables" {
   description = "List of environment variables for the container"
   type        = map(string)